@@ -4,14 +4,16 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
 
-from db import get_db
+from db import get_db, get_pool_stats, pool_names
+from query_profiler import get_query_log, N_PLUS_ONE_THRESHOLD
+from maintenance import run_maintenance
 from analytics import get_analytics, notify_admin_new_signup, send_reengagement_email
 
 
 def render_admin(user_id):
     render_page_header()
     st.title("🛡️ Admin Panel")
-    tabs_admin = st.tabs(["👤 Users", "🏦 Banks", "📊 Summary"])
+    tabs_admin = st.tabs(["👤 Users", "🏦 Banks", "📊 Summary", "🔌 DB Pool", "🐢 Queries", "🧹 Maintenance"])
     with tabs_admin[0]:
         st.subheader("All Registered Users")
         with get_db() as (conn, cursor):
@@ -62,6 +64,96 @@ def render_admin(user_id):
         c2.metric("🏦 Banks", total_banks)
         c3.metric("🧾 Expenses", total_txns)
         c4.metric("💸 Total Spent", f"₦{total_spent:,}")
+    with tabs_admin[3]:
+        st.subheader("Connection Pool Health")
+        st.caption("Live for this server process — refreshes every 5 seconds.")
+        _fragment = getattr(st, "fragment", None)
+        if _fragment is not None:
+            _fragment(run_every=5)(_render_pool_health)()
+        else:
+            _render_pool_health()
+            st.button("Refresh", key="pool_refresh_btn")
+    with tabs_admin[4]:
+        st.subheader("Query Profile")
+        st.caption(
+            "Recorded for admin sessions, or for everyone when the server runs with "
+            f"DB_QUERY_PROFILING=1. A statement run {N_PLUS_ONE_THRESHOLD}+ times in one "
+            "rerun is flagged as N+1."
+        )
+        _render_query_log()
+    with tabs_admin[5]:
+        st.subheader("Table Maintenance")
+        st.caption(
+            "Deletes expired rate-limit attempts and session tokens in small batches "
+            "and creates upcoming month partitions. Safe to run while users are online; "
+            "also available as `python maintenance.py` for a scheduler."
+        )
+        _render_maintenance()
+
+
+def _render_maintenance():
+    with get_db(readonly=True) as (conn, cursor):
+        cursor.execute("""
+            SELECT relname AS table, GREATEST(reltuples, 0)::BIGINT AS approx_rows
+            FROM pg_class
+            WHERE relname IN ('rate_limit_log', 'session_tokens', 'analytics_logins')
+            ORDER BY relname
+        """)
+        sizes = cursor.fetchall()
+    if sizes:
+        st.dataframe(pd.DataFrame(sizes), hide_index=True, use_container_width=True)
+
+    if st.button("Run maintenance now", key="maint_run_btn"):
+        with st.spinner("Pruning…"):
+            st.session_state.maint_last_report = run_maintenance()
+    report = st.session_state.get("maint_last_report")
+    if report:
+        reclaimed = sum(v for k, v in report.items() if k not in ("partitions_created", "elapsed_s"))
+        st.success(
+            f"Reclaimed {reclaimed:,} row(s) in {report['elapsed_s']}s — "
+            f"rate_limit_log {report['rate_limit_log']:,}, "
+            f"session_tokens {report['session_tokens']:,}, "
+            f"partitions created {report['partitions_created']}."
+        )
+
+
+def _render_pool_health():
+    for name in pool_names():
+        st.markdown(f"#### {name.title()} pool")
+        _render_one_pool(get_pool_stats(name))
+
+
+def _render_one_pool(stats):
+    c1, c2, c3, c4, c5 = st.columns(5)
+    c1.metric("In use",      f"{stats['in_use']} / {stats['maxconn']}")
+    c2.metric("Idle",        stats["idle"])
+    c3.metric("Waiting",     stats["waiting"])
+    c4.metric("Checkouts",   stats["checkouts"])
+    c5.metric("Exhaustions", stats["exhaustions"])
+
+    df_t = pd.DataFrame(
+        [("Checkout wait", *stats["wait_ms"].values()),
+         ("Connection hold", *stats["hold_ms"].values()),
+         ("get_db() block", *stats["block_ms"].values())],
+        columns=["Timing (ms)", "p50", "p95", "max"],
+    )
+    st.dataframe(df_t, use_container_width=True, hide_index=True)
+    st.caption(f"{stats['blocks']:,} blocks since {stats['started_at']:%Y-%m-%d %H:%M} "
+               f"· checkout timeout {stats['timeout_s']:g}s")
+
+    st.markdown("**Current holders**")
+    if stats["holders"]:
+        df_h = pd.DataFrame(stats["holders"])
+        df_h.columns = ["Checked out at", "Current block", "Held (s)"]
+        st.dataframe(df_h, use_container_width=True, hide_index=True)
+    else:
+        st.info("No connections checked out.")
+
+    if stats["events"]:
+        st.markdown("**Recent exhaustion events**")
+        df_e = pd.DataFrame(stats["events"])
+        df_e.columns = ["When", "Call site", "Error"]
+        st.dataframe(df_e, use_container_width=True, hide_index=True)
 
 
 def render_analytics(user_id):
@@ -130,3 +222,27 @@ def render_analytics(user_id):
                 st.success("No inactive users right now - everyone's engaged!")
     
     # ================= PAGE: DASHBOARD =================
+
+
+def _render_query_log():
+    log = get_query_log()
+    if not log["runs"]:
+        st.info("No profiled reruns yet.")
+        return
+
+    st.markdown("**Recent reruns**")
+    df_r = pd.DataFrame([
+        (r["at"], r["page"], r["queries"], r["total_ms"], r["rows"],
+         "; ".join(f"{c}× {fp[:60]}" for fp, c, _ms in r["n_plus_one"]) or "—")
+        for r in log["runs"]
+    ], columns=["When", "Page", "Queries", "DB ms", "Rows", "N+1 suspects"])
+    st.dataframe(df_r, use_container_width=True, hide_index=True)
+
+    by_page = df_r.groupby("Page").agg(
+        reruns=("Queries", "size"), avg_queries=("Queries", "mean"), avg_db_ms=("DB ms", "mean"),
+    ).sort_values("avg_db_ms", ascending=False).round(1).reset_index()
+    st.markdown("**Slowest pages**")
+    st.dataframe(by_page, use_container_width=True, hide_index=True)
+
+    st.markdown("**Top statements by total time**")
+    st.dataframe(pd.DataFrame(log["fingerprints"][:50]), use_container_width=True, hide_index=True)
@@ -6,7 +6,7 @@ import plotly.express as px
 from datetime import datetime, timedelta
 
 from db import get_db
-from utils import save_expense, apply_income_filters, apply_expense_filters, \
+from utils import save_expense, \
     render_filter_bar_income, render_filter_bar_expenses, \
     get_category_budgets, compute_daily_safe_to_spend, BUDGET_CATEGORIES, upsert_category_budget
 from auth import validate_password, change_password, get_onboarding_status, mark_onboarding_complete
@@ -8,7 +8,9 @@ import plotly.express as px
 from datetime import datetime, timedelta
 
 from db import get_db
-from utils import save_expense, apply_income_filters, apply_expense_filters, \
+from snapshots import daily_source
+from cache_versions import DATA, DATA_CACHE_TTL, DATA_CACHE_ENTRIES, get_version
+from utils import save_expense, \
     render_filter_bar_income, render_filter_bar_expenses, \
     get_category_budgets, compute_daily_safe_to_spend, BUDGET_CATEGORIES, upsert_category_budget
 from auth import validate_password, change_password, get_onboarding_status, mark_onboarding_complete
@@ -24,15 +26,16 @@ _STAT_CARD_CSS = ""  # kept as variable for backward compat but empty
 def _fetch_stat_cards_data(user_id: int) -> dict:
     """
     Run all stat card queries in a single DB round-trip.
-    OPTIMIZED: result cached for 2 minutes via _fetch_stat_cards_data_cached.
+    OPTIMIZED: cached per data version via _fetch_stat_cards_data_cached.
     """
     # Use date string as cache key — auto-invalidates at midnight
-    return _fetch_stat_cards_data_cached(user_id, datetime.now().date().isoformat())
+    return _fetch_stat_cards_data_cached(user_id, get_version(user_id, DATA),
+                                         datetime.now().date().isoformat())
 
 
-@st.cache_data(ttl=120, show_spinner=False)
-def _fetch_stat_cards_data_cached(user_id: int, _date_key: str) -> dict:
-    """Cached inner function — _date_key forces daily invalidation."""
+@st.cache_data(ttl=DATA_CACHE_TTL, max_entries=DATA_CACHE_ENTRIES, show_spinner=False)
+def _fetch_stat_cards_data_cached(user_id: int, version: int, date_key: str) -> dict:
+    """Cached inner function — date_key forces daily invalidation."""
     today       = datetime.now().date()
     month_start = today.replace(day=1)
     week_start  = today - timedelta(days=today.weekday())
@@ -53,11 +56,10 @@ def _fetch_stat_cards_data_cached(user_id: int, _date_key: str) -> dict:
 
         # 2. Highest spending category this month
         cursor.execute("""
-            SELECT COALESCE(e.category, e.name) AS cat, SUM(e.amount) AS total
-            FROM expenses e
-            JOIN banks b ON e.bank_id = b.id
-            WHERE b.user_id = %s AND e.created_at >= %s
-            GROUP BY cat ORDER BY total DESC LIMIT 1
+            SELECT category AS cat, spent AS total
+            FROM user_month_category_totals
+            WHERE user_id = %s AND month = %s
+            ORDER BY spent DESC LIMIT 1
         """, (user_id, month_start))
         top_cat_month = cursor.fetchone()
 
@@ -67,8 +69,7 @@ def _fetch_stat_cards_data_cached(user_id: int, _date_key: str) -> dict:
                 COALESCE(SUM(CASE WHEN t.type='credit' THEN t.amount ELSE 0 END), 0) AS income,
                 COALESCE(SUM(CASE WHEN t.type='debit'  THEN t.amount ELSE 0 END), 0) AS spent
             FROM transactions t
-            JOIN banks b ON t.bank_id = b.id
-            WHERE b.user_id = %s AND t.created_at >= %s
+            WHERE t.user_id = %s AND t.created_at >= %s
         """, (user_id, month_start))
         month_totals = cursor.fetchone()
         m_income = int(month_totals["income"] or 0)
@@ -79,7 +80,7 @@ def _fetch_stat_cards_data_cached(user_id: int, _date_key: str) -> dict:
             SELECT b.bank_name, COUNT(*) AS cnt
             FROM transactions t
             JOIN banks b ON t.bank_id = b.id
-            WHERE b.user_id = %s AND t.created_at >= %s AND t.type = 'debit'
+            WHERE t.user_id = %s AND t.created_at >= %s AND t.type = 'debit'
             GROUP BY b.bank_name ORDER BY cnt DESC LIMIT 1
         """, (user_id, month_start))
         most_used_bank = cursor.fetchone()
@@ -99,8 +100,7 @@ def _fetch_stat_cards_data_cached(user_id: int, _date_key: str) -> dict:
         cursor.execute("""
             SELECT COALESCE(SUM(t.amount), 0) AS total
             FROM transactions t
-            JOIN banks b ON t.bank_id = b.id
-            WHERE b.user_id = %s AND t.type = 'debit'
+            WHERE t.user_id = %s AND t.type = 'debit'
               AND t.created_at >= %s AND t.created_at <= %s
         """, (user_id, last_month_start, last_month_end))
         last_month_spent = int(cursor.fetchone()["total"] or 0)
@@ -330,17 +330,17 @@ def _render_stat_cards(data: dict):
 def _fetch_smart_suggestions(user_id: int, spending_limit: int, expenses_this_month: int) -> list:
     """
     Run all suggestion queries in one DB connection, return sorted list.
-    OPTIMIZED: cached for 2 minutes — 16-query function, no need to re-run on every widget click.
+    OPTIMIZED: cached per data version — 16-query function, re-runs only after a write.
     """
     return _fetch_smart_suggestions_cached(
-        user_id, spending_limit, expenses_this_month,
+        user_id, get_version(user_id, DATA), spending_limit, expenses_this_month,
         datetime.now().date().isoformat()
     )
 
 
-@st.cache_data(ttl=120, show_spinner=False)
-def _fetch_smart_suggestions_cached(user_id: int, spending_limit: int,
-                                     expenses_this_month: int, _date_key: str) -> list:
+@st.cache_data(ttl=DATA_CACHE_TTL, max_entries=DATA_CACHE_ENTRIES, show_spinner=False)
+def _fetch_smart_suggestions_cached(user_id: int, version: int, spending_limit: int,
+                                     expenses_this_month: int, date_key: str) -> list:
     """Cached inner function."""
     # OPTIMIZED: use module-level `calendar` import
     today            = datetime.now().date()
@@ -358,13 +358,13 @@ def _fetch_smart_suggestions_cached(user_id: int, spending_limit: int,
 
         # ── A. Category totals this month vs last month ───────────────────────
         cursor.execute("""
-            SELECT COALESCE(e.category, e.name) AS cat,
-                   SUM(CASE WHEN e.created_at >= %s THEN e.amount ELSE 0 END)              AS this_month,
-                   SUM(CASE WHEN e.created_at >= %s AND e.created_at <= %s THEN e.amount ELSE 0 END) AS last_month
-            FROM expenses e JOIN banks b ON e.bank_id = b.id
-            WHERE b.user_id = %s AND e.created_at >= %s
-            GROUP BY cat
-        """, (month_start, last_month_start, last_month_end, user_id, last_month_start))
+            SELECT category AS cat,
+                   SUM(CASE WHEN month = %s THEN spent ELSE 0 END) AS this_month,
+                   SUM(CASE WHEN month = %s THEN spent ELSE 0 END) AS last_month
+            FROM user_month_category_totals
+            WHERE user_id = %s AND month IN (%s, %s)
+            GROUP BY category
+        """, (month_start, last_month_start, user_id, month_start, last_month_start))
         cat_rows = cursor.fetchall()
 
         # ── B. Small purchases ────────────────────────────────────────────────
@@ -413,16 +413,16 @@ def _fetch_smart_suggestions_cached(user_id: int, spending_limit: int,
         # ── F. Income this month ──────────────────────────────────────────────
         cursor.execute("""
             SELECT COALESCE(SUM(t.amount), 0) AS total
-            FROM transactions t JOIN banks b ON t.bank_id = b.id
-            WHERE b.user_id = %s AND t.type = 'credit' AND t.created_at >= %s
+            FROM transactions t
+            WHERE t.user_id = %s AND t.type = 'credit' AND t.created_at >= %s
         """, (user_id, month_start))
         income_this_month = int(cursor.fetchone()["total"] or 0)
 
         # ── G. Last month total spent ─────────────────────────────────────────
         cursor.execute("""
             SELECT COALESCE(SUM(t.amount), 0) AS total
-            FROM transactions t JOIN banks b ON t.bank_id = b.id
-            WHERE b.user_id = %s AND t.type = 'debit'
+            FROM transactions t
+            WHERE t.user_id = %s AND t.type = 'debit'
               AND t.created_at >= %s AND t.created_at <= %s
         """, (user_id, last_month_start, last_month_end))
         last_month_total = int(cursor.fetchone()["total"] or 0)
@@ -456,17 +456,15 @@ def _fetch_smart_suggestions_cached(user_id: int, spending_limit: int,
 
         # ── K. Category budgets: overspent ───────────────────────────────────
         cursor.execute("""
-            SELECT cb.category, cb.monthly_limit,
-                   COALESCE(SUM(e.amount), 0) AS spent
+            SELECT cb.category, cb.monthly_limit, r.spent
             FROM category_budgets cb
-            LEFT JOIN expenses e
-                ON COALESCE(e.category, e.name) = cb.category
-               AND e.user_id = cb.user_id
-               AND e.created_at >= %s
+            JOIN user_month_category_totals r
+                ON r.user_id = cb.user_id
+               AND r.month = %s
+               AND r.category = cb.category
             WHERE cb.user_id = %s AND cb.monthly_limit > 0
-            GROUP BY cb.category, cb.monthly_limit
-            HAVING COALESCE(SUM(e.amount), 0) > cb.monthly_limit
-            ORDER BY (COALESCE(SUM(e.amount), 0) - cb.monthly_limit) DESC LIMIT 2
+              AND r.spent > cb.monthly_limit
+            ORDER BY (r.spent - cb.monthly_limit) DESC LIMIT 2
         """, (month_start, user_id))
         overbudget_cats = cursor.fetchall()
 
@@ -878,17 +876,18 @@ def _render_smart_suggestions(suggestions: list):
 
 # ─────────────────────────────────────────────────────────────────────────────
 # DAILY MONEY SUMMARY
-# Single SQL round-trip via CTEs. Cached 60 s per user per day.
+# Single SQL round-trip via CTEs. Cached per user per data version per day.
 # No schema changes — derived entirely from transactions + expenses + banks.
 # ─────────────────────────────────────────────────────────────────────────────
 
 def _fetch_daily_summary(user_id: int) -> dict:
     """Public wrapper — passes today's date as cache-buster."""
-    return _fetch_daily_summary_cached(user_id, datetime.now().date().isoformat())
+    return _fetch_daily_summary_cached(user_id, get_version(user_id, DATA),
+                                       datetime.now().date().isoformat())
 
 
-@st.cache_data(ttl=60, show_spinner=False)
-def _fetch_daily_summary_cached(user_id: int, _today_key: str) -> dict:
+@st.cache_data(ttl=DATA_CACHE_TTL, max_entries=DATA_CACHE_ENTRIES, show_spinner=False)
+def _fetch_daily_summary_cached(user_id: int, version: int, today_key: str) -> dict:
     """
     One DB round-trip via CTEs:
     - today_txn   → income_today, spent_today, txn_count_today
@@ -909,14 +908,12 @@ def _fetch_daily_summary_cached(user_id: int, _today_key: str) -> dict:
                     COALESCE(SUM(CASE WHEN t.type='debit'  THEN t.amount ELSE 0 END), 0) AS spent_today,
                     COUNT(*) AS txn_count
                 FROM transactions t
-                JOIN banks b ON t.bank_id = b.id
-                WHERE b.user_id = %(uid)s AND t.created_at = %(today)s
+                WHERE t.user_id = %(uid)s AND t.created_at = %(today)s
             ),
             yesterday_txn AS (
                 SELECT COALESCE(SUM(CASE WHEN t.type='debit' THEN t.amount ELSE 0 END), 0) AS spent_yesterday
                 FROM transactions t
-                JOIN banks b ON t.bank_id = b.id
-                WHERE b.user_id = %(uid)s AND t.created_at = %(yesterday)s
+                WHERE t.user_id = %(uid)s AND t.created_at = %(yesterday)s
             ),
             top_expense AS (
                 SELECT e.name, e.category, e.amount
@@ -928,8 +925,7 @@ def _fetch_daily_summary_cached(user_id: int, _today_key: str) -> dict:
             top_income AS (
                 SELECT t.description, t.amount
                 FROM transactions t
-                JOIN banks b ON t.bank_id = b.id
-                WHERE b.user_id = %(uid)s AND t.type = 'credit'
+                WHERE t.user_id = %(uid)s AND t.type = 'credit'
                   AND t.created_at = %(today)s
                 ORDER BY t.amount DESC LIMIT 1
             ),
@@ -1187,8 +1183,7 @@ def render_dashboard(user_id, pages):
         current_month_start = datetime.now().date().replace(day=1)
         cursor.execute("""
             SELECT COALESCE(SUM(t.amount),0) AS n FROM transactions t
-            JOIN banks b ON t.bank_id = b.id
-            WHERE b.user_id=%s AND t.type='debit'
+            WHERE t.user_id=%s AND t.type='debit'
               AND t.created_at >= %s
         """, (user_id, current_month_start))
         expenses_this_month = cursor.fetchone()["n"]
@@ -1196,7 +1191,7 @@ def render_dashboard(user_id, pages):
         num_banks = cursor.fetchone()["n"]
         cursor.execute("""
             SELECT COALESCE(SUM(CASE WHEN type='credit' THEN amount ELSE -amount END),0) AS n
-            FROM transactions t JOIN banks b ON t.bank_id = b.id WHERE b.user_id=%s
+            FROM transactions t WHERE t.user_id=%s
         """, (user_id,))
         net_savings = cursor.fetchone()["n"]
         cursor.execute("SELECT monthly_spending_limit FROM users WHERE id=%s", (user_id,))
@@ -1299,7 +1294,7 @@ def render_dashboard(user_id, pages):
     _days_elapsed    = _today_dash.day
     _days_remaining  = _days_in_month - _today_dash.day + 1   # include today
 
-    with get_db() as (conn, cursor):
+    with get_db(readonly=True) as (conn, cursor):
         cursor.execute(
             "SELECT category, monthly_limit FROM category_budgets WHERE user_id=%s AND monthly_limit > 0 ORDER BY category",
             (user_id,)
@@ -1310,12 +1305,9 @@ def render_dashboard(user_id, pages):
             # Fetch actual spend per budgeted category this month
             budgeted_cats = [b["category"] for b in cat_budgets]
             cursor.execute("""
-                SELECT COALESCE(e.category, e.name) AS cat, COALESCE(SUM(e.amount), 0) AS spent
-                FROM expenses e JOIN banks b ON e.bank_id = b.id
-                WHERE b.user_id = %s
-                  AND e.created_at >= %s
-                  AND COALESCE(e.category, e.name) = ANY(%s)
-                GROUP BY cat
+                SELECT category AS cat, spent
+                FROM user_month_category_totals
+                WHERE user_id = %s AND month = %s AND category = ANY(%s)
             """, (user_id, _month_start_dash, budgeted_cats))
             cat_spent_rows = {r["cat"]: int(r["spent"]) for r in cursor.fetchall()}
 
@@ -1431,12 +1423,12 @@ def render_dashboard(user_id, pages):
     week_start = datetime.now().date() - timedelta(days=datetime.now().weekday())
     week_end   = datetime.now().date()
 
-    with get_db() as (conn, cursor):
+    with get_db(readonly=True) as (conn, cursor):
         cursor.execute("""
             SELECT COALESCE(SUM(CASE WHEN t.type='credit' THEN t.amount ELSE 0 END), 0) AS income,
                    COALESCE(SUM(CASE WHEN t.type='debit'  THEN t.amount ELSE 0 END), 0) AS spent
-            FROM transactions t JOIN banks b ON t.bank_id = b.id
-            WHERE b.user_id = %s AND t.created_at >= %s
+            FROM transactions t
+            WHERE t.user_id = %s AND t.created_at >= %s
         """, (user_id, week_start))
         week_totals = cursor.fetchone()
 
@@ -1664,7 +1656,7 @@ def render_dashboard(user_id, pages):
                 calendar.monthrange(_csv_sel[0], _csv_sel[1])[1]
             ).date()
             _csv_label = _r_start.strftime("%B %Y")
-            with get_db() as (conn, cursor):
+            with get_db(readonly=True) as (conn, cursor):
                 cursor.execute("""
                     SELECT e.created_at, e.category, b.bank_name, e.amount
                     FROM expenses e JOIN banks b ON e.bank_id=b.id
@@ -1677,15 +1669,15 @@ def render_dashboard(user_id, pages):
                            CASE WHEN t.type='credit' THEN 'Income' ELSE 'Expense' END AS txn_type,
                            t.description, b.bank_name, t.amount
                     FROM transactions t JOIN banks b ON t.bank_id=b.id
-                    WHERE b.user_id=%s AND t.created_at>=%s AND t.created_at<=%s
+                    WHERE t.user_id=%s AND t.created_at>=%s AND t.created_at<=%s
                     ORDER BY t.created_at
                 """, (user_id, _r_start, _r_end))
                 _txn_rows = cursor.fetchall()
                 cursor.execute("""
                     SELECT COALESCE(SUM(CASE WHEN t.type='credit' THEN t.amount ELSE 0 END),0) AS ti,
                            COALESCE(SUM(CASE WHEN t.type='debit'  THEN t.amount ELSE 0 END),0) AS ts
-                    FROM transactions t JOIN banks b ON t.bank_id=b.id
-                    WHERE b.user_id=%s AND t.created_at>=%s AND t.created_at<=%s
+                    FROM transactions t
+                    WHERE t.user_id=%s AND t.created_at>=%s AND t.created_at<=%s
                 """, (user_id, _r_start, _r_end))
                 _sr = cursor.fetchone()
             _ti = int(_sr["ti"] or 0)
@@ -1718,20 +1710,23 @@ def render_dashboard(user_id, pages):
         }
         selected_period = st.selectbox("Select Period", list(period_map.keys()), key="period_select")
         start_date = (datetime.now() - period_map[selected_period]).date() if period_map[selected_period] else datetime(2000,1,1).date()
-        with get_db() as (conn, cursor):
-            cursor.execute("""
-                SELECT t.created_at, t.type, t.amount FROM transactions t
-                JOIN banks b ON t.bank_id = b.id
-                WHERE b.user_id=%s AND t.created_at >= %s ORDER BY t.created_at
+        src = daily_source()
+        with get_db(readonly=True) as (conn, cursor):
+            # OPTIMIZED: one pre-aggregated snapshot row per bank-day instead of every transaction
+            cursor.execute(f"""
+                SELECT day, SUM(credit) AS credit, SUM(debit) AS debit
+                FROM {src}
+                WHERE user_id=%s AND day >= %s AND txn_count > 0
+                GROUP BY day ORDER BY day
             """, (user_id, start_date))
             rows = cursor.fetchall()
         if rows:
-            df = pd.DataFrame([(r["created_at"], r["type"], r["amount"]) for r in rows], columns=["date","type","amount"])
-            df["date"] = pd.to_datetime(df["date"])
-            df_pivot = df.pivot_table(index="date", columns="type", values="amount", aggfunc="sum", fill_value=0)
-            for col in ["credit","debit"]:
-                if col not in df_pivot.columns: df_pivot[col] = 0
-            df_pivot = df_pivot.rename(columns={"credit":"Income","debit":"Expenses"}).sort_index()
+            df_pivot = pd.DataFrame(
+                [(r["day"], int(r["credit"]), int(r["debit"])) for r in rows],
+                columns=["date", "Income", "Expenses"]
+            )
+            df_pivot["date"] = pd.to_datetime(df_pivot["date"])
+            df_pivot = df_pivot.set_index("date")
             # OPTIMIZED: single Plotly chart replaces duplicate line_chart + bar_chart
             fig_txn = px.bar(df_pivot.reset_index(), x="date", y=["Income","Expenses"],
                              barmode="group",
@@ -1751,11 +1746,11 @@ def render_dashboard(user_id, pages):
             """, unsafe_allow_html=True)
 
     with st.expander("🥧 Expense Breakdown by Category", expanded=False):
-        with get_db() as (conn, cursor):
+        with get_db(readonly=True) as (conn, cursor):
             cursor.execute("""
-                SELECT COALESCE(category, name) AS cat, SUM(amount) AS total
-                FROM expenses WHERE user_id = %s
-                GROUP BY COALESCE(category, name) ORDER BY total DESC
+                SELECT category AS cat, SUM(spent) AS total
+                FROM user_month_category_totals WHERE user_id = %s
+                GROUP BY category ORDER BY total DESC
             """, (user_id,))
             pie_rows = cursor.fetchall()
         if pie_rows:
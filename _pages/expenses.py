@@ -6,7 +6,8 @@ import plotly.express as px
 from datetime import datetime, timedelta
 
 from db import get_db
-from utils import save_expense, apply_income_filters, apply_expense_filters, \
+from cache_versions import DATA, bump
+from utils import save_expense, fetch_history_page, render_history_pager, get_expense_category_totals, \
     render_filter_bar_income, render_filter_bar_expenses, \
     get_category_budgets, compute_daily_safe_to_spend, BUDGET_CATEGORIES, upsert_category_budget
 from auth import validate_password, change_password, get_onboarding_status, mark_onboarding_complete
@@ -44,7 +45,7 @@ def render_expenses(user_id, pages):
                     cursor.execute("UPDATE expenses SET name=%s, category=%s, amount=%s WHERE id=%s AND user_id=%s",
                                    (new_name, new_category, new_amount, edit_id, user_id))
                 st.success("Expense updated!")
-                st.cache_data.clear()
+                bump(user_id, DATA)
                 st.session_state.edit_exp_id = None
                 st.rerun()
             if cancel_clicked:
@@ -173,7 +174,7 @@ def render_expenses(user_id, pages):
             ok, result = save_expense(user_id, bank_id, expense_name, int(expense_amount), category=category)
             if ok:
                 st.success(f"'{expense_name}' ({category}) — ₦{int(expense_amount):,} added.")
-                st.cache_data.clear()
+                bump(user_id, DATA)
                 st.session_state.quick_add_name = ""
                 st.rerun()
             else:
@@ -183,33 +184,22 @@ def render_expenses(user_id, pages):
 
     st.divider()
     st.subheader("Expense Summary")
-    with get_db() as (conn, cursor):
-        cursor.execute("""
-            SELECT e.id, e.created_at, e.name, e.category, e.amount,
-                   e.bank_id, b.bank_name, b.account_number, e.tx_id
-            FROM expenses e JOIN banks b ON e.bank_id = b.id
-            WHERE e.user_id=%s ORDER BY e.created_at DESC
-        """, (user_id,))
-        expenses_data = cursor.fetchall()
-
-    if expenses_data:
-        all_expense_categories = sorted(set(
-            (e["category"] or e["name"]) for e in expenses_data if (e["category"] or e["name"])
-        ))
+    # OPTIMIZED: filters, sort, totals and paging run in SQL — one page of rows per rerun
+    category_totals = get_expense_category_totals(user_id)
 
-        render_filter_bar_expenses(banks, all_expense_categories)
-        filtered_expenses = apply_expense_filters(expenses_data)
+    if category_totals:
+        render_filter_bar_expenses(banks, [c for c, _ in category_totals])
+        page = fetch_history_page("expenses", user_id)
 
-        total_shown = sum(e["amount"] for e in filtered_expenses)
-        if len(filtered_expenses) != len(expenses_data):
-            st.caption(f"Showing {len(filtered_expenses)} of {len(expenses_data)} entries — ₦{total_shown:,} total")
+        if page["count"] != page["count_all"]:
+            st.caption(f"Showing {page['count']} of {page['count_all']} entries — ₦{page['total']:,} total")
         else:
-            st.caption(f"{len(expenses_data)} entries — ₦{total_shown:,} total")
+            st.caption(f"{page['count_all']} entries — ₦{page['total']:,} total")
 
-        if not filtered_expenses:
+        if not page["rows"]:
             st.info("No expenses match your search or filters.")
         else:
-            for exp in filtered_expenses:
+            for exp in page["rows"]:
                 card_col, edit_col, del_col = st.columns([5, 0.5, 0.5])
                 cat_display = exp['category'] if exp.get('category') and exp['category'] != exp['name'] else ""
                 with card_col:
@@ -252,13 +242,11 @@ def render_expenses(user_id, pages):
                             st.session_state.confirm_delete[del_key] = True
                             st.rerun()
 
+            render_history_pager("expenses", page)
+
         st.divider()
         st.subheader("Your Expense Breakdown")
-        df_exp_pie = pd.DataFrame(
-            [(e["category"] or e["name"], e["amount"]) for e in expenses_data],
-            columns=["Category", "Amount"]
-        )
-        df_grouped = df_exp_pie.groupby("Category", as_index=False)["Amount"].sum().sort_values("Amount", ascending=False)
+        df_grouped = pd.DataFrame(category_totals, columns=["Category", "Amount"])
         threshold = df_grouped["Amount"].sum() * 0.02
         df_main   = df_grouped[df_grouped["Amount"] >= threshold]
         df_other  = df_grouped[df_grouped["Amount"] < threshold]
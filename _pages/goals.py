@@ -164,9 +164,9 @@ def render_goals(user_id, pages):
                                         (amt, bank_id)
                                     )
                                     cursor.execute(
-                                        "INSERT INTO transactions (bank_id, type, amount, description, created_at) "
-                                        "VALUES (%s, 'debit', %s, %s, %s)",
-                                        (bank_id, amt, f"Savings goal: {g['name']}", today)
+                                        "INSERT INTO transactions (user_id, bank_id, type, amount, description, created_at) "
+                                        "VALUES (%s, %s, 'debit', %s, %s, %s)",
+                                        (user_id, bank_id, amt, f"Savings goal: {g['name']}", today)
                                     )
                                     # Record in goal_contributions history table
                                     cursor.execute(
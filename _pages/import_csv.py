@@ -2,7 +2,7 @@ from styles import render_page_header
 # import_csv.py — CSV import page
 import streamlit as st
 
-from db import get_db, get_connection
+from db import get_db, get_connection, _return_connection
 from csv_import import csv_import_page
 
 
@@ -42,4 +42,4 @@ def render_import_csv(user_id, pages):
         try:
             csv_import_page(conn_csv, user_id)
         finally:
-            conn_csv.close()
+            _return_connection(conn_csv)
@@ -6,7 +6,8 @@ import plotly.express as px
 from datetime import datetime, timedelta
 
 from db import get_db
-from utils import save_expense, apply_income_filters, apply_expense_filters, \
+from cache_versions import DATA, bump
+from utils import save_expense, fetch_history_page, render_history_pager, has_income_history, \
     render_filter_bar_income, render_filter_bar_expenses, \
     get_category_budgets, compute_daily_safe_to_spend, BUDGET_CATEGORIES, upsert_category_budget
 from auth import validate_password, change_password, get_onboarding_status, mark_onboarding_complete
@@ -41,8 +42,7 @@ def render_income(user_id):
         with get_db() as (conn, cursor):
             cursor.execute("""
                 SELECT t.id, t.description, t.amount, t.bank_id FROM transactions t
-                JOIN banks b ON t.bank_id = b.id
-                WHERE t.id=%s AND b.user_id=%s AND t.type='credit'
+                WHERE t.id=%s AND t.user_id=%s AND t.type='credit'
             """, (edit_id, user_id))
             inc_row = cursor.fetchone()
         if inc_row:
@@ -61,7 +61,7 @@ def render_income(user_id):
                     cursor.execute("UPDATE transactions SET amount=%s, description=%s WHERE id=%s",
                                    (new_amount, f"Income: {new_source}", inc_row["id"]))
                 st.success("Income updated!")
-                st.cache_data.clear()
+                bump(user_id, DATA)
                 st.session_state.edit_income_id = None
                 st.rerun()
             if cancel_clicked:
@@ -86,10 +86,10 @@ def render_income(user_id):
                     bank_id = bank_map_income[selected_bank_income]
                     with get_db() as (conn, cursor):
                         cursor.execute("UPDATE banks SET balance = balance + %s WHERE id=%s", (income_amount, bank_id))
-                        cursor.execute("INSERT INTO transactions (bank_id, type, amount, description, created_at) VALUES (%s, 'credit', %s, %s, %s)",
-                                       (bank_id, income_amount, f"Income: {income_source}", inc_date))
+                        cursor.execute("INSERT INTO transactions (user_id, bank_id, type, amount, description, created_at) VALUES (%s, %s, 'credit', %s, %s, %s)",
+                                       (user_id, bank_id, income_amount, f"Income: {income_source}", inc_date))
                     st.success(f"₦{income_amount:,} income recorded!")
-                    st.cache_data.clear()
+                    bump(user_id, DATA)
                     st.rerun()
                 else:
                     st.warning("Please enter a source and amount.")
@@ -98,26 +98,17 @@ def render_income(user_id):
 
     st.divider()
     st.subheader("Income History")
-    with get_db() as (conn, cursor):
-        cursor.execute("""
-            SELECT t.id, t.created_at, t.description, t.amount, t.bank_id, b.bank_name, b.account_number
-            FROM transactions t JOIN banks b ON t.bank_id = b.id
-            WHERE b.user_id=%s AND t.type='credit' AND t.description LIKE 'Income:%%'
-            ORDER BY t.created_at DESC
-        """, (user_id,))
-        income_data = cursor.fetchall()
-
-    if income_data:
+    # OPTIMIZED: filters, sort, totals and paging run in SQL — one page of rows per rerun
+    if has_income_history(user_id):
         render_filter_bar_income(banks)
-        filtered_income = apply_income_filters(income_data)
+        page = fetch_history_page("income", user_id)
 
-        total_shown = sum(r["amount"] for r in filtered_income)
-        if len(filtered_income) != len(income_data):
-            st.caption(f"Showing {len(filtered_income)} of {len(income_data)} entries — ₦{total_shown:,} total")
+        if page["count"] != page["count_all"]:
+            st.caption(f"Showing {page['count']} of {page['count_all']} entries — ₦{page['total']:,} total")
         else:
-            st.caption(f"{len(income_data)} entries — ₦{total_shown:,} total")
+            st.caption(f"{page['count_all']} entries — ₦{page['total']:,} total")
 
-        if not filtered_income:
+        if not page["rows"]:
             st.markdown(
                 '<div style="background:#f4f7f6;border-radius:10px;padding:18px;text-align:center;color:#6b7f8e;">' +
                 '<div style="font-weight:700;color:#1a2e3b;">No entries match your filters</div>' +
@@ -125,7 +116,7 @@ def render_income(user_id):
                 unsafe_allow_html=True
             )
         else:
-            for inc in filtered_income:
+            for inc in page["rows"]:
                 source = inc["description"].replace("Income: ", "", 1)
                 card_col, edit_col, del_col = st.columns([5, 0.5, 0.5])
                 with card_col:
@@ -165,6 +156,7 @@ def render_income(user_id):
                         if st.button("🗑️", key=f"delete_inc_{inc['id']}", help=f"Delete '{source}'"):
                             st.session_state.confirm_delete[del_key] = True
                             st.rerun()
+            render_history_pager("income", page)
     else:
         st.markdown(
             '<div style="background:#f4f7f6;border-radius:12px;padding:28px;text-align:center;color:#6b7f8e;">' +
@@ -1,6 +1,7 @@
 # landing.py — landing page, login, register, verify, forgot password
 import streamlit as st
 from datetime import datetime
+from concurrent.futures import TimeoutError as HashTimeout
 
 from db import get_db
 from auth import (
@@ -12,6 +13,7 @@ from auth import (
     CODE_EXPIRY_MINUTES,
 )
 from email_service import notify_admin_new_signup
+from passwords import queue_depth, HasherBusy
 
 
 def render_landing(cookies):
@@ -177,7 +179,15 @@ def render_landing(cookies):
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("Login", key="login_btn"):
-                    uid = login_user(login_username, login_password)
+                    depth, workers = queue_depth()
+                    wait_msg = ("Signing you in…" if depth < workers else
+                                f"Lots of people are signing in — {depth - workers + 1} ahead of you…")
+                    try:
+                        with st.spinner(wait_msg):
+                            uid = login_user(login_username, login_password)
+                    except (HasherBusy, HashTimeout):
+                        st.warning("Sign-in is very busy right now. Please try again in a few seconds.")
+                        st.stop()
                     if uid:
                         track_login(uid)
                         token = create_session_token(uid, cookies)
@@ -7,6 +7,7 @@ import plotly.express as px
 from datetime import datetime, timedelta
 
 from db import get_db
+from snapshots import daily_source
 
 
 def render_summaries(user_id):
@@ -27,23 +28,21 @@ def render_summaries(user_id):
         prev_week_end   = week_start - timedelta(days=1)
 
         # All weekly data in ONE connection
-        with get_db() as (conn, cursor):
-            cursor.execute("""
-                SELECT
-                  COALESCE(SUM(CASE WHEN t.type='credit' THEN t.amount ELSE 0 END),0) AS income,
-                  COALESCE(SUM(CASE WHEN t.type='debit'  THEN t.amount ELSE 0 END),0) AS spent
-                FROM transactions t JOIN banks b ON t.bank_id=b.id
-                WHERE b.user_id=%s AND t.created_at>=%s
+        src = daily_source()
+        with get_db(readonly=True) as (conn, cursor):
+            cursor.execute(f"""
+                SELECT COALESCE(SUM(credit),0) AS income, COALESCE(SUM(debit),0) AS spent
+                FROM {src}
+                WHERE user_id=%s AND day>=%s
             """, (user_id, week_start))
             w = cursor.fetchone()
             week_income = int(w["income"] or 0)
             week_spent  = int(w["spent"]  or 0)
 
-            cursor.execute("""
-                SELECT COALESCE(SUM(t.amount),0) AS spent
-                FROM transactions t JOIN banks b ON t.bank_id=b.id
-                WHERE b.user_id=%s AND t.type='debit'
-                  AND t.created_at>=%s AND t.created_at<=%s
+            cursor.execute(f"""
+                SELECT COALESCE(SUM(debit),0) AS spent
+                FROM {src}
+                WHERE user_id=%s AND day>=%s AND day<=%s
             """, (user_id, prev_week_start, prev_week_end))
             prev_week_spent = int(cursor.fetchone()["spent"] or 0)
 
@@ -55,11 +54,11 @@ def render_summaries(user_id):
             """, (user_id, week_start))
             week_top_cats = cursor.fetchall()
 
-            cursor.execute("""
-                SELECT t.created_at AS day, SUM(t.amount) AS total
-                FROM transactions t JOIN banks b ON t.bank_id=b.id
-                WHERE b.user_id=%s AND t.type='debit' AND t.created_at>=%s
-                GROUP BY t.created_at ORDER BY t.created_at
+            cursor.execute(f"""
+                SELECT day, SUM(debit) AS total
+                FROM {src}
+                WHERE user_id=%s AND day>=%s
+                GROUP BY day HAVING SUM(debit) > 0 ORDER BY day
             """, (user_id, week_start))
             daily_rows = cursor.fetchall()
 
@@ -178,33 +177,30 @@ def render_summaries(user_id):
         )
 
         # All monthly data in ONE connection
-        with get_db() as (conn, cursor):
-            cursor.execute("""
-                SELECT
-                  COALESCE(SUM(CASE WHEN t.type='credit' THEN t.amount ELSE 0 END),0) AS income,
-                  COALESCE(SUM(CASE WHEN t.type='debit'  THEN t.amount ELSE 0 END),0) AS spent
-                FROM transactions t JOIN banks b ON t.bank_id=b.id
-                WHERE b.user_id=%s AND t.created_at>=%s AND t.created_at<=%s
+        src = daily_source()
+        with get_db(readonly=True) as (conn, cursor):
+            cursor.execute(f"""
+                SELECT COALESCE(SUM(credit),0) AS income, COALESCE(SUM(debit),0) AS spent
+                FROM {src}
+                WHERE user_id=%s AND day>=%s AND day<=%s
             """, (user_id, m_start, m_end))
             mn = cursor.fetchone()
             m_income = int(mn["income"] or 0)
             m_spent  = int(mn["spent"]  or 0)
 
             cursor.execute("""
-                SELECT COALESCE(e.category, e.name) AS cat,
-                       SUM(e.amount) AS total, COUNT(*) AS cnt
-                FROM expenses e JOIN banks b ON e.bank_id=b.id
-                WHERE b.user_id=%s AND e.created_at>=%s AND e.created_at<=%s
-                GROUP BY cat ORDER BY total DESC
-            """, (user_id, m_start, m_end))
+                SELECT category AS cat, spent AS total, txn_count AS cnt
+                FROM user_month_category_totals
+                WHERE user_id=%s AND month=%s
+                ORDER BY total DESC
+            """, (user_id, m_start))
             m_cats = cursor.fetchall()
 
-            cursor.execute("""
-                SELECT DATE_TRUNC('week', t.created_at) AS wk, SUM(t.amount) AS total
-                FROM transactions t JOIN banks b ON t.bank_id=b.id
-                WHERE b.user_id=%s AND t.type='debit'
-                  AND t.created_at>=%s AND t.created_at<=%s
-                GROUP BY wk ORDER BY wk
+            cursor.execute(f"""
+                SELECT DATE_TRUNC('week', day) AS wk, SUM(debit) AS total
+                FROM {src}
+                WHERE user_id=%s AND day>=%s AND day<=%s
+                GROUP BY wk HAVING SUM(debit) > 0 ORDER BY wk
             """, (user_id, m_start, m_end))
             m_weekly = cursor.fetchall()
 
@@ -220,11 +216,10 @@ def render_summaries(user_id):
             # Previous month for comparison
             prev_m_end   = m_start - timedelta(days=1)
             prev_m_start = prev_m_end.replace(day=1)
-            cursor.execute("""
-                SELECT COALESCE(SUM(t.amount),0) AS spent
-                FROM transactions t JOIN banks b ON t.bank_id=b.id
-                WHERE b.user_id=%s AND t.type='debit'
-                  AND t.created_at>=%s AND t.created_at<=%s
+            cursor.execute(f"""
+                SELECT COALESCE(SUM(debit),0) AS spent
+                FROM {src}
+                WHERE user_id=%s AND day>=%s AND day<=%s
             """, (user_id, prev_m_start, prev_m_end))
             prev_m_spent = int(cursor.fetchone()["spent"] or 0)
 
@@ -102,9 +102,9 @@ def _run_auto_posting(user_id: int, today) -> list:
                     balance_delta = amount if item_type == "income" else -amount
 
                     cursor.execute("""
-                        INSERT INTO transactions (bank_id, type, amount, description, created_at)
-                        VALUES (%s, %s, %s, %s, %s)
-                    """, (item["bank_id"], tx_type, amount,
+                        INSERT INTO transactions (user_id, bank_id, type, amount, description, created_at)
+                        VALUES (%s, %s, %s, %s, %s, %s)
+                    """, (user_id, item["bank_id"], tx_type, amount,
                           f"Auto-posted: {item['name']}", today))
 
                     if item_type == "expense":
@@ -769,8 +769,8 @@ def render_tracker(user_id):
                 three_months_ago = (three_months_ago - timedelta(days=1)).replace(day=1)
             cursor.execute("""
                 SELECT COALESCE(SUM(t.amount), 0) AS total
-                FROM transactions t JOIN banks b ON t.bank_id = b.id
-                WHERE b.user_id = %s AND t.type = 'debit'
+                FROM transactions t
+                WHERE t.user_id = %s AND t.type = 'debit'
                   AND t.created_at >= %s AND t.created_at < %s
             """, (user_id, three_months_ago, today.replace(day=1)))
             three_mo_total = int(cursor.fetchone()["total"] or 0)
@@ -778,8 +778,8 @@ def render_tracker(user_id):
 
             cursor.execute("""
                 SELECT COALESCE(SUM(t.amount), 0) AS total
-                FROM transactions t JOIN banks b ON t.bank_id = b.id
-                WHERE b.user_id = %s AND t.type = 'credit' AND t.created_at >= %s
+                FROM transactions t
+                WHERE t.user_id = %s AND t.type = 'credit' AND t.created_at >= %s
             """, (user_id, today.replace(day=1)))
             income_this_month = int(cursor.fetchone()["total"] or 0)
 
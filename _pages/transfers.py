@@ -4,7 +4,8 @@ import re
 import streamlit as st
 from datetime import datetime
 
-from db import get_db
+from db import get_db, PoolOverloaded, OVERLOAD_MESSAGE
+from cache_versions import DATA, bump
 
 
 def render_transfers(user_id):
@@ -86,20 +87,20 @@ def render_transfers(user_id):
                         )
                         # Log debit side
                         cursor.execute(
-                            "INSERT INTO transactions (bank_id, type, amount, description, created_at) "
-                            "VALUES (%s,'debit',%s,%s,%s)",
-                            (from_id, transfer_amount, f"Transfer to {to_name}" + (f" — {note}" if note else ""), today)
+                            "INSERT INTO transactions (user_id, bank_id, type, amount, description, created_at) "
+                            "VALUES (%s,%s,'debit',%s,%s,%s)",
+                            (user_id, from_id, transfer_amount, f"Transfer to {to_name}" + (f" — {note}" if note else ""), today)
                         )
                         # Log credit side
                         cursor.execute(
-                            "INSERT INTO transactions (bank_id, type, amount, description, created_at) "
-                            "VALUES (%s,'credit',%s,%s,%s)",
-                            (to_id, transfer_amount, f"Transfer from {from_name}" + (f" — {note}" if note else ""), today)
+                            "INSERT INTO transactions (user_id, bank_id, type, amount, description, created_at) "
+                            "VALUES (%s,%s,'credit',%s,%s,%s)",
+                            (user_id, to_id, transfer_amount, f"Transfer from {from_name}" + (f" — {note}" if note else ""), today)
                         )
                         conn.commit()
                         transfer_ok = True
-                        # Clear cached dashboard data so the transfer reflects immediately
-                        st.cache_data.clear()
+                        # Invalidate this user's cached dashboard data so the transfer reflects immediately
+                        bump(user_id, DATA)
 
                     cursor.close()
                     _return_connection(conn, error=False)
@@ -115,7 +116,9 @@ def render_transfers(user_id):
                         except Exception:
                             pass
                     err = str(e)
-                    if "QueryCanceled" in err or "timeout" in err.lower():
+                    if isinstance(e, PoolOverloaded):
+                        error_msg = OVERLOAD_MESSAGE
+                    elif "QueryCanceled" in err or "timeout" in err.lower():
                         error_msg = "Connection timed out — please try again."
                     elif "could not serialize" in err.lower():
                         error_msg = "Transfer conflict — please try again."
@@ -144,7 +147,7 @@ def render_transfers(user_id):
                        b.bank_name, b.account_number
                 FROM transactions t
                 JOIN banks b ON t.bank_id = b.id
-                WHERE b.user_id = %s
+                WHERE t.user_id = %s
                   AND (   t.description LIKE 'Transfer to %%'
                        OR t.description LIKE 'Transfer from %%'
                        OR t.description LIKE 'Transfer to bank %%'
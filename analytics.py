@@ -9,7 +9,7 @@ from db import get_db
 
 def get_analytics():
     try:
-        with get_db() as (conn, cursor):
+        with get_db(readonly=True) as (conn, cursor):
             today     = datetime.now().date()
             cutoff_30 = today - timedelta(days=30)
             cutoff_7  = today - timedelta(days=7)
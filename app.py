@@ -37,10 +37,14 @@ from auth      import (
     validate_session_token, revoke_session_token,
     get_onboarding_status, mark_onboarding_complete,
     invalidate_onboarding_cache,  # OPTIMIZED: cache invalidation helper
+    track_login,
 )
-from db        import get_db
-from retention import run_retention_engine, get_unread_count, get_streak
+from db        import get_db, release_run_connection, PoolOverloaded, render_overload_notice
+from retention import get_unread_count, get_streak
+from cache_versions import load_data_version
+from cache_bus import start_listener
 from utils     import save_expense
+from query_profiler import start_query_profile, finish_query_profile
 from datetime  import datetime
 
 inject_styles()
@@ -49,6 +53,8 @@ inject_styles()
 # process regardless of how many users or reruns. Zero cost on every call after
 # the first because Streamlit returns the cached result immediately.
 create_tables()
+# Same pattern: one LISTEN thread per process for cross-process cache evictions.
+start_listener()
 
 # ── Session state defaults ────────────────────────────────────────────────────
 _DEFAULTS = {
@@ -90,6 +96,9 @@ for k, v in _DEFAULTS.items():
     if k not in st.session_state:
         st.session_state[k] = v
 
+# Per-query timing + N+1 detection — admins only (or DB_QUERY_PROFILING=1)
+start_query_profile(st.session_state.user_role == "admin")
+
 # ── Restore session from cookie ───────────────────────────────────────────────
 if st.session_state.user_id is None:
     _tok = cookies.get("session_token", "")
@@ -199,26 +208,34 @@ if st.session_state.get("demo_mode"):
 # ── Real user — logged in ─────────────────────────────────────────────────────
 user_id = st.session_state.user_id
 
-# OPTIMIZED: cache user name/role in session_state — avoids SELECT on every rerun
-_user_cache_key = f"_user_row_{user_id}"
-if _user_cache_key not in st.session_state:
-    with get_db() as (conn, cursor):
-        cursor.execute("SELECT surname, other_names, role FROM users WHERE id=%s", (user_id,))
-        st.session_state[_user_cache_key] = cursor.fetchone()
-user = st.session_state[_user_cache_key]
-st.session_state.user_role = user["role"]
-
-# ── Retention engine + sidebar data — ONE DB round-trip, cached per day ───────
-_today_str = datetime.now().date().isoformat()
-if st.session_state._retention_date != _today_str:
-    # Run the engine (idempotent within the day) and refresh cached values
-    try:
-        run_retention_engine(user_id)
-    except Exception:
-        pass
-    st.session_state._streak_cache    = get_streak(user_id)
-    st.session_state._unread_cache    = get_unread_count(user_id)
-    st.session_state._retention_date  = _today_str
+# An exhausted pool here gets the same overload notice as the pages below,
+# not a raw database error.
+try:
+    # OPTIMIZED: cache user name/role in session_state — avoids SELECT on every rerun
+    _user_cache_key = f"_user_row_{user_id}"
+    if _user_cache_key not in st.session_state:
+        with get_db() as (conn, cursor):
+            cursor.execute("SELECT surname, other_names, role FROM users WHERE id=%s", (user_id,))
+            st.session_state[_user_cache_key] = cursor.fetchone()
+    user = st.session_state[_user_cache_key]
+    st.session_state.user_role = user["role"]
+
+    # Per-user data version — one PK lookup per rerun; every DATA-scoped cache
+    # below is keyed on it, so a write anywhere shows up on the next rerun.
+    load_data_version(user_id)
+
+    # ── Daily activity + sidebar data — cached per day ───────────────────────
+    # Streaks, tips and reminders are computed by the nightly batch
+    # (python retention.py); the page only records today's visit and reads results.
+    _today_str = datetime.now().date().isoformat()
+    if st.session_state._retention_date != _today_str:
+        track_login(user_id)  # one analytics_logins row per day — idempotent
+        st.session_state._streak_cache    = get_streak(user_id)
+        st.session_state._unread_cache    = get_unread_count(user_id)
+        st.session_state._retention_date  = _today_str
+except PoolOverloaded:
+    render_overload_notice()
+    st.stop()
 
 _streak_data  = st.session_state._streak_cache  or {"current": 0, "longest": 0}
 _unread       = st.session_state._unread_cache  or 0
@@ -282,196 +299,208 @@ with st.sidebar:
         st.rerun()
 
 # ── Onboarding checklist (shown on all pages until complete) ──────────────────
-_ob = get_onboarding_status(user_id)
-if not _ob["already_done"]:
-    if _ob["all_done"]:
-        mark_onboarding_complete(user_id)
-    else:
-        steps_done = sum([_ob["has_bank"], _ob["has_income"],
-                          _ob["has_expense"], _ob["has_budget"]])
-        st.markdown("""
-        <style>
-        .ob-step { display:flex; align-items:center; gap:10px; background:#f0f7f4;
-            border-radius:8px; padding:10px 14px; margin-bottom:6px; font-size:0.92rem; }
-        .ob-done { border-left:4px solid #0e7c5b; color:#2c7a5a; }
-        .ob-todo { border-left:4px solid #d0d0d0; color:#555; }
-        .ob-icon { font-size:1.2rem; }
-        </style>""", unsafe_allow_html=True)
-
-        with st.expander(f"&#x1F680; Setup checklist — {steps_done}/4 done", expanded=(steps_done == 0)):
-            st.progress(steps_done / 4, text=f"{steps_done * 25}% set up")
-
-            done1 = _ob["has_bank"]
-            st.markdown(
-                f'<div class="ob-step {"ob-done" if done1 else "ob-todo"}">'
-                f'<span class="ob-icon">{"&#x2705;" if done1 else "&#x1F3E6;"}</span>'
-                f'<span><strong>Step 1: Add your first bank account</strong>'
-                f'{"&nbsp;&mdash; done!" if done1 else ""}</span></div>',
-                unsafe_allow_html=True
-            )
-            if not done1:
-                with st.form("ob_bank_form"):
-                    ob_bank_name   = st.text_input("Bank Name (e.g. GTB, Access, Opay)")
-                    ob_acct_name   = st.text_input("Account Name")
-                    ob_acct_num    = st.text_input("Account Number (last 4 digits)")
-                    ob_opening_bal = st.number_input("Current Balance (NGN)", min_value=0, step=1000)
-                    ob_bank_submit = st.form_submit_button("Add Bank and Continue")
-                if ob_bank_submit:
-                    if ob_bank_name and ob_acct_name and ob_acct_num:
-                        with get_db() as (conn, cursor):
-                            cursor.execute(
-                                "INSERT INTO banks (user_id, bank_name, account_name, account_number, balance, min_balance_alert) "
-                                "VALUES (%s,%s,%s,%s,%s,0)",
-                                (user_id, ob_bank_name, ob_acct_name, ob_acct_num[-4:], int(ob_opening_bal))
-                            )
-                        st.success(f"Bank '{ob_bank_name}' added!")
-                        invalidate_onboarding_cache(user_id)  # OPTIMIZED
-                        st.rerun()
-                    else:
-                        st.warning("Please fill all bank fields.")
-
-            done2 = _ob["has_income"]
-            st.markdown(
-                f'<div class="ob-step {"ob-done" if done2 else "ob-todo"}">'
-                f'<span class="ob-icon">{"&#x2705;" if done2 else "&#x1F4B0;"}</span>'
-                f'<span><strong>Step 2: Record your first income</strong>'
-                f'{"&nbsp;&mdash; done!" if done2 else ""}</span></div>',
-                unsafe_allow_html=True
-            )
-            if done1 and not done2:
-                with get_db() as (conn, cursor):
-                    cursor.execute("SELECT id, bank_name, account_number FROM banks WHERE user_id=%s", (user_id,))
-                    ob_banks = cursor.fetchall()
-                ob_bank_map = {f"{b['bank_name']} (****{b['account_number']})": b["id"] for b in ob_banks}
-                with st.form("ob_income_form"):
-                    ob_inc_source = st.text_input("Income Source (e.g. Salary, Freelance)")
-                    ob_inc_amount = st.number_input("Amount (NGN)", min_value=1, step=1000)
-                    ob_inc_bank   = st.selectbox("Which bank?", list(ob_bank_map.keys()))
-                    ob_inc_submit = st.form_submit_button("Add Income and Continue")
-                if ob_inc_submit:
-                    if ob_inc_source and ob_inc_amount > 0:
-                        bk_id = ob_bank_map[ob_inc_bank]
-                        with get_db() as (conn, cursor):
-                            cursor.execute("UPDATE banks SET balance=balance+%s WHERE id=%s", (int(ob_inc_amount), bk_id))
-                            cursor.execute(
-                                "INSERT INTO transactions (bank_id,type,amount,description,created_at) VALUES (%s,'credit',%s,%s,%s)",
-                                (bk_id, int(ob_inc_amount), f"Income: {ob_inc_source}", datetime.now().date())
-                            )
-                        st.success("Income recorded!")
-                        invalidate_onboarding_cache(user_id)  # OPTIMIZED
-                        st.rerun()
-                    else:
-                        st.warning("Please enter a source and amount.")
-            elif not done1:
-                st.caption("Complete Step 1 first.")
-
-            done3 = _ob["has_expense"]
-            st.markdown(
-                f'<div class="ob-step {"ob-done" if done3 else "ob-todo"}">'
-                f'<span class="ob-icon">{"&#x2705;" if done3 else "&#x1F9FE;"}</span>'
-                f'<span><strong>Step 3: Log your first expense</strong>'
-                f'{"&nbsp;&mdash; done!" if done3 else ""}</span></div>',
-                unsafe_allow_html=True
-            )
-            if done1 and not done3:
-                with get_db() as (conn, cursor):
-                    cursor.execute("SELECT id, bank_name, account_number FROM banks WHERE user_id=%s", (user_id,))
-                    ob_banks2 = cursor.fetchall()
-                ob_bank_map2 = {f"{b['bank_name']} (****{b['account_number']})": b["id"] for b in ob_banks2}
-                with st.form("ob_expense_form"):
-                    ob_exp_name   = st.text_input("Expense Name (e.g. Transport, Food)")
-                    ob_exp_amount = st.number_input("Amount (NGN)", min_value=1, step=100, key="ob_exp_amt")
-                    ob_exp_bank   = st.selectbox("Pay From Bank", list(ob_bank_map2.keys()))
-                    ob_exp_submit = st.form_submit_button("Add Expense and Continue")
-                if ob_exp_submit:
-                    if ob_exp_name and ob_exp_amount > 0:
-                        bk_id = ob_bank_map2[ob_exp_bank]
-                        ok, result = save_expense(user_id, bk_id, ob_exp_name, ob_exp_amount)
-                        if ok:
-                            st.success("Expense logged!")
+# Shares the page's PoolOverloaded handler at the end of routing.
+try:
+    _ob = get_onboarding_status(user_id)
+    if not _ob["already_done"]:
+        if _ob["all_done"]:
+            mark_onboarding_complete(user_id)
+        else:
+            steps_done = sum([_ob["has_bank"], _ob["has_income"],
+                              _ob["has_expense"], _ob["has_budget"]])
+            st.markdown("""
+            <style>
+            .ob-step { display:flex; align-items:center; gap:10px; background:#f0f7f4;
+                border-radius:8px; padding:10px 14px; margin-bottom:6px; font-size:0.92rem; }
+            .ob-done { border-left:4px solid #0e7c5b; color:#2c7a5a; }
+            .ob-todo { border-left:4px solid #d0d0d0; color:#555; }
+            .ob-icon { font-size:1.2rem; }
+            </style>""", unsafe_allow_html=True)
+
+            with st.expander(f"&#x1F680; Setup checklist — {steps_done}/4 done", expanded=(steps_done == 0)):
+                st.progress(steps_done / 4, text=f"{steps_done * 25}% set up")
+
+                done1 = _ob["has_bank"]
+                st.markdown(
+                    f'<div class="ob-step {"ob-done" if done1 else "ob-todo"}">'
+                    f'<span class="ob-icon">{"&#x2705;" if done1 else "&#x1F3E6;"}</span>'
+                    f'<span><strong>Step 1: Add your first bank account</strong>'
+                    f'{"&nbsp;&mdash; done!" if done1 else ""}</span></div>',
+                    unsafe_allow_html=True
+                )
+                if not done1:
+                    with st.form("ob_bank_form"):
+                        ob_bank_name   = st.text_input("Bank Name (e.g. GTB, Access, Opay)")
+                        ob_acct_name   = st.text_input("Account Name")
+                        ob_acct_num    = st.text_input("Account Number (last 4 digits)")
+                        ob_opening_bal = st.number_input("Current Balance (NGN)", min_value=0, step=1000)
+                        ob_bank_submit = st.form_submit_button("Add Bank and Continue")
+                    if ob_bank_submit:
+                        if ob_bank_name and ob_acct_name and ob_acct_num:
+                            with get_db() as (conn, cursor):
+                                cursor.execute(
+                                    "INSERT INTO banks (user_id, bank_name, account_name, account_number, balance, min_balance_alert) "
+                                    "VALUES (%s,%s,%s,%s,%s,0)",
+                                    (user_id, ob_bank_name, ob_acct_name, ob_acct_num[-4:], int(ob_opening_bal))
+                                )
+                            st.success(f"Bank '{ob_bank_name}' added!")
                             invalidate_onboarding_cache(user_id)  # OPTIMIZED
                             st.rerun()
                         else:
-                            st.error(result)
-                    else:
-                        st.warning("Please enter a name and amount.")
-            elif not done1:
-                st.caption("Complete Step 1 first.")
-
-            done4 = _ob["has_budget"]
-            st.markdown(
-                f'<div class="ob-step {"ob-done" if done4 else "ob-todo"}">'
-                f'<span class="ob-icon">{"&#x2705;" if done4 else "&#x1F4CA;"}</span>'
-                f'<span><strong>Step 4: Set your monthly spending budget</strong>'
-                f'{"&nbsp;&mdash; done!" if done4 else ""}</span></div>',
-                unsafe_allow_html=True
-            )
-            if not done4:
-                with st.form("ob_budget_form"):
-                    ob_budget        = st.number_input("Monthly Budget (NGN)", min_value=1000, step=5000, value=100000)
-                    ob_budget_submit = st.form_submit_button("Set Budget and Finish")
-                if ob_budget_submit:
+                            st.warning("Please fill all bank fields.")
+
+                done2 = _ob["has_income"]
+                st.markdown(
+                    f'<div class="ob-step {"ob-done" if done2 else "ob-todo"}">'
+                    f'<span class="ob-icon">{"&#x2705;" if done2 else "&#x1F4B0;"}</span>'
+                    f'<span><strong>Step 2: Record your first income</strong>'
+                    f'{"&nbsp;&mdash; done!" if done2 else ""}</span></div>',
+                    unsafe_allow_html=True
+                )
+                if done1 and not done2:
                     with get_db() as (conn, cursor):
-                        cursor.execute("UPDATE users SET monthly_spending_limit=%s WHERE id=%s", (int(ob_budget), user_id))
-                    st.success("Budget set! You're all set up.")
-                    invalidate_onboarding_cache(user_id)  # OPTIMIZED
+                        cursor.execute("SELECT id, bank_name, account_number FROM banks WHERE user_id=%s", (user_id,))
+                        ob_banks = cursor.fetchall()
+                    ob_bank_map = {f"{b['bank_name']} (****{b['account_number']})": b["id"] for b in ob_banks}
+                    with st.form("ob_income_form"):
+                        ob_inc_source = st.text_input("Income Source (e.g. Salary, Freelance)")
+                        ob_inc_amount = st.number_input("Amount (NGN)", min_value=1, step=1000)
+                        ob_inc_bank   = st.selectbox("Which bank?", list(ob_bank_map.keys()))
+                        ob_inc_submit = st.form_submit_button("Add Income and Continue")
+                    if ob_inc_submit:
+                        if ob_inc_source and ob_inc_amount > 0:
+                            bk_id = ob_bank_map[ob_inc_bank]
+                            with get_db() as (conn, cursor):
+                                cursor.execute("UPDATE banks SET balance=balance+%s WHERE id=%s", (int(ob_inc_amount), bk_id))
+                                cursor.execute(
+                                    "INSERT INTO transactions (user_id,bank_id,type,amount,description,created_at) VALUES (%s,%s,'credit',%s,%s,%s)",
+                                    (user_id, bk_id, int(ob_inc_amount), f"Income: {ob_inc_source}", datetime.now().date())
+                                )
+                            st.success("Income recorded!")
+                            invalidate_onboarding_cache(user_id)  # OPTIMIZED
+                            st.rerun()
+                        else:
+                            st.warning("Please enter a source and amount.")
+                elif not done1:
+                    st.caption("Complete Step 1 first.")
+
+                done3 = _ob["has_expense"]
+                st.markdown(
+                    f'<div class="ob-step {"ob-done" if done3 else "ob-todo"}">'
+                    f'<span class="ob-icon">{"&#x2705;" if done3 else "&#x1F9FE;"}</span>'
+                    f'<span><strong>Step 3: Log your first expense</strong>'
+                    f'{"&nbsp;&mdash; done!" if done3 else ""}</span></div>',
+                    unsafe_allow_html=True
+                )
+                if done1 and not done3:
+                    with get_db() as (conn, cursor):
+                        cursor.execute("SELECT id, bank_name, account_number FROM banks WHERE user_id=%s", (user_id,))
+                        ob_banks2 = cursor.fetchall()
+                    ob_bank_map2 = {f"{b['bank_name']} (****{b['account_number']})": b["id"] for b in ob_banks2}
+                    with st.form("ob_expense_form"):
+                        ob_exp_name   = st.text_input("Expense Name (e.g. Transport, Food)")
+                        ob_exp_amount = st.number_input("Amount (NGN)", min_value=1, step=100, key="ob_exp_amt")
+                        ob_exp_bank   = st.selectbox("Pay From Bank", list(ob_bank_map2.keys()))
+                        ob_exp_submit = st.form_submit_button("Add Expense and Continue")
+                    if ob_exp_submit:
+                        if ob_exp_name and ob_exp_amount > 0:
+                            bk_id = ob_bank_map2[ob_exp_bank]
+                            ok, result = save_expense(user_id, bk_id, ob_exp_name, ob_exp_amount)
+                            if ok:
+                                st.success("Expense logged!")
+                                invalidate_onboarding_cache(user_id)  # OPTIMIZED
+                                st.rerun()
+                            else:
+                                st.error(result)
+                        else:
+                            st.warning("Please enter a name and amount.")
+                elif not done1:
+                    st.caption("Complete Step 1 first.")
+
+                done4 = _ob["has_budget"]
+                st.markdown(
+                    f'<div class="ob-step {"ob-done" if done4 else "ob-todo"}">'
+                    f'<span class="ob-icon">{"&#x2705;" if done4 else "&#x1F4CA;"}</span>'
+                    f'<span><strong>Step 4: Set your monthly spending budget</strong>'
+                    f'{"&nbsp;&mdash; done!" if done4 else ""}</span></div>',
+                    unsafe_allow_html=True
+                )
+                if not done4:
+                    with st.form("ob_budget_form"):
+                        ob_budget        = st.number_input("Monthly Budget (NGN)", min_value=1000, step=5000, value=100000)
+                        ob_budget_submit = st.form_submit_button("Set Budget and Finish")
+                    if ob_budget_submit:
+                        with get_db() as (conn, cursor):
+                            cursor.execute("UPDATE users SET monthly_spending_limit=%s WHERE id=%s", (int(ob_budget), user_id))
+                        st.success("Budget set! You're all set up.")
+                        invalidate_onboarding_cache(user_id)  # OPTIMIZED
+                        st.rerun()
+
+                if st.button("Skip setup checklist", key="skip_onboarding"):
+                    mark_onboarding_complete(user_id)  # mark_onboarding_complete already invalidates cache
                     st.rerun()
 
-            if st.button("Skip setup checklist", key="skip_onboarding"):
-                mark_onboarding_complete(user_id)  # mark_onboarding_complete already invalidates cache
-                st.rerun()
+            st.divider()
 
-        st.divider()
+    # ── Page routing ──────────────────────────────────────────────────────────
+    if current_page == "Admin Panel":
+        from _pages.admin import render_admin
+        render_admin(user_id)
+
+    elif current_page == "Analytics":
+        from _pages.admin import render_analytics
+        render_analytics(user_id)
 
-# ── Page routing ──────────────────────────────────────────────────────────────
-if current_page == "Admin Panel":
-    from _pages.admin import render_admin
-    render_admin(user_id)
+    elif current_page == "Dashboard":
+        from _pages.dashboard import render_dashboard
+        render_dashboard(user_id, pages)
 
-elif current_page == "Analytics":
-    from _pages.admin import render_analytics
-    render_analytics(user_id)
+    elif current_page == "Income":
+        from _pages.income import render_income
+        render_income(user_id)
 
-elif current_page == "Dashboard":
-    from _pages.dashboard import render_dashboard
-    render_dashboard(user_id, pages)
+    elif current_page == "Expenses":
+        from _pages.expenses import render_expenses
+        render_expenses(user_id, pages)
 
-elif current_page == "Income":
-    from _pages.income import render_income
-    render_income(user_id)
+    elif current_page == "Banks":
+        from _pages.banks import render_banks
+        render_banks(user_id)
 
-elif current_page == "Expenses":
-    from _pages.expenses import render_expenses
-    render_expenses(user_id, pages)
+    elif current_page == "Transfers":
+        from _pages.transfers import render_transfers
+        render_transfers(user_id)
 
-elif current_page == "Banks":
-    from _pages.banks import render_banks
-    render_banks(user_id)
+    elif current_page == "Savings Goals":
+        from _pages.goals import render_goals
+        render_goals(user_id, pages)
 
-elif current_page == "Transfers":
-    from _pages.transfers import render_transfers
-    render_transfers(user_id)
+    elif current_page == "Tracker":
+        from _pages.tracker import render_tracker
+        render_tracker(user_id)
 
-elif current_page == "Savings Goals":
-    from _pages.goals import render_goals
-    render_goals(user_id, pages)
+    elif current_page == "Summaries":
+        from _pages.summaries import render_summaries
+        render_summaries(user_id)
 
-elif current_page == "Tracker":
-    from _pages.tracker import render_tracker
-    render_tracker(user_id)
+    elif current_page == "Notifications":
+        from _pages.notifications import render_notifications
+        render_notifications(user_id)
 
-elif current_page == "Summaries":
-    from _pages.summaries import render_summaries
-    render_summaries(user_id)
+    elif current_page == "Import CSV":
+        from _pages.import_csv import render_import_csv
+        render_import_csv(user_id, pages)
 
-elif current_page == "Notifications":
-    from _pages.notifications import render_notifications
-    render_notifications(user_id)
+    elif current_page == "Settings":
+        from _pages.settings import render_settings
+        render_settings(user_id)
+except PoolOverloaded:
+    # Every pool slot stayed busy past the checkout timeout — tell the user
+    # plainly instead of letting the page surface a raw database error.
+    render_overload_notice()
 
-elif current_page == "Import CSV":
-    from _pages.import_csv import render_import_csv
-    render_import_csv(user_id, pages)
+finish_query_profile(current_page)
 
-elif current_page == "Settings":
-    from _pages.settings import render_settings
-    render_settings(user_id)
+# Hand this run's pooled connection back as soon as the page has rendered.
+# (Runs ending in st.stop()/st.rerun() release it when the script thread exits.)
+release_run_connection()
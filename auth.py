@@ -3,22 +3,31 @@
 # OPTIMIZED: throttled session-token UPDATE, merged onboarding query,
 #            removed psycopg2 top-level import (unused at module level)
 import re
+import time
 import random
 import secrets
 import hashlib
+import threading
 import psycopg2
 import psycopg2.extras
-import bcrypt
 import streamlit as st
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as HashTimeout
 from datetime import datetime, timedelta
 
+import passwords
 from db import get_db
+from cache_bus import publish, on_invalidate
+from rate_limiter import get_rate_limiter
 from email_service import send_verification_email
 
 
 CODE_EXPIRY_MINUTES = 12   # verification & reset codes expire after 12 minutes
 SESSION_EXPIRY_DAYS = 30   # Sessions expire after 30 days
 _SESSION_UPDATE_THROTTLE_HOURS = 1  # OPTIMIZED: only write sliding-window UPDATE once/hour
+_TOKEN_CACHE_TTL_S   = 60       # validated tokens are re-checked against the DB after this
+_TOKEN_CACHE_MAXSIZE = 10_000   # LRU bound on cached token hashes per process
+_HASHER_BUSY_MSG = "Password checks are very busy right now. Please try again in a few seconds."
 
 
 # ── Validation ────────────────────────────────────────────────────────────────
@@ -54,22 +63,12 @@ def _check_rate_limit(identifier: str, action: str, max_attempts: int = 5, windo
     """
     Returns True if the action is ALLOWED (under the rate limit).
     Returns False if the limit has been exceeded.
+
+    OPTIMIZED: decided in memory by a token bucket; the attempt is persisted
+    to rate_limit_log by rate_limiter's batched background writer.
     """
     try:
-        cutoff = datetime.now() - timedelta(minutes=window_minutes)
-        with get_db() as (conn, cursor):
-            cursor.execute("""
-                SELECT COUNT(*) AS n FROM rate_limit_log
-                WHERE identifier = %s AND action = %s AND attempted_at >= %s
-            """, (identifier, action, cutoff))
-            count = cursor.fetchone()["n"] or 0
-            if count >= max_attempts:
-                return False
-            cursor.execute(
-                "INSERT INTO rate_limit_log (identifier, action, attempted_at) VALUES (%s, %s, %s)",
-                (identifier, action, datetime.now())
-            )
-        return True
+        return get_rate_limiter().hit(identifier, action, max_attempts, window_minutes)
     except Exception:
         return True  # fail open — don't lock users out on DB error
 
@@ -77,28 +76,29 @@ def _check_rate_limit(identifier: str, action: str, max_attempts: int = 5, windo
 def _rate_limit_remaining(identifier: str, action: str, max_attempts: int = 5, window_minutes: int = 15) -> int:
     """Returns how many attempts remain in the current window."""
     try:
-        cutoff = datetime.now() - timedelta(minutes=window_minutes)
-        with get_db() as (conn, cursor):
-            cursor.execute("""
-                SELECT COUNT(*) AS n FROM rate_limit_log
-                WHERE identifier = %s AND action = %s AND attempted_at >= %s
-            """, (identifier, action, cutoff))
-            count = cursor.fetchone()["n"] or 0
-        return max(0, max_attempts - count)
+        return get_rate_limiter().remaining(identifier, action, max_attempts, window_minutes)
     except Exception:
         return max_attempts
 
 
 # ---------------- AUTH FUNCTIONS ----------------
 
+# OPTIMIZED: bcrypt runs on passwords' bounded worker pool, not the script thread
 def hash_password(password):
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+    return passwords.hash_password(password)
 
 
 def check_password(password, hashed):
-    if isinstance(hashed, memoryview):
-        hashed = bytes(hashed)
-    return bcrypt.checkpw(password.encode(), hashed)
+    return passwords.check_password(password, hashed)
+
+
+def _store_upgraded_hash(user_id, new_hash) -> None:
+    try:
+        with get_db() as (conn, cursor):
+            cursor.execute("UPDATE users SET password=%s WHERE id=%s",
+                           (psycopg2.Binary(new_hash), user_id))
+    except Exception:
+        pass  # the old hash still works; retried on the next login
 
 
 def register_user(surname, other, email, username, password):
@@ -114,6 +114,8 @@ def register_user(surname, other, email, username, password):
             """, (surname, other, email, username, psycopg2.Binary(hashed_pw),
                   code, expires, datetime.now().date()))
         return code, "User created"
+    except (passwords.HasherBusy, HashTimeout):
+        return None, _HASHER_BUSY_MSG
     except psycopg2.errors.UniqueViolation:
         return None, "Username or email already exists"
     except Exception as e:
@@ -133,6 +135,9 @@ def login_user(username, password):
             st.warning("Email not verified. Please verify before logging in.")
             return None
         if check_password(password, user["password"]):
+            if passwords.needs_rehash(user["password"]):
+                uid = user["id"]
+                passwords.rehash_in_background(password, lambda h: _store_upgraded_hash(uid, h))
             st.session_state.user_id   = user["id"]
             st.session_state.user_role = user["role"]
             return user["id"]
@@ -167,18 +172,25 @@ def reset_password(email, code, new_password):
                 (email, code)
             )
             user = cursor.fetchone()
-            if not user:
-                return False, "Invalid reset code. Please request a new one."
-            if user["verification_code_expires_at"] and now > user["verification_code_expires_at"]:
-                return False, (f"This reset code has expired. Codes are only valid for "
-                               f"{CODE_EXPIRY_MINUTES} minutes. Please request a new one.")
-            hashed_pw = hash_password(new_password)
+        if not user:
+            return False, "Invalid reset code. Please request a new one."
+        if user["verification_code_expires_at"] and now > user["verification_code_expires_at"]:
+            return False, (f"This reset code has expired. Codes are only valid for "
+                           f"{CODE_EXPIRY_MINUTES} minutes. Please request a new one.")
+        # Hash with no transaction open — bcrypt can queue for seconds.
+        hashed_pw = hash_password(new_password)
+        with get_db() as (conn, cursor):
             cursor.execute(
                 "UPDATE users SET password=%s, verification_code=NULL, "
-                "verification_code_expires_at=NULL WHERE email=%s",
-                (psycopg2.Binary(hashed_pw), email)
+                "verification_code_expires_at=NULL WHERE id=%s AND verification_code=%s",
+                (psycopg2.Binary(hashed_pw), user["id"], code)
             )
+            if cursor.rowcount == 0:
+                return False, "Invalid reset code. Please request a new one."
+        invalidate_user_sessions_cache(user["id"])
         return True, "Password reset successful"
+    except (passwords.HasherBusy, HashTimeout):
+        return False, _HASHER_BUSY_MSG
     except Exception as e:
         return False, str(e)
 
@@ -227,15 +239,103 @@ def change_password(user_id, current_pw, new_pw):
     with get_db() as (conn, cursor):
         cursor.execute("SELECT password FROM users WHERE id=%s", (user_id,))
         row = cursor.fetchone()
-        if not row:
-            return False, "User not found"
-        if check_password(current_pw, row["password"]):
-            cursor.execute(
-                "UPDATE users SET password=%s WHERE id=%s",
-                (psycopg2.Binary(hash_password(new_pw)), user_id)
-            )
-            return True, "Password updated"
-        return False, "Current password incorrect"
+    if not row:
+        return False, "User not found"
+    # Verify and hash with no transaction open — bcrypt can queue for seconds.
+    try:
+        if not check_password(current_pw, row["password"]):
+            return False, "Current password incorrect"
+        new_hash = hash_password(new_pw)
+    except (passwords.HasherBusy, HashTimeout):
+        return False, _HASHER_BUSY_MSG
+    with get_db() as (conn, cursor):
+        # Guarded on the hash just verified, so a concurrent change is not overwritten.
+        cursor.execute(
+            "UPDATE users SET password=%s WHERE id=%s AND password=%s",
+            (psycopg2.Binary(new_hash), user_id, psycopg2.Binary(bytes(row["password"])))
+        )
+        if cursor.rowcount == 0:
+            return False, "Your password was changed elsewhere. Please try again."
+    # Only once committed: evicting earlier lets a concurrent request re-cache
+    # the old session before the change is visible.
+    invalidate_user_sessions_cache(user_id)
+    return True, "Password updated"
+
+
+# ── Session-token cache ───────────────────────────────────────────────────────
+# Process-wide, so a new browser session or a cold rerun doesn't pay the
+# session_tokens ⋈ users lookup, and the sliding-window UPDATE is coalesced
+# per token across every session in this process instead of per session_state.
+# Revokes and password changes are published on the cache bus, so other server
+# processes drop the user's cached tokens at once; _TOKEN_CACHE_TTL_S bounds
+# staleness if an event is lost.
+
+_SESSIONS_SCOPE = "sessions"
+
+class _TokenCache:
+    """Bounded LRU: token hash → [user_id, role, last_touch, cached_at]."""
+
+    def __init__(self, maxsize: int, ttl_s: float):
+        self.lock    = threading.Lock()
+        self.maxsize = maxsize
+        self.ttl_s   = ttl_s
+        self.entries = OrderedDict()
+
+    def get(self, hashed_tok: str):
+        with self.lock:
+            entry = self.entries.get(hashed_tok)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[3] > self.ttl_s:
+                del self.entries[hashed_tok]
+                return None
+            self.entries.move_to_end(hashed_tok)
+            return entry
+
+    def put(self, hashed_tok: str, user_id, role, last_touch):
+        entry = [user_id, role, last_touch, time.monotonic()]
+        with self.lock:
+            self.entries[hashed_tok] = entry
+            self.entries.move_to_end(hashed_tok)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return entry
+
+    def claim_touch(self, hashed_tok: str, now: datetime) -> bool:
+        """True for exactly one caller per throttle window — that caller writes the UPDATE."""
+        cutoff = now - timedelta(hours=_SESSION_UPDATE_THROTTLE_HOURS)
+        with self.lock:
+            entry = self.entries.get(hashed_tok)
+            if entry is None or entry[2] >= cutoff:
+                return False
+            entry[2] = now
+            return True
+
+    def discard(self, hashed_tok: str) -> None:
+        with self.lock:
+            self.entries.pop(hashed_tok, None)
+
+    def discard_user(self, user_id) -> None:
+        """Drop `user_id`'s tokens — every user's when None (cache-bus resync)."""
+        with self.lock:
+            if user_id is None:
+                self.entries.clear()
+                return
+            for tok in [t for t, e in self.entries.items() if e[0] == user_id]:
+                del self.entries[tok]
+
+
+@st.cache_resource
+def _get_token_cache() -> _TokenCache:
+    cache = _TokenCache(_TOKEN_CACHE_MAXSIZE, _TOKEN_CACHE_TTL_S)
+    on_invalidate(_SESSIONS_SCOPE, cache.discard_user)
+    return cache
+
+
+def invalidate_user_sessions_cache(user_id) -> None:
+    """Drop every cached token for `user_id`, here and in every other server process."""
+    _get_token_cache().discard_user(user_id)
+    publish(user_id, _SESSIONS_SCOPE)
 
 
 # ── Session tokens ────────────────────────────────────────────────────────────
@@ -260,9 +360,10 @@ def validate_session_token(token, cookies):
     Hash the incoming raw token, look up its hash in the DB.
     Returns (user_id, role) if valid and within SESSION_EXPIRY_DAYS of last activity.
 
-    OPTIMIZED: The sliding-window UPDATE is throttled to once per hour per token
-    (stored in session_state). This eliminates a DB write on every page rerun,
-    saving one round-trip per click while keeping the 30-day expiry accurate.
+    OPTIMIZED: Validated tokens are held in a process-wide TTL/LRU cache, so a
+    warm token costs no DB round-trip at all. The sliding-window UPDATE is
+    throttled to once per hour per token across every session in the process,
+    keyed off the last touch recorded in the cache (seeded from the DB row).
     """
     if not token:
         return None, None
@@ -270,28 +371,33 @@ def validate_session_token(token, cookies):
         hashed_tok    = _hash_token(token)
         now           = datetime.now()
         expiry_cutoff = now - timedelta(days=SESSION_EXPIRY_DAYS)
-        with get_db() as (conn, cursor):
-            cursor.execute("""
-                SELECT u.id, u.role, s.created_at AS token_updated_at
-                FROM session_tokens s
-                JOIN users u ON s.user_id = u.id
-                WHERE s.token = %s
-                  AND u.email_verified = 1
-                  AND s.created_at >= %s
-            """, (hashed_tok, expiry_cutoff))
-            row = cursor.fetchone()
-            if row:
-                # OPTIMIZED: throttle sliding-window UPDATE — only write if > 1 hour since last update
-                last_update_key = f"_tok_updated_{hashed_tok[:16]}"
-                last_updated    = st.session_state.get(last_update_key)
-                throttle_cutoff = now - timedelta(hours=_SESSION_UPDATE_THROTTLE_HOURS)
-                if last_updated is None or last_updated < throttle_cutoff:
-                    cursor.execute(
-                        "UPDATE session_tokens SET created_at = %s WHERE token = %s",
-                        (now, hashed_tok)
-                    )
-                    st.session_state[last_update_key] = now
-                return row["id"], row["role"]
+        cache         = _get_token_cache()
+        entry         = cache.get(hashed_tok)
+        if entry is None:
+            with get_db() as (conn, cursor):
+                cursor.execute("""
+                    SELECT u.id, u.role, s.created_at AS token_updated_at
+                    FROM session_tokens s
+                    JOIN users u ON s.user_id = u.id
+                    WHERE s.token = %s
+                      AND u.email_verified = 1
+                      AND s.created_at >= %s
+                """, (hashed_tok, expiry_cutoff))
+                row = cursor.fetchone()
+            if not row:
+                return None, None
+            entry = cache.put(hashed_tok, row["id"], row["role"], row["token_updated_at"])
+        elif entry[2] < expiry_cutoff:
+            cache.discard(hashed_tok)
+            return None, None
+
+        if cache.claim_touch(hashed_tok, now):
+            with get_db() as (conn, cursor):
+                cursor.execute(
+                    "UPDATE session_tokens SET created_at = %s WHERE token = %s",
+                    (now, hashed_tok)
+                )
+        return entry[0], entry[1]
     except Exception:
         pass
     return None, None
@@ -303,10 +409,13 @@ def revoke_session_token(token, cookies):
     try:
         hashed_tok = _hash_token(token)
         with get_db() as (conn, cursor):
-            cursor.execute("DELETE FROM session_tokens WHERE token=%s", (hashed_tok,))
-        # OPTIMIZED: clear throttle key on logout
-        tok_key = f"_tok_updated_{hashed_tok[:16]}"
-        st.session_state.pop(tok_key, None)
+            cursor.execute("DELETE FROM session_tokens WHERE token=%s RETURNING user_id", (hashed_tok,))
+            row = cursor.fetchone()
+            if row:
+                # Delivered on commit — other processes evict with the DELETE
+                publish(row["user_id"], _SESSIONS_SCOPE, cursor)
+        # After the DELETE commits, so a concurrent validation can't re-cache it
+        _get_token_cache().discard(hashed_tok)
     except Exception:
         pass
     cookies["session_token"] = ""
@@ -336,8 +445,7 @@ def get_onboarding_status(user_id):
                 (SELECT COUNT(*) FROM banks            WHERE user_id = u.id)           AS bank_count,
                 (SELECT COUNT(*) FROM expenses         WHERE user_id = u.id)           AS exp_count,
                 (SELECT COUNT(*) FROM transactions t
-                 JOIN banks b ON t.bank_id = b.id
-                 WHERE b.user_id = u.id AND t.type = 'credit')                         AS income_count
+                 WHERE t.user_id = u.id AND t.type = 'credit')                         AS income_count
             FROM users u WHERE u.id = %s
         """, (user_id,))
         row = cursor.fetchone()
@@ -385,7 +493,11 @@ def track_login(user_id):
         today = datetime.now().date()
         with get_db() as (conn, cursor):
             # OPTIMIZED: both writes in single connection
-            cursor.execute("INSERT INTO analytics_logins (user_id, login_date) VALUES (%s, %s)", (user_id, today))
+            cursor.execute(
+                "INSERT INTO analytics_logins (user_id, login_date) VALUES (%s, %s) "
+                "ON CONFLICT (user_id, login_date) DO NOTHING",
+                (user_id, today)
+            )
             cursor.execute("UPDATE users SET last_login=%s WHERE id=%s", (today, user_id))
     except Exception:
         pass
@@ -395,6 +507,10 @@ def track_signup(user_id):
     try:
         today = datetime.now().date()
         with get_db() as (conn, cursor):
-            cursor.execute("INSERT INTO analytics_logins (user_id, login_date) VALUES (%s, %s)", (user_id, today))
+            cursor.execute(
+                "INSERT INTO analytics_logins (user_id, login_date) VALUES (%s, %s) "
+                "ON CONFLICT (user_id, login_date) DO NOTHING",
+                (user_id, today)
+            )
     except Exception:
         pass
@@ -0,0 +1,138 @@
+# cache_bus.py — cross-process cache invalidation over Postgres LISTEN/NOTIFY
+#
+# st.cache_data / st.cache_resource live inside one server process. Behind a
+# load balancer, a write handled by process A left processes B, C… serving
+# the old inbox badge or a revoked session from their caches until TTL.
+#
+# Writers call publish(user_id, scope); the event is a pg_notify on CHANNEL,
+# so when a cursor is passed it is delivered only if that transaction commits.
+# Each process runs one listener thread (started via st.cache_resource) on
+# its own autocommit connection and, for every event from another process,
+# runs the handlers registered for that scope — which evict that user's
+# entries only. A user_id of None means "every user" — used by batch jobs and
+# after the listener reconnects, since events sent while it was down are lost.
+#
+# DATA-scoped caches need no events: they are keyed on users.data_version,
+# which every process reads once per rerun (see cache_versions.py).
+#
+# LISTEN needs a session-mode connection. Set DB_LISTEN_URL when
+# SUPABASE_DB_URL points at a transaction-mode pooler.
+#
+# Public API
+# ──────────
+#   publish(user_id, scope, cursor=None)  → notify other processes (in `cursor`'s transaction if given)
+#   on_invalidate(scope, handler)         → handler(user_id or None) runs for events from other processes
+#   start_listener()                      → process-wide listener thread (idempotent)
+from __future__ import annotations
+
+import os
+import json
+import uuid
+import time
+import select
+import threading
+
+import streamlit as st
+import psycopg2
+import psycopg2.extensions
+
+from db import get_db, setting
+
+
+CHANNEL = "cache_invalidate"
+
+_POLL_S         = 5.0    # select() timeout — also how often a dead socket is noticed
+_RECONNECT_MAX  = 30.0   # backoff ceiling after connection failures
+
+# Identifies this process so it can skip its own events (it already evicted locally).
+_ORIGIN = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def publish(user_id: int | None, scope: str, cursor=None) -> None:
+    """Tell every other server process to drop `user_id`'s `scope` entries (None = all users)."""
+    payload = json.dumps({"o": _ORIGIN, "u": user_id, "s": scope})
+    try:
+        if cursor is not None:
+            cursor.execute("SELECT pg_notify(%s, %s)", (CHANNEL, payload))
+            return
+        with get_db() as (conn, cur):
+            cur.execute("SELECT pg_notify(%s, %s)", (CHANNEL, payload))
+    except Exception:
+        pass  # other processes fall back to their TTLs
+
+
+class _Listener:
+    def __init__(self, dsn: str):
+        self.dsn      = dsn
+        self.lock     = threading.Lock()
+        self.handlers = {}   # scope → [handler(user_id)]
+        self.received = 0
+        self.thread   = threading.Thread(target=self._run, name="cache-bus-listener", daemon=True)
+        self.thread.start()
+
+    def add(self, scope: str, handler) -> None:
+        with self.lock:
+            if handler not in self.handlers.setdefault(scope, []):
+                self.handlers[scope].append(handler)
+
+    def _dispatch(self, payload: str) -> None:
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        if event.get("o") == _ORIGIN:
+            return
+        self.received += 1
+        self._run_handlers(event.get("s"), event.get("u"))
+
+    def _run_handlers(self, scope: str, user_id) -> None:
+        with self.lock:
+            handlers = list(self.handlers.get(scope, ()))
+        for handler in handlers:
+            try:
+                handler(user_id)
+            except Exception:
+                pass
+
+    def _resync(self) -> None:
+        """Events may have been missed while disconnected — evict everyone once."""
+        with self.lock:
+            scopes = list(self.handlers)
+        for scope in scopes:
+            self._run_handlers(scope, None)
+
+    def _run(self) -> None:
+        backoff, listened = 1.0, False
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                conn.cursor().execute(f"LISTEN {CHANNEL}")
+                if listened:
+                    self._resync()
+                backoff, listened = 1.0, True
+                while True:
+                    if select.select([conn], [], [], _POLL_S) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._dispatch(conn.notifies.pop(0).payload)
+            except Exception:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, _RECONNECT_MAX)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+
+@st.cache_resource
+def start_listener() -> _Listener:
+    return _Listener(setting("DB_LISTEN_URL", "") or st.secrets["SUPABASE_DB_URL"])
+
+
+def on_invalidate(scope: str, handler) -> None:
+    start_listener().add(scope, handler)
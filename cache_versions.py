@@ -0,0 +1,106 @@
+# cache_versions.py — per-user cache versioning
+#
+# Cached readers used to be invalidated with `<fn>.clear()` or
+# st.cache_data.clear(), which drops every user's entries on the server —
+# one user marking a notification read made everyone's next rerun hit the DB
+# at once. Instead each user has a version number per scope; cached readers
+# take it as an argument (so it is part of the cache key) and writes bump it.
+# The bumping user's next read misses and refetches; everyone else keeps
+# their entries, and the superseded ones age out by TTL / max_entries.
+#
+# Scopes
+#   NOTIFICATIONS  inbox list + unread badge (retention.py) — in-process counter,
+#                  kept coherent across server processes by cache_bus events
+#   DATA           balances, expenses, income, goals, debts and everything
+#                  derived from them — users.data_version, which triggers
+#                  (migration 12) bump on every write whatever the code path.
+#                  app.py reads it once per rerun via load_data_version().
+#
+# Public API
+# ──────────
+#   load_data_version(user_id)    → int, read users.data_version for this rerun
+#   get_version(user_id, scope)   → int, part of the cache key of scoped readers
+#   bump(user_id, *scopes)        → invalidate this user's entries (all scopes if none given)
+from __future__ import annotations
+
+import threading
+
+import streamlit as st
+
+from db import get_db
+from cache_bus import publish, on_invalidate
+
+
+NOTIFICATIONS = "notifications"
+DATA          = "data"
+SCOPES        = (NOTIFICATIONS, DATA)
+
+# Readers keyed on DATA turn over on the version, not the clock. They and
+# load_data_version() read the primary: a lagging replica would hand back the
+# old version, or new-version rows built from old data cached for the full TTL.
+DATA_CACHE_TTL     = 6 * 3600
+DATA_CACHE_ENTRIES = 5_000
+
+_SESSION_KEY = "_data_version"
+
+
+class _Versions:
+    def __init__(self):
+        self.lock     = threading.Lock()
+        self.versions = {}   # (user_id, scope) → int
+        self.epoch    = 0    # bumped for "every user" events
+
+    def get(self, user_id: int, scope: str) -> int:
+        return self.versions.get((user_id, scope), 0) + self.epoch
+
+    def bump(self, user_id: int, scopes) -> None:
+        with self.lock:
+            for scope in scopes:
+                key = (user_id, scope)
+                self.versions[key] = self.versions.get(key, 0) + 1
+
+    def on_remote(self, scope: str):
+        def handler(user_id) -> None:
+            if user_id is None:
+                with self.lock:
+                    self.epoch += 1
+            else:
+                self.bump(user_id, [scope])
+        return handler
+
+
+@st.cache_resource
+def _get_versions() -> _Versions:
+    versions = _Versions()
+    on_invalidate(NOTIFICATIONS, versions.on_remote(NOTIFICATIONS))
+    return versions
+
+
+def load_data_version(user_id: int) -> int:
+    """One PK lookup; the value is reused by every DATA reader in this rerun."""
+    with get_db() as (conn, cursor):
+        cursor.execute("SELECT data_version FROM users WHERE id = %s", (user_id,))
+        row = cursor.fetchone()
+    version = int(row["data_version"]) if row else 0
+    st.session_state[_SESSION_KEY] = (user_id, version)
+    return version
+
+
+def get_version(user_id: int, scope: str) -> int:
+    if scope == DATA:
+        loaded = st.session_state.get(_SESSION_KEY)
+        if loaded and loaded[0] == user_id:
+            return loaded[1]
+        return load_data_version(user_id)
+    return _get_versions().get(user_id, scope)
+
+
+def bump(user_id: int, *scopes: str) -> None:
+    scopes = scopes or SCOPES
+    if DATA in scopes:
+        # The triggers already moved the counter; pick it up for the rest of this run.
+        load_data_version(user_id)
+    local = [s for s in scopes if s != DATA]
+    _get_versions().bump(user_id, local)
+    for scope in local:
+        publish(user_id, scope)
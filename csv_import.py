@@ -5,11 +5,18 @@ Safe CSV bank-statement importer for Budget Right.
 Fixes: fingerprint date mismatch, overdraft silent block, mobile UI.
 """
 
+import io
 import re
+import sys
+import time
 import hashlib
+import functools
 import pandas as pd
+import psycopg2.extras
 import streamlit as st
-from datetime import datetime, date
+from datetime import date
+
+from cache_versions import bump, DATA
 
 BANK_FORMATS = {
     "GTB (Guaranty Trust Bank)": {
@@ -182,30 +189,54 @@ def _clean_text(x, fallback="Imported expense"):
     return str(x).strip() or fallback
 
 
-def _to_date(val):
-    """Normalize a DB value (datetime, date, str) to a plain date object."""
-    if val is None:
-        return date.today()
-    if isinstance(val, datetime):
-        return val.date()
-    if isinstance(val, date):
-        return val
-    try:
-        return pd.to_datetime(val, dayfirst=True).date()
-    except Exception:
-        return date.today()
-
-
 def _row_fingerprint(bank_id, txn_date, amount, description):
     """
     FIX: Always use ISO date string so datetime vs date type never causes mismatches.
+    Must stay in step with import_fingerprint() in models.py (migration 14).
     """
     date_str = txn_date.isoformat() if hasattr(txn_date, "isoformat") else str(txn_date)[:10]
     raw = f"{bank_id}|{date_str}|{amount}|{description.strip().lower()}"
     return hashlib.sha256(raw.encode()).hexdigest()
 
 
+# OPTIMIZED: CATEGORY_KEYWORDS is compiled once per process into a single
+# regex instead of rows × keywords substring checks. The alternation sits in a
+# lookahead so every start position is tried, and alternatives are ordered by
+# category — so the lowest-index category matching anywhere is found, keeping
+# first-category-wins precedence. Results are memoized per normalized
+# description; statements repeat the same merchants over and over.
+
+def _compile_categories(categories: dict):
+    rank = {}   # keyword → index of the first category listing it
+    for i, keywords in enumerate(categories.values()):
+        for kw in keywords:
+            rank.setdefault(kw.lower(), i)
+    ordered = sorted(rank, key=lambda kw: rank[kw])
+    pattern = re.compile("(?=(" + "|".join(re.escape(kw) for kw in ordered) + "))")
+    return pattern, rank, list(categories)
+
+
+_CATEGORY_PATTERN, _KEYWORD_RANK, _CATEGORY_NAMES = _compile_categories(CATEGORY_KEYWORDS)
+
+
+@functools.lru_cache(maxsize=8192)
+def _category_for(desc_lower: str) -> str:
+    best = None
+    for m in _CATEGORY_PATTERN.finditer(desc_lower):
+        i = _KEYWORD_RANK[m.group(1)]
+        if best is None or i < best:
+            best = i
+            if i == 0:
+                break
+    return _CATEGORY_NAMES[best] if best is not None else "Other"
+
+
 def _guess_category(description):
+    return _category_for(description.lower().strip())
+
+
+def _guess_category_naive(description):
+    """The original per-keyword scan — kept as the benchmark baseline."""
     desc_lower = description.lower()
     for category, keywords in CATEGORY_KEYWORDS.items():
         if any(kw in desc_lower for kw in keywords):
@@ -240,53 +271,16 @@ def _auto_pick_col(columns, keywords):
     return None
 
 
-def _load_existing_fingerprints(cur, bank_id):
+def _existing_fingerprints(cur, bank_id, fingerprints):
     """
-    FIX: Normalize created_at to plain date before hashing so fingerprints
-    always match regardless of whether the DB returns datetime or date.
+    OPTIMIZED: one primary-key lookup against import_fingerprints (kept by
+    triggers on transactions) instead of hashing the bank's whole history.
     """
     cur.execute(
-        "SELECT amount, description, created_at FROM transactions "
-        "WHERE bank_id = %s AND type = 'debit'",
-        (bank_id,)
+        "SELECT fingerprint FROM import_fingerprints WHERE bank_id = %s AND fingerprint = ANY(%s)",
+        (bank_id, list(fingerprints))
     )
-    rows = cur.fetchall()
-    fps  = set()
-    for r in rows:
-        txn_date = _to_date(r["created_at"])          # ← FIX
-        fp = _row_fingerprint(bank_id, txn_date, int(r["amount"]), r["description"] or "")
-        fps.add(fp)
-    return fps
-
-
-def _ensure_import_tables(cur, conn):
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS import_batches (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            bank_id INTEGER NOT NULL REFERENCES banks(id) ON DELETE CASCADE,
-            filename TEXT,
-            row_count INTEGER DEFAULT 0,
-            total_amount INTEGER DEFAULT 0,
-            imported_at TIMESTAMP DEFAULT NOW(),
-            undone INTEGER DEFAULT 0
-        )
-    """)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS import_batch_items (
-            id SERIAL PRIMARY KEY,
-            batch_id INTEGER NOT NULL REFERENCES import_batches(id) ON DELETE CASCADE,
-            expense_id INTEGER REFERENCES expenses(id) ON DELETE SET NULL,
-            tx_id INTEGER REFERENCES transactions(id) ON DELETE SET NULL,
-            amount INTEGER NOT NULL,
-            bank_id INTEGER NOT NULL REFERENCES banks(id) ON DELETE CASCADE
-        )
-    """)
-    cur.execute("""
-        CREATE INDEX IF NOT EXISTS idx_import_batches_user_id
-            ON import_batches(user_id, imported_at DESC)
-    """)
-    conn.commit()
+    return {r["fingerprint"] for r in cur.fetchall()}
 
 
 def _get_last_batch(cur, user_id):
@@ -323,6 +317,199 @@ def _undo_batch(cur, conn, batch_id, user_id):
     return rows_reversed, total_reversed
 
 
+# ── bulk import ───────────────────────────────────────────────────────────────
+# OPTIMIZED: was four statements per row (transaction, expense, balance update,
+# batch item) — 8,000 round trips and 2,000 updates of the same bank row for a
+# 2,000-line statement. Rows are now staged with execute_values into a temp
+# table and written by one statement: batch header, transactions (ids
+# pre-allocated so expenses can link to them), expenses, batch items via
+# RETURNING, and a single balance debit. One transaction, all or nothing.
+
+_INT_MAX = 2**31 - 1
+
+_IMPORT_SQL = """
+    WITH batch AS (
+        INSERT INTO import_batches (user_id, bank_id, filename, row_count, total_amount, imported_at)
+        SELECT %(uid)s, %(bank_id)s, %(filename)s, COUNT(*), COALESCE(SUM(amount), 0), NOW()
+        FROM _import_rows
+        RETURNING id
+    ),
+    input AS (
+        SELECT s.*, nextval(pg_get_serial_sequence('transactions', 'id')) AS tx_id
+        FROM _import_rows s
+    ),
+    tx AS (
+        INSERT INTO transactions (id, user_id, bank_id, type, amount, description, created_at)
+        SELECT tx_id, %(uid)s, %(bank_id)s, 'debit', amount, 'Expense: ' || name, day
+        FROM input
+        RETURNING id
+    ),
+    exp AS (
+        INSERT INTO expenses (user_id, bank_id, name, category, amount, created_at, tx_id)
+        SELECT %(uid)s, %(bank_id)s, i.name, i.category, i.amount, i.day, i.tx_id
+        FROM input i JOIN tx ON tx.id = i.tx_id
+        RETURNING id, tx_id, amount
+    ),
+    items AS (
+        INSERT INTO import_batch_items (batch_id, expense_id, tx_id, amount, bank_id)
+        SELECT batch.id, exp.id, exp.tx_id, exp.amount, %(bank_id)s
+        FROM exp CROSS JOIN batch
+        RETURNING amount
+    ),
+    debit AS (
+        UPDATE banks SET balance = balance - (SELECT COALESCE(SUM(amount), 0) FROM input)
+        WHERE id = %(bank_id)s AND user_id = %(uid)s
+        RETURNING balance
+    )
+    SELECT (SELECT id FROM batch)                         AS batch_id,
+           (SELECT COUNT(*) FROM items)                   AS imported,
+           (SELECT COALESCE(SUM(amount), 0) FROM items)   AS total,
+           (SELECT balance FROM debit)                    AS balance
+"""
+
+
+def _validate_rows(rows):
+    """
+    Catch what would make Postgres reject a row before anything is written,
+    so one bad line is reported instead of aborting the whole batch.
+    Returns (valid_rows, broken_rows) — broken rows as {"row", "error"}.
+    """
+    valid, broken = [], []
+    for r in rows:
+        if not 0 < r["amount"] <= _INT_MAX:
+            error = f"amount {r['amount']:,} is out of range"
+        elif "\x00" in r["description"]:
+            error = "description contains a NUL character"
+        elif not isinstance(r["date"], date):
+            error = f"unreadable date {r['date']!r}"
+        else:
+            valid.append(r)
+            continue
+        broken.append({"row": r["_row_idx"] + 2, "error": error})
+    return valid, broken
+
+
+def _bulk_import(cur, user_id, bank_id, filename, rows):
+    """Write `rows` as one import batch. The caller commits or rolls back."""
+    cur.execute("""
+        CREATE TEMP TABLE IF NOT EXISTS _import_rows (
+            n INTEGER, day DATE, name TEXT, category TEXT, amount INTEGER
+        ) ON COMMIT DROP
+    """)
+    cur.execute("TRUNCATE _import_rows")
+    psycopg2.extras.execute_values(
+        cur,
+        "INSERT INTO _import_rows (n, day, name, category, amount) VALUES %s",
+        [(i, r["date"], r["description"], r["category"], r["amount"]) for i, r in enumerate(rows)],
+        page_size=1000,
+    )
+    cur.execute(_IMPORT_SQL, {"uid": user_id, "bank_id": bank_id, "filename": filename})
+    return cur.fetchone()
+
+
+# ── vectorized cleaning ───────────────────────────────────────────────────────
+# One pass per column instead of per-row Python calls; cached so adjusting the
+# column mapping or any other widget doesn't re-parse and re-clean the file.
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _read_csv(data: bytes) -> pd.DataFrame:
+    """Parse uploaded bytes — UTF-8, falling back to latin-1."""
+    try:
+        return pd.read_csv(io.BytesIO(data))
+    except UnicodeDecodeError:
+        return pd.read_csv(io.BytesIO(data), encoding="latin-1")
+
+
+def _clean_amounts(col: pd.Series) -> pd.Series:
+    """Vectorized _clean_amount: absolute value, NaN where missing / unparseable / zero."""
+    if pd.api.types.is_numeric_dtype(col):
+        amounts = pd.to_numeric(col, errors="coerce")
+    else:
+        text = col.astype(str).where(col.notna(), "")
+        text = text.str.replace(",", "", regex=False).str.replace(r"[^0-9.\-]", "", regex=True)
+        amounts = pd.to_numeric(text, errors="coerce")
+    amounts = amounts.abs()
+    return amounts.where(amounts > 0)
+
+
+def _clean_dates(col: pd.Series) -> pd.Series:
+    """Vectorized _clean_date: one to_datetime over the column, today where unparseable."""
+    parsed = pd.to_datetime(col, errors="coerce", dayfirst=True)
+    # A column-wide parse infers one format; give rows in another format a second chance.
+    retry = parsed.isna() & col.notna()
+    if retry.any():
+        try:
+            parsed[retry] = pd.to_datetime(col[retry], errors="coerce", dayfirst=True, format="mixed")
+        except (TypeError, ValueError):
+            pass
+    today = date.today()
+    return pd.Series([d.date() if not pd.isna(d) else today for d in parsed], index=col.index, dtype=object)
+
+
+def _clean_texts(col: pd.Series, fallback="Imported expense") -> pd.Series:
+    """Vectorized _clean_text."""
+    text = col.astype(str).where(col.notna(), "").str.strip()
+    return text.mask(text == "", fallback)
+
+
+def _clean_rows_slow(df, amount_col, date_col, desc_col, skip_kws):
+    """Row-by-row cleaning — only used when a column defeats the vectorized path."""
+    rows_raw, broken_rows = [], []
+    for idx, row in df.iterrows():
+        try:
+            desc = _clean_text(row.get(desc_col))
+            if skip_kws and any(kw in desc.lower() for kw in skip_kws):
+                continue
+            amt = _clean_amount(row.get(amount_col))
+            if amt is None or amt <= 0:
+                continue
+            raw_date = row.get(date_col) if date_col else None
+            txn_date = _clean_date(raw_date) if raw_date is not None else date.today()
+            rows_raw.append({
+                "date": txn_date, "description": desc,
+                "amount": int(round(amt)), "category": _guess_category(desc),
+                "_row_idx": idx,
+            })
+        except Exception as exc:
+            broken_rows.append({"row": idx + 2, "error": str(exc)})
+    return rows_raw, broken_rows
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _clean_frame(df: pd.DataFrame, amount_col: str, date_col, desc_col: str, skip_kws: tuple):
+    """
+    Statement rows → (rows_raw, broken_rows), same shapes as the per-row loop:
+    skip-keyword rows and rows without a positive amount are dropped, missing
+    or unparseable dates become today, descriptions are categorised.
+    """
+    try:
+        desc = _clean_texts(df[desc_col])
+        keep = pd.Series(True, index=df.index)
+        if skip_kws:
+            pattern = "|".join(re.escape(kw) for kw in skip_kws)
+            keep &= ~desc.str.lower().str.contains(pattern, regex=True)
+        amounts = _clean_amounts(df[amount_col])
+        keep &= amounts.notna()
+
+        kept  = df.index[keep]
+        desc  = desc[kept]
+        dates = _clean_dates(df.loc[kept, date_col]) if date_col else \
+            pd.Series(date.today(), index=kept, dtype=object)
+        out = pd.DataFrame({
+            "date":        dates,
+            "description": desc,
+            "amount":      amounts[kept].round().astype("int64"),
+            "category":    desc.map(_guess_category),
+            "_row_idx":    kept,
+        })
+        rows_raw = out.to_dict("records")
+        for r in rows_raw:
+            r["amount"] = int(r["amount"])
+        return rows_raw, []
+    except Exception:
+        return _clean_rows_slow(df, amount_col, date_col, desc_col, skip_kws)
+
+
 # ── mobile-optimised styles ────────────────────────────────────────────────────
 
 _IMPORT_CSS = """
@@ -369,8 +556,6 @@ _IMPORT_CSS = """
 
 def csv_import_page(conn, user_id: int):
     cur = conn.cursor()
-    _ensure_import_tables(cur, conn)
-
     st.markdown(_IMPORT_CSS, unsafe_allow_html=True)
 
     # 1. Load banks
@@ -428,10 +613,7 @@ def csv_import_page(conn, user_id: int):
 
     # Parse CSV — try UTF-8, fall back to latin-1
     try:
-        df = pd.read_csv(file)
-    except UnicodeDecodeError:
-        file.seek(0)
-        df = pd.read_csv(file, encoding="latin-1")
+        df = _read_csv(file.getvalue())
     except Exception as e:
         st.error(f"Could not read CSV: {e}")
         return
@@ -489,35 +671,17 @@ def csv_import_page(conn, user_id: int):
         st.info("Please map at least the **Amount** and **Description** columns to continue.")
         return
 
-    # 6. Build and clean working data
-    skip_kws    = fmt.get("skip_keywords", [])
-    rows_raw    = []
-    broken_rows = []
-
-    for idx, row in df.iterrows():
-        try:
-            raw_amount = row.get(amount_col)
-            raw_desc   = row.get(desc_col)  if desc_col  != "(none)" else None
-            raw_date   = row.get(date_col)  if date_col  != "(none)" else None
-
-            desc = _clean_text(raw_desc)
-            if skip_kws and any(kw in desc.lower() for kw in skip_kws):
-                continue
-
-            amt = _clean_amount(raw_amount)
-            if amt is None or amt <= 0:
-                continue
-
-            txn_date = _clean_date(raw_date) if raw_date is not None else date.today()
-            category = _guess_category(desc)
-
-            rows_raw.append({
-                "date": txn_date, "description": desc,
-                "amount": int(round(amt)), "category": category,
-                "_row_idx": idx,
-            })
-        except Exception as exc:
-            broken_rows.append({"row": idx + 2, "error": str(exc)})
+    # 6. Build and clean working data — vectorized, cached per file + mapping
+    skip_kws = tuple(fmt.get("skip_keywords", []))
+    rows_raw, broken_rows = _clean_frame(
+        df,
+        amount_col,
+        date_col if date_col != "(none)" else None,
+        desc_col,
+        skip_kws,
+    )
+    rows_raw, invalid_rows = _validate_rows(rows_raw)
+    broken_rows = broken_rows + invalid_rows
 
     if broken_rows:
         with st.expander(f"{len(broken_rows)} broken row(s) skipped", expanded=False):
@@ -529,10 +693,10 @@ def csv_import_page(conn, user_id: int):
         return
 
     # 7. Duplicate detection (uses normalized date fingerprints — FIX)
-    existing_fps = _load_existing_fingerprints(cur, bank_id)
+    fps          = [_row_fingerprint(bank_id, r["date"], r["amount"], r["description"]) for r in rows_raw]
+    existing_fps = _existing_fingerprints(cur, bank_id, set(fps))
     new_rows, dup_rows = [], []
-    for r in rows_raw:
-        fp = _row_fingerprint(bank_id, r["date"], r["amount"], r["description"])
+    for r, fp in zip(rows_raw, fps):
         (dup_rows if fp in existing_fps else new_rows).append(r)
 
     # 8. Preview
@@ -615,82 +779,61 @@ def csv_import_page(conn, user_id: int):
         return
 
     if st.button(btn_label, use_container_width=True, type="primary", key="csv_import_btn"):
-        imported      = 0
-        import_errors = []
-        total_to_do   = len(new_rows)
-        progress      = st.progress(0, text="Importing\u2026")
-
         try:
-            cur.execute("""
-                INSERT INTO import_batches
-                    (user_id, bank_id, filename, row_count, total_amount, imported_at)
-                VALUES (%s, %s, %s, %s, %s, NOW()) RETURNING id
-            """, (user_id, bank_id, filename, len(new_rows), total_new))
-            batch_id = cur.fetchone()["id"]
-
-            for i, r in enumerate(new_rows):
-                try:
-                    amt      = r["amount"]
-                    desc     = r["description"]
-                    cat      = r["category"]
-                    txn_date = r["date"]
-
-                    cur.execute("""
-                        INSERT INTO transactions (bank_id, type, amount, description, created_at)
-                        VALUES (%s, 'debit', %s, %s, %s) RETURNING id
-                    """, (bank_id, amt, f"Expense: {desc}", txn_date))
-                    tx_id = cur.fetchone()["id"]
-
-                    cur.execute("""
-                        INSERT INTO expenses
-                            (user_id, bank_id, name, category, amount, created_at, tx_id)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id
-                    """, (user_id, bank_id, desc, cat, amt, txn_date, tx_id))
-                    expense_id = cur.fetchone()["id"]
-
-                    cur.execute("UPDATE banks SET balance = balance - %s WHERE id = %s",
-                                (amt, bank_id))
-
-                    cur.execute("""
-                        INSERT INTO import_batch_items
-                            (batch_id, expense_id, tx_id, amount, bank_id)
-                        VALUES (%s, %s, %s, %s, %s)
-                    """, (batch_id, expense_id, tx_id, amt, bank_id))
-
-                    imported += 1
-                except Exception as row_exc:
-                    import_errors.append(str(row_exc))
-
-                # Update progress every 10 rows to avoid UI flooding
-                if i % 10 == 0 or i == total_to_do - 1:
-                    progress.progress(
-                        (i + 1) / total_to_do,
-                        text=f"Importing\u2026 {i + 1}/{total_to_do}"
-                    )
-
-            actual_total = sum(r["amount"] for r in new_rows[:imported])
-            cur.execute(
-                "UPDATE import_batches SET row_count=%s, total_amount=%s WHERE id=%s",
-                (imported, actual_total, batch_id)
-            )
-            conn.commit()
-            progress.empty()
-
-            if imported > 0:
-                st.markdown(
-                    f'<div class="imp-ok-box">\u2705 <strong>Imported {imported} expenses</strong> '
-                    f'from <strong>{selected_bank["bank_name"]}</strong> successfully! '
-                    f'Your balance has been updated.<br>'
-                    f'<em>To undo, reload this page and expand \u201cUndo last import\u201d above.</em></div>',
-                    unsafe_allow_html=True
+            with st.spinner(f"Importing {len(new_rows)} expenses\u2026"):
+                result = _bulk_import(cur, user_id, bank_id, filename, new_rows)
+            if result["balance"] is None:
+                raise ValueError("bank account not found")
+            if result["balance"] < 0 and not allow_overdraft:
+                raise ValueError(
+                    f"your {selected_bank['bank_name']} balance changed and would go to "
+                    f"\u20a6{result['balance']:,}"
                 )
-                st.balloons()
-            if import_errors:
-                with st.expander(f"{len(import_errors)} row(s) failed during import"):
-                    for err in import_errors:
-                        st.caption(err)
-
+            conn.commit()
         except Exception as e:
             conn.rollback()
-            progress.empty()
             st.error(f"Import failed \u2014 no data was changed. Error: {e}")
+            return
+
+        bump(user_id, DATA)
+        st.markdown(
+            f'<div class="imp-ok-box">\u2705 <strong>Imported {result["imported"]} expenses</strong> '
+            f'from <strong>{selected_bank["bank_name"]}</strong> successfully! '
+            f'Your balance has been updated.<br>'
+            f'<em>To undo, reload this page and expand \u201cUndo last import\u201d above.</em></div>',
+            unsafe_allow_html=True
+        )
+        st.balloons()
+
+
+# ── Benchmark ─────────────────────────────────────────────────────────────────
+
+def _bench(rows: int = 20_000, merchants: int = 400) -> None:
+    """Compiled + memoized categorizer vs the per-keyword scan on a synthetic statement."""
+    import random
+    rng   = random.Random(7)
+    words = [kw for kws in CATEGORY_KEYWORDS.values() for kw in kws]
+    pool  = [f"POS/WEB {rng.choice(words).upper()} {rng.choice(['LAGOS', 'ABUJA', 'IKEJA', 'NG'])}"
+             if rng.random() < 0.8 else f"TRF/{rng.randint(10**6, 10**7)}/PAYMENT REF"
+             for _ in range(merchants)]
+    descs = [rng.choice(pool) for _ in range(rows)]
+
+    mismatches = sum(_guess_category(d) != _guess_category_naive(d) for d in pool)
+    print(f"{rows} rows, {merchants} distinct descriptions, {mismatches} mismatches")
+    print(f"{'impl':>10}  {'ms':>8}  {'rows/s':>10}")
+    for name, fn in (("naive", _guess_category_naive), ("compiled", _guess_category)):
+        _category_for.cache_clear()
+        t0 = time.perf_counter()
+        for d in descs:
+            fn(d)
+        dt = time.perf_counter() - t0
+        print(f"{name:>10}  {dt * 1000:>8.1f}  {rows / dt:>10.0f}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "--bench" in args:
+        nums = [int(a) for a in args if a.isdigit()]
+        _bench(*nums[:2])
+    else:
+        print("usage: python csv_import.py --bench [rows [merchants]]")
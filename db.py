@@ -1,55 +1,460 @@
 # db.py — database connection with persistent connection pooling
 # Uses st.cache_resource so the pool truly persists across Streamlit reruns
 # (module-level globals can be reset by Streamlit's module reloader).
+#
+# Connection affinity: inside a Streamlit script run every get_db() block
+# shares ONE checked-out connection (one transaction per block). The
+# connection goes back to the pool when the run's script thread finishes,
+# or earlier via release_run_connection().
+#
+# Read/write split: get_db(readonly=True) draws from a second pool pointed at
+# SUPABASE_DB_READ_URL (a read replica). Without that secret it falls back to
+# the primary pool, so callers never need to know whether a replica exists.
+import os
+import sys
+import time
+import threading
+import weakref
+from collections import deque
+from datetime import datetime
+
 import streamlit as st
 import psycopg2
 import psycopg2.pool
-import psycopg2.extras
 from contextlib import contextmanager
 
+from query_profiler import ProfilingCursor
+
+try:
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+except ImportError:  # very old / very new Streamlit layouts
+    def get_script_run_ctx():
+        return None
+
+
+class PoolOverloaded(psycopg2.pool.PoolError):
+    """
+    No connection became free within the checkout timeout, or the wait queue
+    is already full. Pages can catch this and show OVERLOAD_MESSAGE instead
+    of a raw database error.
+    """
+
+
+OVERLOAD_MESSAGE = (
+    "Budget Right is very busy right now and could not reach the database in time. "
+    "Please wait a few seconds and try again — nothing was saved or lost."
+)
+
+
+def render_overload_notice() -> None:
+    """Standard page-level response to PoolOverloaded."""
+    st.warning(OVERLOAD_MESSAGE)
+    if st.button("Try again", key="_pool_overload_retry"):
+        st.rerun()
+
+
+def setting(name: str, default):
+    """st.secrets[name] coerced to type(default); `default` when unset or unparseable."""
+    try:
+        return type(default)(st.secrets.get(name, default))
+    except Exception:
+        return default
+
+
+PRIMARY = "primary"
+REPLICA = "replica"
+
+
+def _replica_configured() -> bool:
+    try:
+        return bool(st.secrets.get("SUPABASE_DB_READ_URL"))
+    except Exception:
+        return False
+
+
+def _pool_name(readonly: bool) -> str:
+    return REPLICA if readonly and _replica_configured() else PRIMARY
+
+
+def pool_names() -> list:
+    """Pools active in this process — [primary] or [primary, replica]."""
+    return [PRIMARY, REPLICA] if _replica_configured() else [PRIMARY]
+
 
 @st.cache_resource
-def _get_pool() -> psycopg2.pool.ThreadedConnectionPool:
+def _get_pool(name: str = PRIMARY) -> psycopg2.pool.ThreadedConnectionPool:
     """
-    Create the connection pool once per server process.
+    Create each connection pool once per server process.
     st.cache_resource keeps it alive across all reruns and all users
     — far more reliable than a module-level global on Streamlit Cloud.
     """
+    if name == REPLICA:
+        return psycopg2.pool.ThreadedConnectionPool(
+            minconn=1,
+            maxconn=setting("DB_READ_POOL_MAXCONN", 8),
+            dsn=st.secrets["SUPABASE_DB_READ_URL"],
+            cursor_factory=ProfilingCursor,
+        )
     return psycopg2.pool.ThreadedConnectionPool(
         minconn=1,
-        maxconn=8,           # Supabase free tier: 15 direct / 200 pooler
+        maxconn=setting("DB_POOL_MAXCONN", 8),   # Supabase free tier: 15 direct / 200 pooler
         dsn=st.secrets["SUPABASE_DB_URL"],
-        cursor_factory=psycopg2.extras.RealDictCursor,
+        cursor_factory=ProfilingCursor,   # RealDictCursor + optional timing
     )
 
 
+# ── Fair, bounded-wait checkout ───────────────────────────────────────────────
+# psycopg2's getconn() raises PoolError the instant all slots are taken. The
+# gate hands out one permit per pool slot; when none are free, callers queue
+# FIFO for up to DB_POOL_TIMEOUT_S seconds. At most DB_POOL_MAX_WAITERS may
+# queue — beyond that the caller is told immediately that we are overloaded.
+
+class _Waiter:
+    __slots__ = ("event", "granted")
+
+    def __init__(self):
+        self.event   = threading.Event()
+        self.granted = False
+
+
+class _CheckoutGate:
+    def __init__(self, permits: int, timeout: float, max_waiters: int):
+        self.lock        = threading.Lock()
+        self.permits     = permits
+        self.timeout     = timeout
+        self.max_waiters = max_waiters
+        self.waiters     = deque()
+
+    def acquire(self) -> None:
+        with self.lock:
+            if self.permits > 0 and not self.waiters:
+                self.permits -= 1
+                return
+            if len(self.waiters) >= self.max_waiters:
+                raise PoolOverloaded(
+                    f"connection wait queue full ({self.max_waiters} waiting)")
+            waiter = _Waiter()
+            self.waiters.append(waiter)
+        waiter.event.wait(self.timeout)
+        with self.lock:
+            if waiter.granted:
+                return
+            self.waiters.remove(waiter)
+        raise PoolOverloaded(f"no connection free after {self.timeout:g}s")
+
+    def release(self) -> None:
+        with self.lock:
+            if self.waiters:
+                # Hand the permit straight to the oldest waiter (FIFO)
+                waiter = self.waiters.popleft()
+                waiter.granted = True
+                waiter.event.set()
+            else:
+                self.permits += 1
+
+    @property
+    def waiting(self) -> int:
+        return len(self.waiters)
+
+
+@st.cache_resource
+def _get_gate(name: str = PRIMARY) -> _CheckoutGate:
+    return _CheckoutGate(
+        permits=_get_pool(name).maxconn,
+        timeout=setting("DB_POOL_TIMEOUT_S", 5.0),
+        max_waiters=setting("DB_POOL_MAX_WAITERS", 32),
+    )
+
+
+# ── Pool instrumentation ──────────────────────────────────────────────────────
+# Every checkout/return goes through _checkout()/_return_connection() so the
+# Admin Panel can show wait times, hold times, exhaustion events and which
+# call site currently holds each connection.
+
+_SAMPLE_SIZE = 500   # rolling window for timing percentiles
+_DB_FILES    = (os.path.abspath(__file__), "contextlib.py")
+
+
+class _PoolStats:
+    """Process-wide counters for the connection pool (thread-safe)."""
+
+    def __init__(self):
+        self.lock         = threading.Lock()
+        self.started_at   = datetime.now()
+        self.checkouts    = 0
+        self.exhaustions  = 0
+        self.blocks       = 0
+        self.wait_ms      = deque(maxlen=_SAMPLE_SIZE)
+        self.hold_ms      = deque(maxlen=_SAMPLE_SIZE)
+        self.block_ms     = deque(maxlen=_SAMPLE_SIZE)
+        self.events       = deque(maxlen=50)    # (when, site, message)
+        self.holders      = {}                  # id(conn) → {site, since, block_site}
+
+
+@st.cache_resource
+def _get_stats(name: str = PRIMARY) -> _PoolStats:
+    return _PoolStats()
+
+
+def _call_site() -> str:
+    """First frame outside db.py / contextlib — the code asking for a connection."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        fname = frame.f_code.co_filename
+        if not fname.endswith(_DB_FILES[1]) and os.path.abspath(fname) != _DB_FILES[0]:
+            return f"{os.path.basename(fname)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return "?"
+
+
+def _checkout(name: str = PRIMARY):
+    """Queue for a permit, then getconn() — with wait-time, exhaustion and holder bookkeeping."""
+    stats = _get_stats(name)
+    gate  = _get_gate(name)
+    site  = _call_site()
+    t0    = time.perf_counter()
+    try:
+        gate.acquire()
+    except PoolOverloaded as e:
+        with stats.lock:
+            stats.exhaustions += 1
+            stats.events.append((datetime.now(), site, str(e)))
+        raise
+    try:
+        conn = _get_pool(name).getconn()
+        if name == REPLICA and not conn.readonly:
+            conn.readonly = True   # belt and braces: replica sessions never write
+    except Exception as e:
+        gate.release()
+        if isinstance(e, psycopg2.pool.PoolError):
+            with stats.lock:
+                stats.exhaustions += 1
+                stats.events.append((datetime.now(), site, str(e)))
+        raise
+    waited = (time.perf_counter() - t0) * 1000
+    with stats.lock:
+        stats.checkouts += 1
+        stats.wait_ms.append(waited)
+        stats.holders[id(conn)] = {"site": site, "since": time.perf_counter(),
+                                   "block_site": site}
+    return conn
+
+
+def _note_block(name: str, started: float) -> None:
+    stats = _get_stats(name)
+    with stats.lock:
+        stats.blocks += 1
+        stats.block_ms.append((time.perf_counter() - started) * 1000)
+
+
+def _note_block_site(name: str, conn) -> None:
+    stats = _get_stats(name)
+    with stats.lock:
+        held = stats.holders.get(id(conn))
+        if held is not None:
+            held["block_site"] = _call_site()
+
+
 def get_connection():
     """Get a raw connection from the pool (caller must return it)."""
-    return _get_pool().getconn()
+    return _checkout()
 
 
-def _return_connection(conn, error: bool = False) -> None:
+def _return_connection(conn, error: bool = False, name: str = PRIMARY) -> None:
+    stats = _get_stats(name)
+    with stats.lock:
+        held = stats.holders.pop(id(conn), None)
+        if held is not None:
+            stats.hold_ms.append((time.perf_counter() - held["since"]) * 1000)
     try:
-        _get_pool().putconn(conn, close=error)
+        _get_pool(name).putconn(conn, close=error)
     except Exception:
         pass
+    if held is not None:
+        _get_gate(name).release()
 
 
-@contextmanager
-def get_db():
+def _pct(samples, q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+
+def get_pool_stats(name: str = PRIMARY) -> dict:
     """
-    Yield (conn, cursor).  Commits on success, rolls back on exception.
-    Returns the connection to the pool — never closes it.
-    Multiple get_db() calls within one request reuse the same pool slot.
+    Snapshot of one pool's health for the Admin Panel: sizes, in-use/idle/queued
+    counts, wait/hold/block timings (p50/p95/max over the last _SAMPLE_SIZE samples),
+    exhaustion events and the call sites currently holding connections.
     """
-    conn   = _get_pool().getconn()
-    cursor = conn.cursor()
+    pool  = _get_pool(name)
+    stats = _get_stats(name)
+    now   = time.perf_counter()
+    with stats.lock:
+        wait, hold, block = list(stats.wait_ms), list(stats.hold_ms), list(stats.block_ms)
+        holders = [
+            {"site": h["site"], "current_block": h["block_site"],
+             "held_s": round(now - h["since"], 2)}
+            for h in stats.holders.values()
+        ]
+        events  = [{"at": w, "site": s, "error": m} for w, s, m in reversed(stats.events)]
+        result  = {
+            "started_at":  stats.started_at,
+            "checkouts":   stats.checkouts,
+            "blocks":      stats.blocks,
+            "exhaustions": stats.exhaustions,
+        }
+    result.update({
+        "minconn":  pool.minconn,
+        "maxconn":  pool.maxconn,
+        "in_use":   len(pool._used),
+        "idle":     len(pool._pool),
+        "waiting":  _get_gate(name).waiting,
+        "timeout_s": _get_gate(name).timeout,
+        "wait_ms":  {"p50": _pct(wait, 0.5),  "p95": _pct(wait, 0.95),  "max": round(max(wait, default=0), 1)},
+        "hold_ms":  {"p50": _pct(hold, 0.5),  "p95": _pct(hold, 0.95),  "max": round(max(hold, default=0), 1)},
+        "block_ms": {"p50": _pct(block, 0.5), "p95": _pct(block, 0.95), "max": round(max(block, default=0), 1)},
+        "holders":  sorted(holders, key=lambda h: h["held_s"], reverse=True),
+        "events":   events,
+    })
+    return result
+
+
+# ── Per-run connection scope ──────────────────────────────────────────────────
+# Streamlit executes each script run on its own ScriptRunner thread, so a
+# thread-local is a natural "request" scope. The holder is finalized when the
+# thread exits (CPython drops the thread's local dict), which hands the
+# connection back even if the run ended via st.stop() / st.rerun().
+
+_run_scope = threading.local()
+
+
+class _RunConnection:
+    """Holds the connection checked out from one pool for the current script run."""
+
+    __slots__ = ("name", "conn", "depth", "_finalizer", "__weakref__")
+
+    def __init__(self, name, conn):
+        self.name       = name
+        self.conn       = conn
+        self.depth      = 0
+        self._finalizer = weakref.finalize(self, _return_connection, conn, False, name)
+
+    def release(self, error: bool = False) -> None:
+        if self._finalizer.detach() is not None:
+            _return_connection(self.conn, error=error, name=self.name)
+
+
+def _in_script_run() -> bool:
+    try:
+        return get_script_run_ctx() is not None
+    except Exception:
+        return False
+
+
+def _run_holders() -> dict:
+    holders = getattr(_run_scope, "holders", None)
+    if holders is None:
+        holders = _run_scope.holders = {}
+    return holders
+
+
+def _run_connection(name: str):
+    """
+    Return this script run's connection for pool `name`, checking one out on
+    first use. Returns None outside a script run (background threads,
+    CLI jobs) — callers then fall back to a per-block checkout.
+    """
+    if not _in_script_run():
+        return None
+    holders = _run_holders()
+    holder  = holders.get(name)
+    if holder is not None and holder.conn.closed:
+        holder.release(error=True)
+        holder = None
+    if holder is None:
+        holder = holders[name] = _RunConnection(name, _checkout(name))
+    return holder
+
+
+def release_run_connection() -> None:
+    """
+    Return this run's connections to their pools now instead of waiting for
+    the script thread to exit. Safe to call when nothing is held.
+    """
+    holders = _run_holders()
+    for name, holder in list(holders.items()):
+        if holder.depth == 0:
+            del holders[name]
+            holder.release()
+
+
+@contextmanager
+def _scoped_block(holder):
+    conn    = holder.conn
+    cursor  = conn.cursor()
+    started = time.perf_counter()
+    holder.depth += 1
+    _note_block_site(holder.name, conn)
+    try:
+        yield conn, cursor
+        conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        if conn.closed:
+            # Broken socket — drop it so the next block gets a fresh one
+            _run_holders().pop(holder.name, None)
+            holder.release(error=True)
+        raise
+    finally:
+        holder.depth -= 1
+        _note_block(holder.name, started)
+        try:
+            cursor.close()
+        except Exception:
+            pass
+
+
+@contextmanager
+def _pooled_block(name: str):
+    conn    = _checkout(name)
+    cursor  = conn.cursor()
+    started = time.perf_counter()
     try:
         yield conn, cursor
         conn.commit()
     except Exception:
         conn.rollback()
-        _return_connection(conn, error=True)
+        _note_block(name, started)
+        _return_connection(conn, error=True, name=name)
         raise
     else:
-        _return_connection(conn, error=False)
+        _note_block(name, started)
+        _return_connection(conn, error=False, name=name)
+
+
+@contextmanager
+def get_db(readonly: bool = False):
+    """
+    Yield (conn, cursor).  Commits on success, rolls back on exception.
+    Returns the connection to the pool — never closes it.
+    Multiple get_db() calls within one script run reuse the same pool slot;
+    each block is still its own transaction. A nested get_db() (opened while
+    another block is active) checks out a separate connection so the inner
+    commit never ends the outer transaction.
+
+    readonly=True routes the block to the read-replica pool (when configured).
+    Use it only for reads that tolerate a little replication lag — anything
+    that must see a write from the same rerun belongs on the primary.
+    """
+    name   = _pool_name(readonly)
+    holder = _run_connection(name)
+    if holder is not None and holder.depth == 0:
+        with _scoped_block(holder) as pair:
+            yield pair
+    else:
+        with _pooled_block(name) as pair:
+            yield pair
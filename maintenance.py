@@ -0,0 +1,88 @@
+# maintenance.py — pruning for the tables in the login hot path
+#
+# rate_limit_log gains a row on every login / reset / resend attempt and
+# session_tokens a row on every sign-in; neither was ever cleaned up. This job
+# deletes rows that can no longer affect a decision, in bounded batches — each
+# batch is its own short transaction, so logins are never blocked behind one
+# long DELETE. analytics_logins is collapsed to one row per user per day by
+# migration 11 and kept that way by its unique index. The job also creates
+# upcoming month partitions once transactions/expenses are partitioned.
+#
+#   python maintenance.py              → prune everything, print rows reclaimed
+#   python maintenance.py --batch 500  → smaller batches
+#
+# The Admin Panel's Maintenance tab runs the same job.
+#
+# Public API
+# ──────────
+#   run_maintenance(batch_size)   → dict {table: rows reclaimed, ..., partitions_created, elapsed_s}
+from __future__ import annotations
+
+import sys
+import time
+from datetime import datetime, timedelta
+
+from db import get_db
+from auth import SESSION_EXPIRY_DAYS
+from models import ensure_partitions
+
+
+BATCH_SIZE = 5_000
+# Longest rate-limit window in use is 15 minutes; a day of history is ample
+# for the Admin Panel and support questions, and irrelevant to the limiter.
+RATE_LIMIT_RETENTION = timedelta(days=1)
+
+
+def _delete_in_batches(table: str, where: str, params: tuple, batch_size: int) -> int:
+    """DELETE matching rows `batch_size` at a time. Returns total rows deleted."""
+    total = 0
+    while True:
+        with get_db() as (conn, cursor):
+            cursor.execute(
+                f"DELETE FROM {table} WHERE id IN "
+                f"(SELECT id FROM {table} WHERE {where} LIMIT %s)",
+                params + (batch_size,)
+            )
+            deleted = cursor.rowcount
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+def _prune_rate_limit_log(batch_size: int) -> int:
+    cutoff = datetime.now() - RATE_LIMIT_RETENTION
+    return _delete_in_batches("rate_limit_log", "attempted_at < %s", (cutoff,), batch_size)
+
+
+def _prune_session_tokens(batch_size: int) -> int:
+    # Same cutoff validate_session_token applies — these can never log anyone in.
+    cutoff = datetime.now() - timedelta(days=SESSION_EXPIRY_DAYS)
+    return _delete_in_batches("session_tokens", "created_at < %s", (cutoff,), batch_size)
+
+
+def run_maintenance(batch_size: int = BATCH_SIZE) -> dict:
+    """Prune every maintained table. Returns rows reclaimed per table and the elapsed seconds."""
+    t0 = time.perf_counter()
+    report = {
+        "rate_limit_log":   _prune_rate_limit_log(batch_size),
+        "session_tokens":   _prune_session_tokens(batch_size),
+    }
+    report["partitions_created"] = ensure_partitions()
+    report["elapsed_s"] = round(time.perf_counter() - t0, 2)
+    return report
+
+
+def _cli(argv) -> None:
+    batch_size = int(argv[argv.index("--batch") + 1]) if "--batch" in argv else BATCH_SIZE
+    report  = run_maintenance(batch_size)
+    elapsed = report.pop("elapsed_s")
+    made    = report.pop("partitions_created")
+    for table, n in report.items():
+        print(f"  {table:<18} {n:>8,} row(s) reclaimed")
+    if made:
+        print(f"  created {made} month partition(s)")
+    print(f"Done in {elapsed}s.")
+
+
+if __name__ == "__main__":
+    _cli(sys.argv[1:])
@@ -1,13 +1,34 @@
 # models.py — CREATE TABLE, migrations, indexes
 #
-# All work happens in ONE connection grabbed once and released at the end.
-# @st.cache_resource ensures this runs only once per server process — every
-# subsequent call across all users is an instant in-memory cache hit.
+# Schema changes are an ordered registry of versioned migrations recorded in
+# schema_migrations. On a warm database, startup is ONE query: read the applied
+# versions and compare with the registry. Pending migrations run in order, each
+# in its own transaction under an advisory lock, so concurrent server processes
+# never apply the same version twice.
+#
+# Migrations flagged deferred=True (long backfills, big index builds) are
+# skipped at startup and run out-of-band:
+#
+#   python models.py --status        → list applied / pending versions
+#   python models.py --deferred      → apply everything, including deferred
+#   python models.py --deferred 15   → apply only the listed deferred versions
+#
+# Once the deferred partitioning migration (010) has run, transactions and
+# expenses are range-partitioned by month. Startup also creates the next few
+# months' partitions; old years are archived with
+#   ALTER TABLE transactions DETACH PARTITION transactions_2023_01
+#
+# @st.cache_resource ensures the startup check runs only once per server
+# process — every subsequent call is an instant in-memory cache hit.
 
+import sys
 import streamlit as st
 from db import get_db
 
 
+_MIGRATION_LOCK_KEY = 7_202_401   # pg advisory lock id shared by all processes
+
+
 def _col_type(cursor, table, column):
     """Return current data_type of a column, '' if not found."""
     cursor.execute("""
@@ -18,283 +39,1007 @@ def _col_type(cursor, table, column):
     return (row["data_type"] or "").lower() if row else ""
 
 
-@st.cache_resource(show_spinner=False)
-def create_tables():
-    """
-    Runs ONCE per server process. Uses a single connection for all DDL so
-    the pool (size 8) is never exhausted. Every subsequent call is a free
-    cache hit — zero DB work, zero latency.
-    """
-    with get_db() as (conn, cursor):
+def _safe_execute(cursor, sql, params=None) -> bool:
+    """Execute inside a SAVEPOINT so one failure doesn't abort the whole migration."""
+    cursor.execute("SAVEPOINT _safe")
+    try:
+        cursor.execute(sql, params)
+    except Exception:
+        cursor.execute("ROLLBACK TO SAVEPOINT _safe")
+        return False
+    cursor.execute("RELEASE SAVEPOINT _safe")
+    return True
 
-        # ── Core tables ───────────────────────────────────────────────────────
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            surname TEXT NOT NULL,
-            other_names TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            username TEXT UNIQUE NOT NULL,
-            password BYTEA NOT NULL,
-            email_verified INTEGER DEFAULT 0,
-            verification_code TEXT,
-            verification_code_expires_at TIMESTAMP,
-            role TEXT DEFAULT 'user',
-            monthly_spending_limit INTEGER DEFAULT 0,
-            onboarding_complete INTEGER DEFAULT 0,
-            allow_overdraft INTEGER DEFAULT 0,
-            created_at DATE,
-            last_login DATE
-        )""")
 
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS banks (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            bank_name TEXT NOT NULL,
-            account_name TEXT NOT NULL,
-            account_number TEXT NOT NULL,
-            balance INTEGER DEFAULT 0,
-            min_balance_alert INTEGER DEFAULT 0
-        )""")
+# ─────────────────────────────────────────────────────────────────────────────
+# MIGRATIONS — append only; never edit or renumber an applied migration
+# ─────────────────────────────────────────────────────────────────────────────
 
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS transactions (
-            id SERIAL PRIMARY KEY,
-            bank_id INTEGER NOT NULL REFERENCES banks(id) ON DELETE CASCADE,
-            type TEXT CHECK(type IN ('credit','debit')),
-            amount INTEGER NOT NULL,
-            description TEXT,
-            created_at DATE DEFAULT CURRENT_DATE
-        )""")
+def _m001_core_tables(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        surname TEXT NOT NULL,
+        other_names TEXT NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        username TEXT UNIQUE NOT NULL,
+        password BYTEA NOT NULL,
+        email_verified INTEGER DEFAULT 0,
+        verification_code TEXT,
+        verification_code_expires_at TIMESTAMP,
+        role TEXT DEFAULT 'user',
+        monthly_spending_limit INTEGER DEFAULT 0,
+        onboarding_complete INTEGER DEFAULT 0,
+        allow_overdraft INTEGER DEFAULT 0,
+        created_at DATE,
+        last_login DATE
+    )""")
 
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS expenses (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            bank_id INTEGER REFERENCES banks(id) ON DELETE SET NULL,
-            name TEXT NOT NULL,
-            category TEXT,
-            amount INTEGER NOT NULL,
-            created_at DATE DEFAULT CURRENT_DATE,
-            tx_id INTEGER REFERENCES transactions(id) ON DELETE SET NULL
-        )""")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS banks (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        bank_name TEXT NOT NULL,
+        account_name TEXT NOT NULL,
+        account_number TEXT NOT NULL,
+        balance INTEGER DEFAULT 0,
+        min_balance_alert INTEGER DEFAULT 0
+    )""")
 
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS goals (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            name TEXT NOT NULL,
-            target_amount INTEGER NOT NULL,
-            current_amount INTEGER DEFAULT 0,
-            status TEXT DEFAULT 'active',
-            created_at DATE DEFAULT CURRENT_DATE
-        )""")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS transactions (
+        id SERIAL PRIMARY KEY,
+        bank_id INTEGER NOT NULL REFERENCES banks(id) ON DELETE CASCADE,
+        type TEXT CHECK(type IN ('credit','debit')),
+        amount INTEGER NOT NULL,
+        description TEXT,
+        created_at DATE DEFAULT CURRENT_DATE
+    )""")
 
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS goal_contributions (
-            id SERIAL PRIMARY KEY,
-            goal_id INTEGER NOT NULL REFERENCES goals(id) ON DELETE CASCADE,
-            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            bank_id INTEGER NOT NULL REFERENCES banks(id) ON DELETE CASCADE,
-            amount INTEGER NOT NULL,
-            contributed_at DATE DEFAULT CURRENT_DATE
-        )""")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS expenses (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        bank_id INTEGER REFERENCES banks(id) ON DELETE SET NULL,
+        name TEXT NOT NULL,
+        category TEXT,
+        amount INTEGER NOT NULL,
+        created_at DATE DEFAULT CURRENT_DATE,
+        tx_id INTEGER REFERENCES transactions(id) ON DELETE SET NULL
+    )""")
 
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS analytics_logins (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            login_date DATE NOT NULL DEFAULT CURRENT_DATE
-        )""")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS goals (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        name TEXT NOT NULL,
+        target_amount INTEGER NOT NULL,
+        current_amount INTEGER DEFAULT 0,
+        status TEXT DEFAULT 'active',
+        created_at DATE DEFAULT CURRENT_DATE
+    )""")
 
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS session_tokens (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            token TEXT UNIQUE NOT NULL,
-            created_at TIMESTAMP NOT NULL DEFAULT NOW()
-        )""")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS goal_contributions (
+        id SERIAL PRIMARY KEY,
+        goal_id INTEGER NOT NULL REFERENCES goals(id) ON DELETE CASCADE,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        bank_id INTEGER NOT NULL REFERENCES banks(id) ON DELETE CASCADE,
+        amount INTEGER NOT NULL,
+        contributed_at DATE DEFAULT CURRENT_DATE
+    )""")
 
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS rate_limit_log (
-            id SERIAL PRIMARY KEY,
-            identifier TEXT NOT NULL,
-            action TEXT NOT NULL,
-            attempted_at TIMESTAMP NOT NULL DEFAULT NOW()
-        )""")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS analytics_logins (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        login_date DATE NOT NULL DEFAULT CURRENT_DATE
+    )""")
 
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS category_budgets (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            category TEXT NOT NULL,
-            monthly_limit INTEGER NOT NULL DEFAULT 0,
-            UNIQUE(user_id, category)
-        )""")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS session_tokens (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        token TEXT UNIQUE NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )""")
 
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS recurring_items (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            type TEXT NOT NULL CHECK(type IN ('income','expense')),
-            name TEXT NOT NULL,
-            category TEXT,
-            amount INTEGER NOT NULL,
-            frequency TEXT NOT NULL DEFAULT 'monthly'
-                CHECK(frequency IN ('daily','weekly','monthly','yearly')),
-            next_due DATE,
-            bank_id INTEGER REFERENCES banks(id) ON DELETE SET NULL,
-            auto_post INTEGER DEFAULT 0,
-            allow_overdraft INTEGER DEFAULT 0,
-            last_posted_at DATE,
-            active INTEGER DEFAULT 1,
-            created_at DATE DEFAULT CURRENT_DATE
-        )""")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS rate_limit_log (
+        id SERIAL PRIMARY KEY,
+        identifier TEXT NOT NULL,
+        action TEXT NOT NULL,
+        attempted_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )""")
 
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS debts (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            name TEXT NOT NULL,
-            type TEXT NOT NULL DEFAULT 'borrowed'
-                CHECK(type IN ('borrowed','lent')),
-            principal INTEGER NOT NULL,
-            balance_remaining INTEGER NOT NULL,
-            interest_rate NUMERIC(5,2) DEFAULT 0,
-            monthly_payment INTEGER DEFAULT 0,
-            due_date DATE,
-            counterparty TEXT,
-            notes TEXT,
-            status TEXT DEFAULT 'active' CHECK(status IN ('active','paid')),
-            created_at DATE DEFAULT CURRENT_DATE
-        )""")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS category_budgets (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        category TEXT NOT NULL,
+        monthly_limit INTEGER NOT NULL DEFAULT 0,
+        UNIQUE(user_id, category)
+    )""")
 
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS emergency_fund_plan (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE UNIQUE,
-            target_months INTEGER NOT NULL DEFAULT 6,
-            monthly_expenses_estimate INTEGER DEFAULT 0,
-            current_saved INTEGER DEFAULT 0,
-            updated_at DATE,
-            goal_id INTEGER REFERENCES goals(id) ON DELETE SET NULL
-        )""")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS recurring_items (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        type TEXT NOT NULL CHECK(type IN ('income','expense')),
+        name TEXT NOT NULL,
+        category TEXT,
+        amount INTEGER NOT NULL,
+        frequency TEXT NOT NULL DEFAULT 'monthly'
+            CHECK(frequency IN ('daily','weekly','monthly','yearly')),
+        next_due DATE,
+        bank_id INTEGER REFERENCES banks(id) ON DELETE SET NULL,
+        auto_post INTEGER DEFAULT 0,
+        allow_overdraft INTEGER DEFAULT 0,
+        last_posted_at DATE,
+        active INTEGER DEFAULT 1,
+        created_at DATE DEFAULT CURRENT_DATE
+    )""")
 
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS user_streaks (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE UNIQUE,
-            current_streak INTEGER NOT NULL DEFAULT 0,
-            longest_streak INTEGER NOT NULL DEFAULT 0,
-            last_active_date DATE,
-            streak_updated_at TIMESTAMP DEFAULT NOW()
-        )""")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS debts (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        name TEXT NOT NULL,
+        type TEXT NOT NULL DEFAULT 'borrowed'
+            CHECK(type IN ('borrowed','lent')),
+        principal INTEGER NOT NULL,
+        balance_remaining INTEGER NOT NULL,
+        interest_rate NUMERIC(5,2) DEFAULT 0,
+        monthly_payment INTEGER DEFAULT 0,
+        due_date DATE,
+        counterparty TEXT,
+        notes TEXT,
+        status TEXT DEFAULT 'active' CHECK(status IN ('active','paid')),
+        created_at DATE DEFAULT CURRENT_DATE
+    )""")
 
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS notifications (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            type TEXT NOT NULL DEFAULT 'tip'
-                CHECK(type IN ('reminder','tip','milestone','alert','nudge')),
-            title TEXT NOT NULL,
-            body TEXT NOT NULL,
-            icon TEXT DEFAULT '&#x1F514;',
-            read INTEGER NOT NULL DEFAULT 0,
-            created_at TIMESTAMP DEFAULT NOW()
-        )""")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS emergency_fund_plan (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE UNIQUE,
+        target_months INTEGER NOT NULL DEFAULT 6,
+        monthly_expenses_estimate INTEGER DEFAULT 0,
+        current_saved INTEGER DEFAULT 0,
+        updated_at DATE,
+        goal_id INTEGER REFERENCES goals(id) ON DELETE SET NULL
+    )""")
 
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS onboarding_tips (
-            id SERIAL PRIMARY KEY,
-            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE UNIQUE,
-            tips_sent INTEGER NOT NULL DEFAULT 0,
-            last_tip_at DATE
-        )""")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_streaks (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE UNIQUE,
+        current_streak INTEGER NOT NULL DEFAULT 0,
+        longest_streak INTEGER NOT NULL DEFAULT 0,
+        last_active_date DATE,
+        streak_updated_at TIMESTAMP DEFAULT NOW()
+    )""")
 
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS debt_payments (
-            id           SERIAL PRIMARY KEY,
-            debt_id      INTEGER NOT NULL REFERENCES debts(id) ON DELETE CASCADE,
-            user_id      INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-            amount       INTEGER NOT NULL,
-            payment_date DATE    NOT NULL DEFAULT CURRENT_DATE,
-            note         TEXT,
-            created_at   TIMESTAMP DEFAULT NOW()
-        )""")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS notifications (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        type TEXT NOT NULL DEFAULT 'tip'
+            CHECK(type IN ('reminder','tip','milestone','alert','nudge')),
+        title TEXT NOT NULL,
+        body TEXT NOT NULL,
+        icon TEXT DEFAULT '&#x1F514;',
+        read INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT NOW()
+    )""")
 
-        # ── ADD COLUMN migrations (IF NOT EXISTS = instant no-ops) ────────────
-        cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS onboarding_complete INTEGER DEFAULT 0")
-        cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS allow_overdraft INTEGER DEFAULT 0")
-        cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS verification_code_expires_at TIMESTAMP")
-        cursor.execute("ALTER TABLE expenses ADD COLUMN IF NOT EXISTS category TEXT")
-        cursor.execute("ALTER TABLE recurring_items ADD COLUMN IF NOT EXISTS allow_overdraft INTEGER DEFAULT 0")
-        cursor.execute("ALTER TABLE recurring_items ADD COLUMN IF NOT EXISTS last_posted_at DATE")
-
-        # ── ALTER COLUMN TYPE — only if column is still TEXT ─────────────────
-        # Each check is a tiny information_schema read; if already DATE it skips.
-        _migrations = [
-            ("users",            "created_at",  "DATE",      "CASE WHEN created_at ~ '^\\d{4}-\\d{2}-\\d{2}' THEN created_at::DATE ELSE NULL END"),
-            ("users",            "last_login",  "DATE",      "CASE WHEN last_login ~ '^\\d{4}-\\d{2}-\\d{2}' THEN last_login::DATE ELSE NULL END"),
-            ("transactions",     "created_at",  "DATE",      "CASE WHEN created_at ~ '^\\d{4}-\\d{2}-\\d{2}' THEN created_at::DATE ELSE CURRENT_DATE END"),
-            ("expenses",         "created_at",  "DATE",      "CASE WHEN created_at ~ '^\\d{4}-\\d{2}-\\d{2}' THEN created_at::DATE ELSE CURRENT_DATE END"),
-            ("goals",            "created_at",  "DATE",      "CASE WHEN created_at ~ '^\\d{4}-\\d{2}-\\d{2}' THEN created_at::DATE ELSE CURRENT_DATE END"),
-            ("analytics_logins", "login_date",  "DATE",      "CASE WHEN login_date ~ '^\\d{4}-\\d{2}-\\d{2}' THEN login_date::DATE ELSE CURRENT_DATE END"),
-            ("session_tokens",   "created_at",  "TIMESTAMP", "CASE WHEN created_at ~ '^\\d{4}-\\d{2}-\\d{2}' THEN created_at::TIMESTAMP ELSE NOW() END"),
-        ]
-        for table, col, target_type, using in _migrations:
-            try:
-                current = _col_type(cursor, table, col)
-                if current and current != target_type.lower():
-                    cursor.execute("""
-                        DO $$ BEGIN
-                            ALTER TABLE {t} ALTER COLUMN {c} TYPE {ty} USING {u};
-                        EXCEPTION WHEN others THEN NULL; END $$;
-                    """.format(t=table, c=col, ty=target_type, u=using))
-            except Exception:
-                pass
-
-        # ── Back-fill expenses.category ───────────────────────────────────────
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS onboarding_tips (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE UNIQUE,
+        tips_sent INTEGER NOT NULL DEFAULT 0,
+        last_tip_at DATE
+    )""")
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS debt_payments (
+        id           SERIAL PRIMARY KEY,
+        debt_id      INTEGER NOT NULL REFERENCES debts(id) ON DELETE CASCADE,
+        user_id      INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        amount       INTEGER NOT NULL,
+        payment_date DATE    NOT NULL DEFAULT CURRENT_DATE,
+        note         TEXT,
+        created_at   TIMESTAMP DEFAULT NOW()
+    )""")
+
+
+def _m002_add_columns(cursor):
+    # IF NOT EXISTS keeps these safe on databases created before versioning
+    cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS onboarding_complete INTEGER DEFAULT 0")
+    cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS allow_overdraft INTEGER DEFAULT 0")
+    cursor.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS verification_code_expires_at TIMESTAMP")
+    cursor.execute("ALTER TABLE expenses ADD COLUMN IF NOT EXISTS category TEXT")
+    cursor.execute("ALTER TABLE recurring_items ADD COLUMN IF NOT EXISTS allow_overdraft INTEGER DEFAULT 0")
+    cursor.execute("ALTER TABLE recurring_items ADD COLUMN IF NOT EXISTS last_posted_at DATE")
+
+
+def _m003_text_to_date_columns(cursor):
+    # Each check is a tiny information_schema read; if already DATE it skips.
+    _migrations = [
+        ("users",            "created_at",  "DATE",      "CASE WHEN created_at ~ '^\\d{4}-\\d{2}-\\d{2}' THEN created_at::DATE ELSE NULL END"),
+        ("users",            "last_login",  "DATE",      "CASE WHEN last_login ~ '^\\d{4}-\\d{2}-\\d{2}' THEN last_login::DATE ELSE NULL END"),
+        ("transactions",     "created_at",  "DATE",      "CASE WHEN created_at ~ '^\\d{4}-\\d{2}-\\d{2}' THEN created_at::DATE ELSE CURRENT_DATE END"),
+        ("expenses",         "created_at",  "DATE",      "CASE WHEN created_at ~ '^\\d{4}-\\d{2}-\\d{2}' THEN created_at::DATE ELSE CURRENT_DATE END"),
+        ("goals",            "created_at",  "DATE",      "CASE WHEN created_at ~ '^\\d{4}-\\d{2}-\\d{2}' THEN created_at::DATE ELSE CURRENT_DATE END"),
+        ("analytics_logins", "login_date",  "DATE",      "CASE WHEN login_date ~ '^\\d{4}-\\d{2}-\\d{2}' THEN login_date::DATE ELSE CURRENT_DATE END"),
+        ("session_tokens",   "created_at",  "TIMESTAMP", "CASE WHEN created_at ~ '^\\d{4}-\\d{2}-\\d{2}' THEN created_at::TIMESTAMP ELSE NOW() END"),
+    ]
+    for table, col, target_type, using in _migrations:
         try:
-            cursor.execute("UPDATE expenses SET category = name WHERE category IS NULL")
+            current = _col_type(cursor, table, col)
+            if current and current != target_type.lower():
+                cursor.execute("""
+                    DO $$ BEGIN
+                        ALTER TABLE {t} ALTER COLUMN {c} TYPE {ty} USING {u};
+                    EXCEPTION WHEN others THEN NULL; END $$;
+                """.format(t=table, c=col, ty=target_type, u=using))
         except Exception:
             pass
 
-        # ── Indexes (IF NOT EXISTS = instant no-ops after first run) ──────────
-        for idx in [
-            "CREATE INDEX IF NOT EXISTS idx_banks_user_id ON banks(user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_transactions_bank_id ON transactions(bank_id)",
+
+def _m004_backfill_expense_category(cursor):
+    _safe_execute(cursor, "UPDATE expenses SET category = name WHERE category IS NULL")
+
+
+def _m005_indexes(cursor):
+    for idx in [
+        "CREATE INDEX IF NOT EXISTS idx_banks_user_id ON banks(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_bank_id ON transactions(bank_id)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_created_at ON transactions(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_type ON transactions(type)",
+        "CREATE INDEX IF NOT EXISTS idx_expenses_user_id ON expenses(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_expenses_bank_id ON expenses(bank_id)",
+        "CREATE INDEX IF NOT EXISTS idx_expenses_created_at ON expenses(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_expenses_category ON expenses(category)",
+        "CREATE INDEX IF NOT EXISTS idx_goals_user_id ON goals(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_goals_status ON goals(status)",
+        "CREATE INDEX IF NOT EXISTS idx_goal_contributions_goal_id ON goal_contributions(goal_id)",
+        "CREATE INDEX IF NOT EXISTS idx_goal_contributions_user_id ON goal_contributions(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_analytics_logins_user_id ON analytics_logins(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_analytics_logins_login_date ON analytics_logins(login_date)",
+        "CREATE INDEX IF NOT EXISTS idx_session_tokens_user_id ON session_tokens(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_session_tokens_created_at ON session_tokens(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_rate_limit_identifier ON rate_limit_log(identifier, action, attempted_at)",
+        "CREATE INDEX IF NOT EXISTS idx_category_budgets_user_id ON category_budgets(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_recurring_items_user_id ON recurring_items(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_recurring_items_next_due ON recurring_items(next_due)",
+        "CREATE INDEX IF NOT EXISTS idx_debts_user_id ON debts(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_debt_payments_debt_id ON debt_payments(debt_id)",
+        "CREATE INDEX IF NOT EXISTS idx_debt_payments_user_id ON debt_payments(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_notifications_user_id ON notifications(user_id, created_at DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_notifications_read ON notifications(user_id, read)",
+        "CREATE INDEX IF NOT EXISTS idx_user_streaks_user_id ON user_streaks(user_id)",
+    ]:
+        _safe_execute(cursor, idx)
+
+
+def _m006_csv_import_tables(cursor):
+    """Tables for CSV import batches / undo — previously created on every import page load."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS import_batches (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        bank_id INTEGER NOT NULL REFERENCES banks(id) ON DELETE CASCADE,
+        filename TEXT,
+        row_count INTEGER DEFAULT 0,
+        total_amount INTEGER DEFAULT 0,
+        imported_at TIMESTAMP DEFAULT NOW(),
+        undone INTEGER DEFAULT 0
+    )""")
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS import_batch_items (
+        id SERIAL PRIMARY KEY,
+        batch_id INTEGER NOT NULL REFERENCES import_batches(id) ON DELETE CASCADE,
+        expense_id INTEGER REFERENCES expenses(id) ON DELETE SET NULL,
+        tx_id INTEGER REFERENCES transactions(id) ON DELETE SET NULL,
+        amount INTEGER NOT NULL,
+        bank_id INTEGER NOT NULL REFERENCES banks(id) ON DELETE CASCADE
+    )""")
+
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_import_batches_user_id "
+        "ON import_batches(user_id, imported_at DESC)"
+    )
+
+
+def _m007_transactions_user_id(cursor):
+    """
+    Denormalize banks.user_id onto transactions so per-user aggregates filter
+    on transactions alone instead of joining banks on every read. Every insert
+    path writes user_id explicitly; the trigger fills it for anything that
+    doesn't and keeps it in step if a row is ever moved to another bank.
+    """
+    cursor.execute(
+        "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS user_id INTEGER "
+        "REFERENCES users(id) ON DELETE CASCADE"
+    )
+    cursor.execute("""
+    UPDATE transactions t SET user_id = b.user_id
+    FROM banks b
+    WHERE t.bank_id = b.id AND t.user_id IS DISTINCT FROM b.user_id
+    """)
+
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION transactions_set_user_id() RETURNS trigger AS $$
+    BEGIN
+        IF NEW.user_id IS NULL OR TG_OP = 'UPDATE' THEN
+            SELECT user_id INTO NEW.user_id FROM banks WHERE id = NEW.bank_id;
+        END IF;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql""")
+    cursor.execute("DROP TRIGGER IF EXISTS trg_transactions_user_id ON transactions")
+    cursor.execute("""
+    CREATE TRIGGER trg_transactions_user_id
+    BEFORE INSERT OR UPDATE OF bank_id ON transactions
+    FOR EACH ROW EXECUTE FUNCTION transactions_set_user_id()""")
+
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_type_created "
+        "ON transactions(user_id, type, created_at)"
+    )
+
+
+def _m008_month_category_rollup(cursor):
+    """
+    Per-user, per-month, per-category expense totals. Maintained by a trigger
+    on expenses, so every write path — manual entry, edit, delete, CSV import
+    and undo, auto-posting — updates it in the same transaction. Month-level
+    readers query this instead of re-aggregating expenses on every page load.
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_month_category_totals (
+        user_id   INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        month     DATE    NOT NULL,
+        category  TEXT    NOT NULL,
+        spent     BIGINT  NOT NULL DEFAULT 0,
+        txn_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, month, category)
+    )""")
+
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION expenses_month_rollup() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.created_at IS NOT NULL THEN
+            UPDATE user_month_category_totals
+               SET spent = spent - OLD.amount, txn_count = txn_count - 1
+             WHERE user_id  = OLD.user_id
+               AND month    = date_trunc('month', OLD.created_at)::date
+               AND category = COALESCE(OLD.category, OLD.name);
+            DELETE FROM user_month_category_totals
+             WHERE user_id  = OLD.user_id
+               AND month    = date_trunc('month', OLD.created_at)::date
+               AND category = COALESCE(OLD.category, OLD.name)
+               AND txn_count <= 0;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.created_at IS NOT NULL THEN
+            INSERT INTO user_month_category_totals (user_id, month, category, spent, txn_count)
+            VALUES (NEW.user_id, date_trunc('month', NEW.created_at)::date,
+                    COALESCE(NEW.category, NEW.name), NEW.amount, 1)
+            ON CONFLICT (user_id, month, category) DO UPDATE
+               SET spent     = user_month_category_totals.spent + EXCLUDED.spent,
+                   txn_count = user_month_category_totals.txn_count + 1;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql""")
+
+    # Block expense writes until the trigger and backfill commit together,
+    # so no row is counted twice or missed.
+    cursor.execute("LOCK TABLE expenses IN SHARE ROW EXCLUSIVE MODE")
+    cursor.execute("DROP TRIGGER IF EXISTS trg_expenses_month_rollup ON expenses")
+    cursor.execute("""
+    CREATE TRIGGER trg_expenses_month_rollup
+    AFTER INSERT OR DELETE OR UPDATE OF user_id, name, category, amount, created_at
+    ON expenses
+    FOR EACH ROW EXECUTE FUNCTION expenses_month_rollup()""")
+
+    cursor.execute("DELETE FROM user_month_category_totals")
+    cursor.execute("""
+    INSERT INTO user_month_category_totals (user_id, month, category, spent, txn_count)
+    SELECT user_id, date_trunc('month', created_at)::date, COALESCE(category, name),
+           SUM(amount), COUNT(*)
+    FROM expenses
+    WHERE created_at IS NOT NULL
+    GROUP BY 1, 2, 3
+    """)
+
+
+def _signed_changes(rows: str, sign: str) -> str:
+    return f"""
+        SELECT bank_id, user_id, created_at AS day,
+               {sign}CASE WHEN type = 'credit' THEN amount ELSE 0 END AS credit,
+               {sign}CASE WHEN type = 'debit'  THEN amount ELSE 0 END AS debit,
+               {sign}1 AS n
+        FROM {rows} WHERE created_at IS NOT NULL"""
+
+
+def _apply_changes(source: str) -> str:
+    return f"""
+        INSERT INTO bank_daily_balances AS b (bank_id, day, user_id, credit, debit, txn_count)
+        SELECT bank_id, day, MAX(user_id), SUM(credit), SUM(debit), SUM(n)
+        FROM ({source}) c
+        WHERE user_id IS NOT NULL
+        GROUP BY bank_id, day
+        HAVING SUM(credit) <> 0 OR SUM(debit) <> 0 OR SUM(n) <> 0
+        ON CONFLICT (bank_id, day) DO UPDATE
+           SET credit    = b.credit    + EXCLUDED.credit,
+               debit     = b.debit     + EXCLUDED.debit,
+               txn_count = b.txn_count + EXCLUDED.txn_count;"""
+
+
+# Statement-level so a bulk import or undo is one upsert per affected day,
+# not one per row. Only the written days change — never the rest of history.
+_DAILY_BALANCE_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION transactions_daily_balances() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        {_apply_changes(_signed_changes("new_rows", ""))}
+    ELSIF TG_OP = 'DELETE' THEN
+        {_apply_changes(_signed_changes("old_rows", "-"))}
+    ELSE
+        {_apply_changes(_signed_changes("new_rows", "") + " UNION ALL " + _signed_changes("old_rows", "-"))}
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql"""
+
+
+def _create_daily_balance_triggers(cursor) -> None:
+    cursor.execute("DROP TRIGGER IF EXISTS trg_transactions_daily_balance ON transactions")
+    for event, transition in (("INSERT", "NEW TABLE AS new_rows"),
+                              ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+                              ("DELETE", "OLD TABLE AS old_rows")):
+        name = f"trg_transactions_daily_balance_{event.lower()}"
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name} ON transactions")
+        cursor.execute(f"""
+        CREATE TRIGGER {name}
+        AFTER {event} ON transactions
+        REFERENCING {transition}
+        FOR EACH STATEMENT EXECUTE FUNCTION transactions_daily_balances()""")
+
+
+def _m009_bank_daily_balances(cursor):
+    """
+    One row per bank per day: money in, money out and transaction count.
+    Closing balances are derived when read — the live balance minus the net
+    of every later day (see snapshots.py) — so a write touches only its own
+    day's row, and a back-dated write can't leave later days stale.
+    rebuild_bank_daily_balances() recomputes rows from the ledger for the
+    backfill (migration 15) and the `python snapshots.py` repair job.
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS bank_daily_balances (
+        bank_id         INTEGER NOT NULL REFERENCES banks(id) ON DELETE CASCADE,
+        day             DATE    NOT NULL,
+        user_id         INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        credit          BIGINT  NOT NULL DEFAULT 0,
+        debit           BIGINT  NOT NULL DEFAULT 0,
+        txn_count       INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (bank_id, day)
+    )""")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_bank_daily_balances_user_day "
+        "ON bank_daily_balances(user_id, day)"
+    )
+    cursor.execute(_DAILY_BALANCE_FUNCTION)
+
+    # Locking the snapshot table makes concurrent writers' triggers wait, so
+    # their deltas land on top of the rebuilt rows — never lost, never
+    # counted twice. The ledger itself is not locked.
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION rebuild_bank_daily_balances(p_bank_id INTEGER DEFAULT NULL)
+    RETURNS INTEGER AS $$
+    DECLARE
+        n INTEGER;
+    BEGIN
+        LOCK TABLE bank_daily_balances IN SHARE ROW EXCLUSIVE MODE;
+        DELETE FROM bank_daily_balances WHERE p_bank_id IS NULL OR bank_id = p_bank_id;
+
+        INSERT INTO bank_daily_balances (bank_id, day, user_id, credit, debit, txn_count)
+        SELECT t.bank_id, t.created_at, b.user_id,
+               SUM(CASE WHEN t.type = 'credit' THEN t.amount ELSE 0 END),
+               SUM(CASE WHEN t.type = 'debit'  THEN t.amount ELSE 0 END),
+               COUNT(*)
+        FROM transactions t
+        JOIN banks b ON b.id = t.bank_id
+        WHERE t.created_at IS NOT NULL
+          AND (p_bank_id IS NULL OR t.bank_id = p_bank_id)
+        GROUP BY t.bank_id, t.created_at, b.user_id;
+        GET DIAGNOSTICS n = ROW_COUNT;
+        RETURN n;
+    END
+    $$ LANGUAGE plpgsql""")
+
+    _create_daily_balance_triggers(cursor)
+    # History is filled in by the deferred migration 15; readers use the
+    # ledger until it has been applied (snapshots.daily_source()).
+
+
+# Month partitions are named <table>_YYYY_MM; rows outside every partition
+# land in <table>_default. ensure_month_partitions() creates any missing months
+# in a range, first moving matching rows out of the default partition. The
+# move deletes and re-inserts through the parent, so the parent's
+# statement-level triggers (data version, daily balances, import fingerprints)
+# see both halves and net to zero; row-level triggers fire either way.
+_PARTITION_FUNCTION = """
+CREATE OR REPLACE FUNCTION ensure_month_partitions(p_parent TEXT, p_from DATE, p_to DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    m    DATE := date_trunc('month', p_from)::date;
+    nxt  DATE;
+    part TEXT;
+    made INTEGER := 0;
+BEGIN
+    WHILE m <= p_to LOOP
+        nxt  := (m + INTERVAL '1 month')::date;
+        part := format('%s_%s', p_parent, to_char(m, 'YYYY_MM'));
+        IF to_regclass(part) IS NULL THEN
+            EXECUTE format('CREATE TEMP TABLE _partition_move (LIKE %I) ON COMMIT DROP', p_parent);
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM %I WHERE created_at >= %L AND created_at < %L RETURNING *) '
+                'INSERT INTO _partition_move SELECT * FROM moved',
+                p_parent, m, nxt);
+            EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                           part, p_parent, m, nxt);
+            EXECUTE format('INSERT INTO %I SELECT * FROM _partition_move', p_parent);
+            DROP TABLE _partition_move;
+            made := made + 1;
+        END IF;
+        m := nxt;
+    END LOOP;
+    RETURN made;
+END
+$$ LANGUAGE plpgsql"""
+
+_PARTITION_MONTHS_AHEAD = 3
+
+
+def _partition_by_month(cursor, table: str, foreign_keys: list, indexes: list, triggers: list):
+    """
+    Swap `table` for a copy range-partitioned by month on created_at. Foreign
+    keys pointing INTO the table are dropped: a partitioned table's primary
+    key must include created_at, so `id` alone can no longer be referenced.
+    """
+    legacy = f"{table}_unpartitioned"
+    cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+
+    cursor.execute("""
+        SELECT conrelid::regclass::text AS tbl, conname
+        FROM pg_constraint WHERE contype = 'f' AND confrelid = %s::regclass
+    """, (table,))
+    for fk in cursor.fetchall():
+        cursor.execute(f'ALTER TABLE {fk["tbl"]} DROP CONSTRAINT "{fk["conname"]}"')
+
+    # The partition key is part of the primary key, so it can't be NULL.
+    cursor.execute(f"UPDATE {table} SET created_at = CURRENT_DATE WHERE created_at IS NULL")
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    cursor.execute(f"ALTER INDEX {table}_pkey RENAME TO {legacy}_pkey")
+    cursor.execute(f"""
+    CREATE TABLE {table} (
+        LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at)""")
+    cursor.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+    cursor.execute(f"SELECT MIN(created_at) AS lo FROM {legacy}")
+    lo = cursor.fetchone()["lo"]
+    cursor.execute(
+        "SELECT ensure_month_partitions(%s, COALESCE(%s, CURRENT_DATE), "
+        "(CURRENT_DATE + %s * INTERVAL '1 month')::date)",
+        (table, lo, _PARTITION_MONTHS_AHEAD)
+    )
+    cursor.execute(f"INSERT INTO {table} SELECT * FROM {legacy}")
+    cursor.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+    cursor.execute(f"DROP TABLE {legacy}")
+
+    for fk in foreign_keys:
+        cursor.execute(f"ALTER TABLE {table} ADD {fk}")
+    # Indexes created on the parent are created on every partition, current and future.
+    for idx in indexes:
+        cursor.execute(idx)
+    for trg in triggers:
+        cursor.execute(trg)
+
+
+def _m010_partition_by_month(cursor):
+    """
+    Range-partition transactions and expenses by month on created_at, so
+    month-bounded queries prune to one or two partitions and old years can be
+    archived with DETACH PARTITION instead of a bulk DELETE. Deferred: it
+    rewrites both tables under an exclusive lock — run with
+    `python models.py --deferred` in a maintenance window.
+    """
+    cursor.execute(_PARTITION_FUNCTION)
+
+    _partition_by_month(
+        cursor, "transactions",
+        foreign_keys=[
+            "FOREIGN KEY (bank_id) REFERENCES banks(id) ON DELETE CASCADE",
+            "FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE",
+        ],
+        indexes=[
+            "CREATE INDEX IF NOT EXISTS idx_transactions_bank_id ON transactions(bank_id, created_at)",
             "CREATE INDEX IF NOT EXISTS idx_transactions_created_at ON transactions(created_at)",
-            "CREATE INDEX IF NOT EXISTS idx_transactions_type ON transactions(type)",
-            "CREATE INDEX IF NOT EXISTS idx_expenses_user_id ON expenses(user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_transactions_user_type_created "
+            "ON transactions(user_id, type, created_at)",
+        ],
+        triggers=[
+            """CREATE TRIGGER trg_transactions_user_id
+            BEFORE INSERT OR UPDATE OF bank_id ON transactions
+            FOR EACH ROW EXECUTE FUNCTION transactions_set_user_id()""",
+        ],
+    )
+
+    _partition_by_month(
+        cursor, "expenses",
+        foreign_keys=[
+            "FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE",
+            "FOREIGN KEY (bank_id) REFERENCES banks(id) ON DELETE SET NULL",
+        ],
+        indexes=[
+            "CREATE INDEX IF NOT EXISTS idx_expenses_user_id ON expenses(user_id, created_at)",
             "CREATE INDEX IF NOT EXISTS idx_expenses_bank_id ON expenses(bank_id)",
-            "CREATE INDEX IF NOT EXISTS idx_expenses_created_at ON expenses(created_at)",
             "CREATE INDEX IF NOT EXISTS idx_expenses_category ON expenses(category)",
-            "CREATE INDEX IF NOT EXISTS idx_goals_user_id ON goals(user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_goals_status ON goals(status)",
-            "CREATE INDEX IF NOT EXISTS idx_goal_contributions_goal_id ON goal_contributions(goal_id)",
-            "CREATE INDEX IF NOT EXISTS idx_goal_contributions_user_id ON goal_contributions(user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_analytics_logins_user_id ON analytics_logins(user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_analytics_logins_login_date ON analytics_logins(login_date)",
-            "CREATE INDEX IF NOT EXISTS idx_session_tokens_user_id ON session_tokens(user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_session_tokens_created_at ON session_tokens(created_at)",
-            "CREATE INDEX IF NOT EXISTS idx_rate_limit_identifier ON rate_limit_log(identifier, action, attempted_at)",
-            "CREATE INDEX IF NOT EXISTS idx_category_budgets_user_id ON category_budgets(user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_recurring_items_user_id ON recurring_items(user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_recurring_items_next_due ON recurring_items(next_due)",
-            "CREATE INDEX IF NOT EXISTS idx_debts_user_id ON debts(user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_debt_payments_debt_id ON debt_payments(debt_id)",
-            "CREATE INDEX IF NOT EXISTS idx_debt_payments_user_id ON debt_payments(user_id)",
-            "CREATE INDEX IF NOT EXISTS idx_notifications_user_id ON notifications(user_id, created_at DESC)",
-            "CREATE INDEX IF NOT EXISTS idx_notifications_read ON notifications(user_id, read)",
-            "CREATE INDEX IF NOT EXISTS idx_user_streaks_user_id ON user_streaks(user_id)",
-        ]:
-            try:
-                cursor.execute(idx)
-            except Exception:
-                pass
+            "CREATE INDEX IF NOT EXISTS idx_expenses_created_at ON expenses(created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_expenses_tx_id ON expenses(tx_id)",
+        ],
+        triggers=[
+            """CREATE TRIGGER trg_expenses_month_rollup
+            AFTER INSERT OR DELETE OR UPDATE OF user_id, name, category, amount, created_at
+            ON expenses
+            FOR EACH ROW EXECUTE FUNCTION expenses_month_rollup()""",
+        ],
+    )
+
+    # Migration 9's daily-balance triggers went with the legacy table too.
+    _create_daily_balance_triggers(cursor)
+    # Migration 12's triggers went with the legacy tables; recreate them when
+    # it has already run (otherwise it will create them itself).
+    cursor.execute("SELECT to_regprocedure('bump_user_data_version()') IS NOT NULL AS ok")
+    if cursor.fetchone()["ok"]:
+        for table in ("transactions", "expenses"):
+            _create_data_version_triggers(cursor, table)
+    # Likewise migration 13's trigram indexes.
+    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    if cursor.fetchone():
+        _create_search_indexes(cursor, ("transactions", "expenses"))
+    # And migration 14's fingerprint triggers (the rows were copied before they existed).
+    cursor.execute("SELECT to_regprocedure('transactions_import_fingerprints()') IS NOT NULL AS ok")
+    if cursor.fetchone()["ok"]:
+        _create_import_fingerprint_triggers(cursor)
+
+
+def _m011_analytics_logins_daily(cursor):
+    """
+    One analytics_logins row per user per day. Every reader counts DISTINCT
+    user_id, so same-day repeats were pure growth; collapse them and let the
+    unique index turn repeat logins into no-ops (ON CONFLICT DO NOTHING).
+    """
+    cursor.execute("""
+    DELETE FROM analytics_logins a
+    USING analytics_logins keep
+    WHERE a.user_id = keep.user_id
+      AND a.login_date = keep.login_date
+      AND a.id > keep.id
+    """)
+    cursor.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_analytics_logins_user_day "
+        "ON analytics_logins(user_id, login_date)"
+    )
+    # The unique index leads with user_id, so this one is redundant.
+    cursor.execute("DROP INDEX IF EXISTS idx_analytics_logins_user_id")
+
+
+# Every table a user's numbers are derived from. Statement-level triggers with
+# transition tables bump users.data_version once per statement, so a bulk
+# import costs one UPDATE per user rather than one per row.
+_DATA_VERSION_TABLES = (
+    "banks", "transactions", "expenses", "goals", "goal_contributions",
+    "category_budgets", "recurring_items", "debts", "debt_payments",
+    "emergency_fund_plan",
+)
+
+
+def _create_data_version_triggers(cursor, table: str) -> None:
+    # Transition tables allow one event per trigger.
+    for event, transition in (("INSERT", "NEW TABLE AS new_rows"),
+                              ("UPDATE", "NEW TABLE AS new_rows"),
+                              ("DELETE", "OLD TABLE AS old_rows")):
+        name = f"trg_{table}_data_version_{event.lower()}"
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name} ON {table}")
+        cursor.execute(f"""
+        CREATE TRIGGER {name}
+        AFTER {event} ON {table}
+        REFERENCING {transition}
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_user_data_version()""")
+
+
+def _m012_user_data_version(cursor):
+    """
+    users.data_version changes whenever anything a user's dashboards are
+    computed from changes — whichever code path wrote it (pages, CSV import,
+    tracker auto-posts, batch jobs). Readers key their caches on it (see
+    cache_versions.py), so caches can live for hours and still turn over on
+    the rerun right after a write.
+    """
+    cursor.execute(
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS data_version BIGINT NOT NULL DEFAULT 0"
+    )
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION bump_user_data_version() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            UPDATE users SET data_version = data_version + 1
+            WHERE id IN (SELECT DISTINCT user_id FROM old_rows);
+        ELSE
+            UPDATE users SET data_version = data_version + 1
+            WHERE id IN (SELECT DISTINCT user_id FROM new_rows);
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql""")
+    for table in _DATA_VERSION_TABLES:
+        _create_data_version_triggers(cursor, table)
+
+
+# Columns behind search.py and the history filters' ILIKE '%…%'. Trigram GIN
+# indexes serve both substring ILIKE and word-similarity (<%) lookups.
+_SEARCH_INDEXES = {
+    "expenses":        ("name", "category"),
+    "transactions":    ("description",),
+    "debts":           ("name", "counterparty", "notes"),
+    "recurring_items": ("name",),
+}
+
 
+def _create_search_indexes(cursor, tables) -> None:
+    for table in tables:
+        for column in _SEARCH_INDEXES[table]:
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table}_{column}_trgm "
+                f"ON {table} USING gin ({column} gin_trgm_ops)"
+            )
+
+
+def _m013_search_trigram(cursor):
+    """
+    pg_trgm plus trigram indexes on the searchable text columns, so search
+    latency stays flat as history grows. Where the extension cannot be
+    installed, search.py falls back to plain (unindexed) ILIKE.
+    """
+    if not _safe_execute(cursor, "CREATE EXTENSION IF NOT EXISTS pg_trgm"):
+        return
+    _create_search_indexes(cursor, _SEARCH_INDEXES)
+
+
+# Debit fingerprints for CSV-import dedupe, counted per (bank, fingerprint) so
+# legitimate same-day repeats and deletes stay exact. Must hash exactly what
+# csv_import._row_fingerprint does — over the expense name, so the
+# 'Expense: ' prefix of stored descriptions is stripped.
+_IMPORT_FINGERPRINT_FUNCTIONS = r"""
+CREATE OR REPLACE FUNCTION import_fingerprint(p_bank INTEGER, p_day DATE, p_amount INTEGER, p_desc TEXT)
+RETURNS TEXT AS $$
+    SELECT encode(sha256(convert_to(
+        p_bank || '|' || to_char(p_day, 'YYYY-MM-DD') || '|' || p_amount || '|'
+        || lower(btrim(regexp_replace(COALESCE(p_desc, ''), '^Expense: ', ''), E' \t\r\n\f\v')),
+        'UTF8')), 'hex')
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION transactions_import_fingerprints() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE import_fingerprints f SET n = f.n - gone.n
+        FROM (
+            SELECT bank_id, import_fingerprint(bank_id, created_at, amount, description) AS fp,
+                   COUNT(*) AS n
+            FROM old_rows WHERE type = 'debit' AND created_at IS NOT NULL
+            GROUP BY 1, 2
+        ) gone
+        WHERE f.bank_id = gone.bank_id AND f.fingerprint = gone.fp;
+        DELETE FROM import_fingerprints
+        WHERE n <= 0 AND (bank_id, fingerprint) IN (
+            SELECT bank_id, import_fingerprint(bank_id, created_at, amount, description)
+            FROM old_rows WHERE type = 'debit' AND created_at IS NOT NULL
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO import_fingerprints (bank_id, fingerprint, n)
+        SELECT bank_id, import_fingerprint(bank_id, created_at, amount, description), COUNT(*)
+        FROM new_rows WHERE type = 'debit' AND created_at IS NOT NULL
+        GROUP BY 1, 2
+        ON CONFLICT (bank_id, fingerprint) DO UPDATE SET n = import_fingerprints.n + EXCLUDED.n;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+
+def _create_import_fingerprint_triggers(cursor) -> None:
+    for event, transition in (("INSERT", "NEW TABLE AS new_rows"),
+                              ("UPDATE", "OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+                              ("DELETE", "OLD TABLE AS old_rows")):
+        name = f"trg_transactions_import_fp_{event.lower()}"
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name} ON transactions")
+        cursor.execute(f"""
+        CREATE TRIGGER {name}
+        AFTER {event} ON transactions
+        REFERENCING {transition}
+        FOR EACH STATEMENT EXECUTE FUNCTION transactions_import_fingerprints()""")
+
+
+def _m014_import_fingerprints(cursor):
+    """
+    CSV import used to select every debit the bank ever had and SHA-256 them
+    in Python on each rerun to dedupe a file. Fingerprints are now kept in
+    import_fingerprints by triggers on every write path, so the import page
+    checks a file's fingerprints with one primary-key lookup.
+    """
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS import_fingerprints (
+        bank_id INTEGER NOT NULL REFERENCES banks(id) ON DELETE CASCADE,
+        fingerprint TEXT NOT NULL,
+        n INTEGER NOT NULL DEFAULT 1,
+        PRIMARY KEY (bank_id, fingerprint)
+    )""")
+    cursor.execute(_IMPORT_FINGERPRINT_FUNCTIONS)
+    # Triggers first: CREATE TRIGGER holds off concurrent writes until commit,
+    # so the backfill below can't miss or double-count a row.
+    _create_import_fingerprint_triggers(cursor)
+    cursor.execute("""
+        INSERT INTO import_fingerprints (bank_id, fingerprint, n)
+        SELECT bank_id, import_fingerprint(bank_id, created_at, amount, description), COUNT(*)
+        FROM transactions WHERE type = 'debit' AND created_at IS NOT NULL
+        GROUP BY 1, 2
+        ON CONFLICT (bank_id, fingerprint) DO NOTHING
+    """)
+
+
+def _m015_bank_daily_balances_backfill(cursor):
+    """
+    Build bank_daily_balances for the whole ledger. Deferred: transaction
+    writes wait on the snapshot table while it runs — apply it on its own with
+    `python models.py --deferred 15`. Until it is recorded, readers aggregate
+    transactions instead (snapshots.daily_source()).
+    """
+    cursor.execute("SELECT rebuild_bank_daily_balances(NULL)")
+
+
+# (version, name, function, deferred)
+MIGRATIONS = [
+    (1, "core_tables",               _m001_core_tables,               False),
+    (2, "add_columns",               _m002_add_columns,               False),
+    (3, "text_to_date_columns",      _m003_text_to_date_columns,      False),
+    (4, "backfill_expense_category", _m004_backfill_expense_category, False),
+    (5, "indexes",                   _m005_indexes,                   False),
+    (6, "csv_import_tables",         _m006_csv_import_tables,         False),
+    (7, "transactions_user_id",      _m007_transactions_user_id,      False),
+    (8, "month_category_rollup",     _m008_month_category_rollup,     False),
+    (9, "bank_daily_balances",       _m009_bank_daily_balances,       False),
+    (10, "partition_by_month",       _m010_partition_by_month,        True),
+    (11, "analytics_logins_daily",   _m011_analytics_logins_daily,    False),
+    (12, "user_data_version",        _m012_user_data_version,         False),
+    (13, "search_trigram",           _m013_search_trigram,            False),
+    (14, "import_fingerprints",      _m014_import_fingerprints,       False),
+    (15, "bank_daily_balances_backfill", _m015_bank_daily_balances_backfill, True),
+]
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# RUNNER
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _applied_versions() -> set:
+    with get_db() as (conn, cursor):
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version    INTEGER PRIMARY KEY,
+            name       TEXT NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )""")
+        cursor.execute("SELECT version FROM schema_migrations")
+        return {r["version"] for r in cursor.fetchall()}
+
+
+def _apply(version: int, name: str, fn) -> bool:
+    """Run one migration in its own transaction. Returns False if another process beat us to it."""
+    with get_db() as (conn, cursor):
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_MIGRATION_LOCK_KEY,))
+        cursor.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+        if cursor.fetchone():
+            return False
+        fn(cursor)
+        cursor.execute(
+            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+            (version, name)
+        )
     return True
 
 
-create_tables()
+def run_migrations(include_deferred=False) -> list:
+    """
+    Apply pending migrations in version order. Returns the versions applied.
+    `include_deferred` is True for every deferred migration, or a collection
+    of the deferred versions to run this time.
+    """
+    applied = _applied_versions()
+    done    = []
+    for version, name, fn, deferred in MIGRATIONS:
+        if deferred and include_deferred is not True:
+            if not include_deferred or version not in include_deferred:
+                continue
+        if version in applied:
+            continue
+        if _apply(version, name, fn):
+            done.append(version)
+    return done
+
+
+def ensure_partitions(months_ahead: int = _PARTITION_MONTHS_AHEAD) -> int:
+    """
+    Create next months' partitions for transactions and expenses ahead of
+    need. A no-op until the deferred partitioning migration has run.
+    Returns the number of partitions created.
+    """
+    with get_db() as (conn, cursor):
+        cursor.execute("SELECT 1 FROM schema_migrations WHERE version = 10")
+        if not cursor.fetchone():
+            return 0
+        made = 0
+        for table in ("transactions", "expenses"):
+            cursor.execute(
+                "SELECT ensure_month_partitions(%s, CURRENT_DATE, "
+                "(CURRENT_DATE + %s * INTERVAL '1 month')::date) AS n",
+                (table, months_ahead)
+            )
+            made += cursor.fetchone()["n"]
+        return made
+
+
+def pending_migrations() -> list:
+    """[(version, name, deferred)] not yet recorded in schema_migrations."""
+    applied = _applied_versions()
+    return [(v, n, d) for v, n, _fn, d in MIGRATIONS if v not in applied]
+
+
+@st.cache_resource(show_spinner=False)
+def create_tables():
+    """
+    Runs ONCE per server process. On an up-to-date database this is a single
+    version check; only pending, non-deferred migrations are applied. Every
+    subsequent call is a free cache hit — zero DB work, zero latency.
+    """
+    run_migrations(include_deferred=False)
+    ensure_partitions()
+    return True
+
+
+def _cli(argv) -> None:
+    if "--status" in argv:
+        pending = pending_migrations()
+        print(f"{len(MIGRATIONS) - len(pending)} of {len(MIGRATIONS)} migrations applied.")
+        for version, name, deferred in pending:
+            print(f"  pending {version:03d} {name}" + (" (deferred)" if deferred else ""))
+        return
+    deferred = False
+    if "--deferred" in argv:
+        deferred = {int(a) for a in argv if a.isdigit()} or True
+    applied = run_migrations(include_deferred=deferred)
+    print(f"Applied {len(applied)} migration(s): {applied}" if applied else "Schema is up to date.")
+
+
+if __name__ == "__main__":
+    _cli(sys.argv[1:])
+else:
+    create_tables()
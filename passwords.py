@@ -0,0 +1,155 @@
+# passwords.py — bcrypt on a bounded worker pool, with a configurable cost
+#
+# bcrypt is deliberately CPU-heavy (~250 ms at cost 12). Run on the script
+# thread, a login spike stalled every other rerun in the process. Hashing and
+# verification now run on a small dedicated executor — bcrypt releases the
+# GIL, so workers use real cores while script threads stay responsive — and
+# submissions beyond BCRYPT_MAX_QUEUE are refused with HasherBusy rather than
+# piling up behind each other.
+#
+# Settings (st.secrets, all optional):
+#   BCRYPT_ROUNDS     work factor for new hashes (default 12, bcrypt's default)
+#   BCRYPT_WORKERS    executor threads (default: CPU count)
+#   BCRYPT_MAX_QUEUE  in-flight + queued jobs before HasherBusy (default 64)
+#
+# Stored hashes with a different cost are upgraded after a successful login
+# (see auth.login_user → needs_rehash / rehash_in_background).
+#
+#   python passwords.py --bench          → verifications/sec per core at costs 10–14
+#   python passwords.py --bench 11 13    → just those costs
+#
+# Public API
+# ──────────
+#   hash_password(password)                 → bytes
+#   check_password(password, hashed)        → bool
+#   needs_rehash(hashed)                    → bool, stored cost != BCRYPT_ROUNDS
+#   rehash_in_background(password, on_done) → schedule a re-hash, on_done(new_hash) after
+#   queue_depth()                           → (jobs in flight or queued, workers)
+from __future__ import annotations
+
+import os
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+import streamlit as st
+
+from db import setting
+
+
+_DEFAULT_ROUNDS = 12
+_JOB_TIMEOUT_S  = 30
+
+
+class HasherBusy(RuntimeError):
+    """More bcrypt jobs are queued than BCRYPT_MAX_QUEUE allows."""
+
+
+class _Hasher:
+    def __init__(self, rounds: int, workers: int, max_queue: int):
+        self.rounds    = rounds
+        self.workers   = workers
+        self.max_queue = max_queue
+        self.lock      = threading.Lock()
+        self.depth     = 0
+        self.executor  = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+
+    def submit(self, fn, *args):
+        with self.lock:
+            if self.depth >= self.max_queue:
+                raise HasherBusy(f"{self.depth} bcrypt jobs already queued")
+            self.depth += 1
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, _future) -> None:
+        with self.lock:
+            self.depth -= 1
+
+
+@st.cache_resource
+def _get_hasher() -> _Hasher:
+    return _Hasher(
+        rounds=setting("BCRYPT_ROUNDS", _DEFAULT_ROUNDS),
+        workers=setting("BCRYPT_WORKERS", os.cpu_count() or 2),
+        max_queue=setting("BCRYPT_MAX_QUEUE", 64),
+    )
+
+
+def _as_bytes(hashed) -> bytes:
+    if isinstance(hashed, memoryview):
+        return bytes(hashed)
+    if isinstance(hashed, str):
+        return hashed.encode()
+    return hashed
+
+
+def hash_password(password: str) -> bytes:
+    hasher = _get_hasher()
+    salt   = bcrypt.gensalt(rounds=hasher.rounds)
+    return hasher.submit(bcrypt.hashpw, password.encode(), salt).result(timeout=_JOB_TIMEOUT_S)
+
+
+def check_password(password: str, hashed) -> bool:
+    hashed = _as_bytes(hashed)
+    return _get_hasher().submit(bcrypt.checkpw, password.encode(), hashed).result(timeout=_JOB_TIMEOUT_S)
+
+
+def needs_rehash(hashed) -> bool:
+    """True when the stored hash ($2b$<cost>$…) was made with a different work factor."""
+    try:
+        return int(_as_bytes(hashed).split(b"$")[2]) != _get_hasher().rounds
+    except (IndexError, ValueError):
+        return False
+
+
+def rehash_in_background(password: str, on_done) -> None:
+    """Hash at the current cost off the request path; on_done(new_hash) runs on the worker."""
+    hasher = _get_hasher()
+    salt   = bcrypt.gensalt(rounds=hasher.rounds)
+
+    def _job():
+        on_done(bcrypt.hashpw(password.encode(), salt))
+
+    try:
+        hasher.submit(_job)
+    except HasherBusy:
+        pass  # try again on the next login
+
+
+def queue_depth() -> tuple:
+    hasher = _get_hasher()
+    with hasher.lock:
+        return hasher.depth, hasher.workers
+
+
+# ── Benchmark ─────────────────────────────────────────────────────────────────
+
+def _bench(costs, seconds: float = 3.0) -> None:
+    """Single-threaded checkpw throughput per cost ≈ logins/sec one core can serve."""
+    print(f"{'cost':>4}  {'ms/login':>9}  {'logins/s/core':>13}")
+    for cost in costs:
+        hashed = bcrypt.hashpw(b"benchmark-password", bcrypt.gensalt(rounds=cost))
+        n, t0  = 0, time.perf_counter()
+        while time.perf_counter() - t0 < seconds or n < 2:
+            bcrypt.checkpw(b"benchmark-password", hashed)
+            n += 1
+        per = (time.perf_counter() - t0) / n
+        print(f"{cost:>4}  {per * 1000:>9.1f}  {1 / per:>13.1f}")
+    print(f"\n{os.cpu_count()} core(s) here; multiply by BCRYPT_WORKERS for the process ceiling.")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "--bench" in args:
+        costs = [int(a) for a in args if a.isdigit()] or list(range(10, 15))
+        _bench(costs)
+    else:
+        print("usage: python passwords.py --bench [cost ...]")
@@ -25,6 +25,7 @@ from reportlab.platypus import (
 )
 
 from db import get_db
+from snapshots import daily_source
 
 # ── Brand colours ─────────────────────────────────────────────────────────────
 DARK_NAVY   = colors.HexColor("#1a3c5e")
@@ -225,7 +226,7 @@ def fetch_monthly_data(user_id: int, year: int, month: int) -> dict:
     prev_end   = m_start - timedelta(days=1)
     prev_start = prev_end.replace(day=1)
 
-    with get_db() as (conn, cursor):
+    with get_db(readonly=True) as (conn, cursor):
         # User name
         cursor.execute("SELECT surname, other_names FROM users WHERE id=%s", (user_id,))
         u = cursor.fetchone()
@@ -236,8 +237,8 @@ def fetch_monthly_data(user_id: int, year: int, month: int) -> dict:
             SELECT
               COALESCE(SUM(CASE WHEN t.type='credit' THEN t.amount ELSE 0 END),0) AS income,
               COALESCE(SUM(CASE WHEN t.type='debit'  THEN t.amount ELSE 0 END),0) AS spent
-            FROM transactions t JOIN banks b ON t.bank_id=b.id
-            WHERE b.user_id=%s AND t.created_at>=%s AND t.created_at<=%s
+            FROM transactions t
+            WHERE t.user_id=%s AND t.created_at>=%s AND t.created_at<=%s
         """, (user_id, m_start, m_end))
         totals = cursor.fetchone()
         income = int(totals["income"] or 0)
@@ -248,8 +249,8 @@ def fetch_monthly_data(user_id: int, year: int, month: int) -> dict:
             SELECT
               COALESCE(SUM(CASE WHEN t.type='credit' THEN t.amount ELSE 0 END),0) AS income,
               COALESCE(SUM(CASE WHEN t.type='debit'  THEN t.amount ELSE 0 END),0) AS spent
-            FROM transactions t JOIN banks b ON t.bank_id=b.id
-            WHERE b.user_id=%s AND t.created_at>=%s AND t.created_at<=%s
+            FROM transactions t
+            WHERE t.user_id=%s AND t.created_at>=%s AND t.created_at<=%s
         """, (user_id, prev_start, prev_end))
         prev = cursor.fetchone()
         prev_income = int(prev["income"] or 0)
@@ -257,12 +258,11 @@ def fetch_monthly_data(user_id: int, year: int, month: int) -> dict:
 
         # Category breakdown
         cursor.execute("""
-            SELECT COALESCE(e.category, e.name) AS cat,
-                   SUM(e.amount) AS total, COUNT(*) AS cnt
-            FROM expenses e JOIN banks b ON e.bank_id=b.id
-            WHERE b.user_id=%s AND e.created_at>=%s AND e.created_at<=%s
-            GROUP BY cat ORDER BY total DESC
-        """, (user_id, m_start, m_end))
+            SELECT category AS cat, spent AS total, txn_count AS cnt
+            FROM user_month_category_totals
+            WHERE user_id=%s AND month=%s
+            ORDER BY total DESC
+        """, (user_id, m_start))
         categories = cursor.fetchall()
 
         # All expenses
@@ -279,7 +279,7 @@ def fetch_monthly_data(user_id: int, year: int, month: int) -> dict:
         cursor.execute("""
             SELECT t.created_at, t.description, t.amount, b.bank_name
             FROM transactions t JOIN banks b ON t.bank_id=b.id
-            WHERE b.user_id=%s AND t.type='credit'
+            WHERE t.user_id=%s AND t.type='credit'
               AND t.created_at>=%s AND t.created_at<=%s
             ORDER BY t.created_at DESC
         """, (user_id, m_start, m_end))
@@ -318,7 +318,7 @@ def fetch_monthly_data(user_id: int, year: int, month: int) -> dict:
 
 def fetch_goal_data(user_id: int) -> dict:
     cursor_data = {}
-    with get_db() as (conn, cursor):
+    with get_db(readonly=True) as (conn, cursor):
         cursor.execute("SELECT surname, other_names FROM users WHERE id=%s", (user_id,))
         u = cursor.fetchone()
         cursor_data["user_name"] = f"{u['surname']} {u['other_names']}"
@@ -358,23 +358,22 @@ def fetch_category_budget_data(user_id: int, year: int, month: int) -> dict:
     m_start = date(year, month, 1)
     m_end   = date(year, month, calendar.monthrange(year, month)[1])
 
-    with get_db() as (conn, cursor):
+    with get_db(readonly=True) as (conn, cursor):
         cursor.execute("SELECT surname, other_names FROM users WHERE id=%s", (user_id,))
         u = cursor.fetchone()
         user_name = f"{u['surname']} {u['other_names']}"
 
         cursor.execute("""
             SELECT cb.category, cb.monthly_limit,
-                   COALESCE(SUM(e.amount), 0) AS spent
+                   COALESCE(r.spent, 0) AS spent
             FROM category_budgets cb
-            LEFT JOIN expenses e
-                ON COALESCE(e.category, e.name) = cb.category
-               AND e.user_id = cb.user_id
-               AND e.created_at >= %s AND e.created_at <= %s
+            LEFT JOIN user_month_category_totals r
+                ON r.user_id = cb.user_id
+               AND r.month = %s
+               AND r.category = cb.category
             WHERE cb.user_id = %s AND cb.monthly_limit > 0
-            GROUP BY cb.category, cb.monthly_limit
             ORDER BY cb.monthly_limit DESC
-        """, (m_start, m_end, user_id))
+        """, (m_start, user_id))
         cats = cursor.fetchall()
 
     return dict(user_name=user_name, year=year, month=month,
@@ -385,7 +384,7 @@ def fetch_bank_data(user_id: int, year: int, month: int) -> dict:
     m_start = date(year, month, 1)
     m_end   = date(year, month, calendar.monthrange(year, month)[1])
 
-    with get_db() as (conn, cursor):
+    with get_db(readonly=True) as (conn, cursor):
         cursor.execute("SELECT surname, other_names FROM users WHERE id=%s", (user_id,))
         u = cursor.fetchone()
         user_name = f"{u['surname']} {u['other_names']}"
@@ -396,21 +395,27 @@ def fetch_bank_data(user_id: int, year: int, month: int) -> dict:
         """, (user_id,))
         banks = cursor.fetchall()
 
+        # Month totals for every bank from the daily snapshots; month-end
+        # balance = live balance minus the net of every day after the month.
+        cursor.execute(f"""
+            SELECT bank_id,
+                   COALESCE(SUM(credit)        FILTER (WHERE day <= %s), 0) AS credit,
+                   COALESCE(SUM(debit)         FILTER (WHERE day <= %s), 0) AS debit,
+                   COALESCE(SUM(txn_count)     FILTER (WHERE day <= %s), 0) AS txn_count,
+                   COALESCE(SUM(credit - debit) FILTER (WHERE day > %s), 0) AS net_after
+            FROM {daily_source()} s
+            WHERE user_id=%s AND day>=%s
+            GROUP BY bank_id
+        """, (m_end, m_end, m_end, m_end, user_id, m_start))
+        snaps = {r["bank_id"]: r for r in cursor.fetchall()}
+
         bank_details = []
         for b in banks:
-            cursor.execute("""
-                SELECT type,
-                       COALESCE(SUM(CASE WHEN type='credit' THEN amount ELSE 0 END),0) AS credit,
-                       COALESCE(SUM(CASE WHEN type='debit'  THEN amount ELSE 0 END),0) AS debit,
-                       COUNT(*) AS txn_count
-                FROM transactions
-                WHERE bank_id=%s AND created_at>=%s AND created_at<=%s
-                GROUP BY type
-            """, (b["id"], m_start, m_end))
-            rows = cursor.fetchall()
-            credit = sum(int(r["credit"]) for r in rows)
-            debit  = sum(int(r["debit"])  for r in rows)
-            count  = sum(int(r["txn_count"]) for r in rows)
+            snap   = snaps.get(b["id"]) or {}
+            credit = int(snap.get("credit") or 0)
+            debit  = int(snap.get("debit") or 0)
+            count  = int(snap.get("txn_count") or 0)
+            closing = int(b["balance"]) - int(snap.get("net_after") or 0)
 
             cursor.execute("""
                 SELECT created_at, type, description, amount
@@ -425,6 +430,7 @@ def fetch_bank_data(user_id: int, year: int, month: int) -> dict:
                 account_name=b["account_name"],
                 account_number=b["account_number"],
                 balance=int(b["balance"]),
+                closing_balance=closing,
                 credit=credit, debit=debit, net=credit-debit,
                 txn_count=count,
                 transactions=txns,
@@ -810,6 +816,7 @@ def build_bank_report(data: dict) -> bytes:
                       S["h2"]),
             Paragraph(
                 f"Current balance: <b>{_ngn(b['balance'])}</b> &nbsp;|&nbsp; "
+                f"Month-end balance: {_ngn(b['closing_balance'])} &nbsp;|&nbsp; "
                 f"Money in: {_ngn(b['credit'])} &nbsp;|&nbsp; "
                 f"Money out: {_ngn(b['debit'])} &nbsp;|&nbsp; "
                 f"{b['txn_count']} transaction{'s' if b['txn_count'] != 1 else ''} this month",
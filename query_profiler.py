@@ -0,0 +1,174 @@
+# query_profiler.py — per-query timing and N+1 detection for every cursor
+#
+# db._get_pool() uses ProfilingCursor as its cursor_factory. When profiling is
+# off (the default) execute() is a straight pass-through to RealDictCursor.
+# When on — for admin sessions, or every session if DB_QUERY_PROFILING=1 —
+# each statement is fingerprinted and timed into a per-rerun QueryProfile,
+# and finished profiles are kept in a small process-wide log for the Admin
+# Panel.
+#
+# Public API
+# ──────────
+#   start_query_profile(enabled)   → call at the top of each script run
+#   finish_query_profile(label)    → call when the page has rendered; returns the profile
+#   get_query_log()                → dict {runs, fingerprints} for the Admin Panel
+from __future__ import annotations
+
+import os
+import re
+import time
+import threading
+from collections import deque
+from datetime import datetime
+
+import streamlit as st
+import psycopg2.extras
+import psycopg2.sql
+
+
+N_PLUS_ONE_THRESHOLD = 5     # same fingerprint this many times in one rerun → flagged
+_RUN_LOG_SIZE        = 200   # finished reruns kept for the Admin Panel
+_ENV_FLAG            = "DB_QUERY_PROFILING"
+
+_WS_RE     = re.compile(r"\s+")
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+
+_current = threading.local()
+
+
+def fingerprint(sql: str) -> str:
+    """Collapse whitespace and literals so the same statement shape groups together."""
+    sql = _STRING_RE.sub("?", sql)
+    sql = _NUMBER_RE.sub("?", sql)
+    return _WS_RE.sub(" ", sql).strip()
+
+
+class QueryProfile:
+    """Statement stats for one script run."""
+
+    def __init__(self):
+        self.started_at = datetime.now()
+        self.queries    = 0
+        self.total_ms   = 0.0
+        self.rows       = 0
+        self.by_fp      = {}   # fingerprint → [count, total_ms, max_ms, rows]
+
+    def record(self, fp: str, ms: float, rows: int) -> None:
+        self.queries  += 1
+        self.total_ms += ms
+        self.rows     += max(rows, 0)
+        entry = self.by_fp.get(fp)
+        if entry is None:
+            self.by_fp[fp] = [1, ms, ms, max(rows, 0)]
+        else:
+            entry[0] += 1
+            entry[1] += ms
+            entry[2]  = max(entry[2], ms)
+            entry[3] += max(rows, 0)
+
+    def n_plus_one(self) -> list:
+        """Fingerprints executed in a loop — [(fingerprint, count, total_ms)], worst first."""
+        hits = [(fp, e[0], round(e[1], 1)) for fp, e in self.by_fp.items()
+                if e[0] >= N_PLUS_ONE_THRESHOLD]
+        return sorted(hits, key=lambda h: h[1], reverse=True)
+
+
+class _QueryLog:
+    def __init__(self):
+        self.lock         = threading.Lock()
+        self.runs         = deque(maxlen=_RUN_LOG_SIZE)
+        self.fingerprints = {}   # fingerprint → [count, total_ms, max_ms, rows]
+
+
+@st.cache_resource
+def _get_log() -> _QueryLog:
+    return _QueryLog()
+
+
+class ProfilingCursor(psycopg2.extras.RealDictCursor):
+    """RealDictCursor that times each statement into the current run's profile."""
+
+    def _sql_text(self, query) -> str:
+        # str from most callers, bytes from psycopg2.extras.execute_values,
+        # sql.Composable from psycopg2.sql.
+        if isinstance(query, bytes):
+            return query.decode(self.connection.encoding, errors="replace")
+        if isinstance(query, psycopg2.sql.Composable):
+            return query.as_string(self)
+        return str(query)
+
+    def _record(self, profile, query, t0) -> None:
+        """Never lets profiling change the outcome of the statement."""
+        try:
+            ms = (time.perf_counter() - t0) * 1000
+            profile.record(fingerprint(self._sql_text(query)), ms, self.rowcount)
+        except Exception:
+            pass
+
+    def execute(self, query, vars=None):
+        profile = getattr(_current, "profile", None)
+        if profile is None:
+            return super().execute(query, vars)
+        t0 = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            self._record(profile, query, t0)
+
+    def executemany(self, query, vars_list):
+        profile = getattr(_current, "profile", None)
+        if profile is None:
+            return super().executemany(query, vars_list)
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._record(profile, query, t0)
+
+
+def start_query_profile(enabled: bool = False) -> None:
+    """Begin a fresh profile for this run if `enabled` or DB_QUERY_PROFILING=1."""
+    if enabled or os.environ.get(_ENV_FLAG, "") not in ("", "0"):
+        _current.profile = QueryProfile()
+    else:
+        _current.profile = None
+
+
+def finish_query_profile(label: str = ""):
+    """Stop profiling this run, add it to the process log and return it (or None)."""
+    profile = getattr(_current, "profile", None)
+    _current.profile = None
+    if profile is None or not profile.queries:
+        return profile
+    log = _get_log()
+    with log.lock:
+        log.runs.append({
+            "at":         profile.started_at,
+            "page":       label,
+            "queries":    profile.queries,
+            "total_ms":   round(profile.total_ms, 1),
+            "rows":       profile.rows,
+            "n_plus_one": profile.n_plus_one(),
+        })
+        for fp, (count, total, peak, rows) in profile.by_fp.items():
+            agg = log.fingerprints.setdefault(fp, [0, 0.0, 0.0, 0])
+            agg[0] += count
+            agg[1] += total
+            agg[2]  = max(agg[2], peak)
+            agg[3] += rows
+    return profile
+
+
+def get_query_log() -> dict:
+    """Recent profiled reruns (newest first) and process-wide totals per fingerprint."""
+    log = _get_log()
+    with log.lock:
+        runs = list(reversed(log.runs))
+        fps  = [
+            {"fingerprint": fp, "calls": c, "total_ms": round(t, 1),
+             "avg_ms": round(t / c, 2) if c else 0.0, "max_ms": round(m, 1), "rows": r}
+            for fp, (c, t, m, r) in log.fingerprints.items()
+        ]
+    fps.sort(key=lambda f: f["total_ms"], reverse=True)
+    return {"runs": runs, "fingerprints": fps}
@@ -0,0 +1,166 @@
+# rate_limiter.py — in-process token buckets with write-behind persistence
+#
+# auth._check_rate_limit / _rate_limit_remaining used to COUNT(*) rate_limit_log
+# and INSERT a row on every attempt, each on its own pooled connection — so a
+# credential-stuffing burst became a burst of DB writes competing with real
+# users for the pool.
+#
+# Each (identifier, action) now has a bucket of `max_attempts` tokens that
+# refills continuously over `window_minutes`; an attempt spends one token and
+# is refused when none are left. That is the same "N attempts per window"
+# decision, smoothed instead of a hard sliding count.
+#
+# Persistence: attempts are queued in memory and written to rate_limit_log in
+# batches by one background thread. A bucket is seeded from rate_limit_log the
+# first time its key is seen in this process and re-synced every _SYNC_S
+# seconds, so limits survive restarts and attempts made through other server
+# processes count here too.
+#
+# Public API
+# ──────────
+#   get_rate_limiter()                                   → process-wide RateLimiter
+#   RateLimiter.hit(identifier, action, max, window_min) → bool, True if allowed (spends a token)
+#   RateLimiter.remaining(identifier, action, max, window_min) → int
+#   RateLimiter.flush()                                  → write queued attempts now
+from __future__ import annotations
+
+import time
+import atexit
+import threading
+from datetime import datetime, timedelta
+
+import streamlit as st
+import psycopg2.extras
+
+from db import get_db
+
+
+_SYNC_S           = 10      # re-read a bucket's DB count at most this often
+_FLUSH_INTERVAL_S = 2.0     # background writer cadence
+_FLUSH_BATCH      = 200     # …or sooner once this many attempts are queued
+_MAX_PENDING      = 10_000  # queued attempts kept if the DB is unreachable
+
+
+class _Bucket:
+    __slots__ = ("tokens", "capacity", "window_s", "updated", "synced")
+
+    def __init__(self, tokens: float, capacity: int, window_s: float, now: float):
+        self.tokens   = tokens
+        self.capacity = capacity
+        self.window_s = window_s
+        self.updated  = now
+        self.synced   = now
+
+    def refill(self, now: float) -> None:
+        rate         = self.capacity / self.window_s
+        self.tokens  = min(self.capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+
+class RateLimiter:
+    """Token buckets keyed by (identifier, action); attempts persisted write-behind."""
+
+    def __init__(self):
+        self.lock    = threading.Lock()
+        self.buckets = {}   # (identifier, action) → _Bucket
+        self.pending = []   # (identifier, action, attempted_at) not yet in rate_limit_log
+        self.wake    = threading.Event()
+        self.thread  = threading.Thread(target=self._flush_loop, name="rate-limit-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.flush)
+
+    # ── decisions ────────────────────────────────────────────────────────────
+
+    def hit(self, identifier: str, action: str, max_attempts: int, window_minutes: int) -> bool:
+        bucket = self._bucket(identifier, action, max_attempts, window_minutes)
+        with self.lock:
+            bucket.refill(time.monotonic())
+            if bucket.tokens < 1:
+                return False
+            bucket.tokens -= 1
+            self.pending.append((identifier, action, datetime.now()))
+            if len(self.pending) >= _FLUSH_BATCH:
+                self.wake.set()
+        return True
+
+    def remaining(self, identifier: str, action: str, max_attempts: int, window_minutes: int) -> int:
+        bucket = self._bucket(identifier, action, max_attempts, window_minutes)
+        with self.lock:
+            bucket.refill(time.monotonic())
+            return int(bucket.tokens)
+
+    def _bucket(self, identifier: str, action: str, max_attempts: int, window_minutes: int) -> _Bucket:
+        key = (identifier, action)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is not None and now - bucket.synced < _SYNC_S:
+                return bucket
+
+        # Seed / re-sync from the persisted log outside the lock.
+        used = self._recorded(identifier, action, window_minutes)
+        with self.lock:
+            used  += sum(1 for p in self.pending if p[0] == identifier and p[1] == action)
+            seeded = float(max(max_attempts - used, 0))
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = _Bucket(seeded, max_attempts, window_minutes * 60, now)
+            else:
+                bucket.refill(now)
+                bucket.tokens = min(bucket.tokens, seeded)
+                bucket.synced = now
+            return bucket
+
+    @staticmethod
+    def _recorded(identifier: str, action: str, window_minutes: int) -> int:
+        try:
+            cutoff = datetime.now() - timedelta(minutes=window_minutes)
+            with get_db() as (conn, cursor):
+                cursor.execute("""
+                    SELECT COUNT(*) AS n FROM rate_limit_log
+                    WHERE identifier = %s AND action = %s AND attempted_at >= %s
+                """, (identifier, action, cutoff))
+                return int(cursor.fetchone()["n"] or 0)
+        except Exception:
+            return 0  # fail open — don't lock users out on DB error
+
+    # ── write-behind ─────────────────────────────────────────────────────────
+
+    def flush(self) -> int:
+        """Write every queued attempt in one statement. Returns rows written."""
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if not batch:
+            return 0
+        try:
+            with get_db() as (conn, cursor):
+                psycopg2.extras.execute_values(
+                    cursor,
+                    "INSERT INTO rate_limit_log (identifier, action, attempted_at) VALUES %s",
+                    batch
+                )
+            return len(batch)
+        except Exception:
+            with self.lock:
+                self.pending = (batch + self.pending)[-_MAX_PENDING:]
+            return 0
+
+    def _prune(self) -> None:
+        """Forget buckets that have been idle long enough to refill completely."""
+        now = time.monotonic()
+        with self.lock:
+            idle = [k for k, b in self.buckets.items() if now - b.updated > b.window_s]
+            for k in idle:
+                del self.buckets[k]
+
+    def _flush_loop(self) -> None:
+        while True:
+            self.wake.wait(_FLUSH_INTERVAL_S)
+            self.wake.clear()
+            self.flush()
+            self._prune()
+
+
+@st.cache_resource
+def get_rate_limiter() -> RateLimiter:
+    return RateLimiter()
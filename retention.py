@@ -1,11 +1,18 @@
 # retention.py — streaks, in-app notifications, onboarding tips, re-engagement
 #
-# Call run_retention_engine(user_id) once per login (from app.py after auth).
-# It is idempotent for the same calendar day — safe to call on every page load.
+# Streak advance, onboarding tips and smart reminders run as one nightly batch
+# over all users in set-based SQL (INSERT … SELECT / data-modifying CTEs) — the
+# page only reads the results. Activity comes from analytics_logins, which
+# app.py records once per user per day. Schedule shortly after midnight:
+#
+#   python retention.py                    → run for today (credits yesterday's streaks)
+#   python retention.py --date 2026-01-31  → run as of a given day
+#
+# Idempotent for the same date — safe to re-run.
 #
 # Public API
 # ──────────
-#   run_retention_engine(user_id)          → call after every successful login
+#   run_retention_batch(today=None)        → dict of rows written per step, elapsed_s
 #   get_streak(user_id)                    → dict {current, longest, last_active_date}
 #   get_notifications(user_id, unread_only)→ list of notification dicts
 #   mark_notifications_read(user_id)       → mark all as read
@@ -14,10 +21,15 @@
 #   push_notification(user_id, type, title, body, icon) → insert one notification
 from __future__ import annotations
 
+import sys
+import time
+
 import streamlit as st
 from datetime import datetime, timedelta, date
 
 from db import get_db
+from cache_versions import NOTIFICATIONS, get_version, bump
+from cache_bus import publish
 
 
 # ── Onboarding tip sequence ──────────────────────────────────────────────────
@@ -96,95 +108,118 @@ _STREAK_MILESTONES = [
           "&#x1F48E;"),
 ]
 
-# ── In-app reminder schedule ──────────────────────────────────────────────────
-# Reminders generated automatically based on user data.
-# These fire at most once per day per type.
+# ── In-app reminder copy ──────────────────────────────────────────────────────
+# Bodies are PostgreSQL format() templates (%s placeholders) filled in by the
+# reminder INSERT … SELECT statements below. Each reminder type fires at most
+# once per user per day, keyed on its title prefix.
+_REMINDER_TEMPLATES = {
+    "bill":          "<strong>%s</strong> is due %s (%s) — NGN %s. "
+                     "Make sure you have enough balance on the account it will come from.",
+    "budget_50":     "You have spent <strong>NGN %s</strong> — half your NGN %s monthly budget. "
+                     "NGN %s remaining.",
+    "budget_80":     "You have used <strong>%s%% of your monthly budget</strong> (NGN %s of NGN %s). "
+                     "Only NGN %s left — slow down.",
+    "budget_over":   "You have exceeded your NGN %s monthly budget by <strong>NGN %s</strong>. "
+                     "Review your expenses and pause non-essential spending.",
+    "streak_broken": "Your %s-day tracking streak ended yesterday. "
+                     "Don't let it stop you — start a new one today. "
+                     "Log one expense now to get back on track.",
+    "goal":          "Your <strong>%s</strong> goal is <strong>%s%% complete</strong>! "
+                     "Just NGN %s left. One more contribution and you are done!",
+    "weekly":        "You logged %s expense%s last week. ",
+    "no_expenses":   "It has been <strong>%s days</strong> since your last expense. "
+                     "Logging accurately keeps your balance right. "
+                     "Tap Expenses and add anything you have spent since %s.",
+    "month_end":     "The month is almost over and you have <strong>NGN %s left</strong>. "
+                     "Transfer some to a savings goal before new-month expenses arrive. "
+                     "Even NGN %s moved now builds a habit.",
+    "welcome":       "Good to see you! You were away for %s days. ",
+    "welcome_spent": "NGN %s has been spent this month so far. ",
+}
+
+# Only users seen within this many days get reminders — a nightly job has no
+# login to hang them on, so this keeps long-gone accounts from piling up inbox rows.
+_REMINDER_ACTIVE_DAYS = 30
+_RETENTION_LOCK_KEY   = 874_201   # pg advisory lock: one batch run at a time
 
 
 # ─────────────────────────────────────────────────────────────────────────────
-# PUBLIC: Main entry point
+# PUBLIC: Nightly batch
 # ─────────────────────────────────────────────────────────────────────────────
 
-def run_retention_engine(user_id: int) -> None:
+def run_retention_batch(today: date | None = None) -> dict:
     """
-    Call once per login. Updates streak, delivers onboarding tips, generates
-    smart in-app reminders, and fires milestone notifications.
-    All operations are idempotent for the same calendar day.
+    Advance every streak, deliver due onboarding tips and generate reminders
+    for all users in a handful of set-based statements. Run once a day shortly
+    after midnight (see CLI below); streaks are credited for yesterday's
+    activity, tips and reminders are dated today.
+    Idempotent for the same `today` — re-running inserts nothing new.
     """
-    today = datetime.now().date()
-
-    _update_streak(user_id, today)
-    _deliver_onboarding_tip(user_id, today)
-    _generate_reminders(user_id, today)
+    today = today or datetime.now().date()
+    t0 = time.perf_counter()
+    streaks, milestones = _advance_streaks(today - timedelta(days=1))
+    report = {
+        "streaks_advanced": streaks,
+        "milestones":       milestones,
+        "tips":             _deliver_onboarding_tips(today),
+        "reminders":        _generate_reminders(today),
+    }
+    # Inboxes changed for many users — every server process refreshes badges once.
+    publish(None, NOTIFICATIONS)
+    report["elapsed_s"] = round(time.perf_counter() - t0, 2)
+    return report
 
 
 # ─────────────────────────────────────────────────────────────────────────────
 # STREAK ENGINE
 # ─────────────────────────────────────────────────────────────────────────────
 
-def _update_streak(user_id: int, today: date) -> None:
-    """Update the user's streak. Fires milestone notifications when thresholds hit."""
+def _advance_streaks(active_day: date) -> tuple:
+    """
+    Credit every user with an analytics_logins row on `active_day`: extend the
+    streak when the last credited day was the day before, otherwise restart it
+    at 1. Milestone notifications go out in the same statement, once each.
+    Returns (streaks advanced, milestones fired).
+    """
+    days, titles, bodies, icons = (list(col) for col in zip(*_STREAK_MILESTONES))
     with get_db() as (conn, cursor):
-        cursor.execute(
-            "SELECT current_streak, longest_streak, last_active_date "
-            "FROM user_streaks WHERE user_id = %s",
-            (user_id,)
-        )
-        row = cursor.fetchone()
-
-        if row is None:
-            # First ever login — create the streak row
-            cursor.execute("""
-                INSERT INTO user_streaks (user_id, current_streak, longest_streak, last_active_date)
-                VALUES (%s, 1, 1, %s)
-            """, (user_id, today))
-            _maybe_fire_milestone(cursor, user_id, 1)
-            return
-
-        last   = row["last_active_date"]
-        curr   = int(row["current_streak"])
-        longest= int(row["longest_streak"])
-
-        if last == today:
-            return  # already updated today — idempotent
-
-        yesterday = today - timedelta(days=1)
-        if last == yesterday:
-            # Consecutive day — extend streak
-            new_streak = curr + 1
-        else:
-            # Gap — streak broken
-            new_streak = 1
-
-        new_longest = max(longest, new_streak)
-
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_RETENTION_LOCK_KEY,))
         cursor.execute("""
-            UPDATE user_streaks
-            SET current_streak = %s,
-                longest_streak = %s,
-                last_active_date = %s,
-                streak_updated_at = NOW()
-            WHERE user_id = %s
-        """, (new_streak, new_longest, today, user_id))
-
-        _maybe_fire_milestone(cursor, user_id, new_streak)
-
-
-def _maybe_fire_milestone(cursor, user_id: int, streak: int) -> None:
-    """Insert a milestone notification if this streak hits a threshold — once only."""
-    for days, title, body, icon in _STREAK_MILESTONES:
-        if streak == days:
-            # Check we haven't already sent this milestone
-            cursor.execute("""
-                SELECT id FROM notifications
-                WHERE user_id = %s AND type = 'milestone' AND title = %s
-            """, (user_id, title))
-            if not cursor.fetchone():
-                cursor.execute("""
-                    INSERT INTO notifications (user_id, type, title, body, icon)
-                    VALUES (%s, 'milestone', %s, %s, %s)
-                """, (user_id, title, body, icon))
-            break
+            WITH active AS (
+                SELECT user_id FROM analytics_logins WHERE login_date = %(day)s
+            ),
+            advanced AS (
+                INSERT INTO user_streaks (user_id, current_streak, longest_streak, last_active_date)
+                SELECT user_id, 1, 1, %(day)s FROM active
+                ON CONFLICT (user_id) DO UPDATE
+                SET current_streak = CASE WHEN user_streaks.last_active_date = %(day)s - 1
+                                          THEN user_streaks.current_streak + 1 ELSE 1 END,
+                    longest_streak = GREATEST(user_streaks.longest_streak,
+                                              CASE WHEN user_streaks.last_active_date = %(day)s - 1
+                                                   THEN user_streaks.current_streak + 1 ELSE 1 END),
+                    last_active_date  = EXCLUDED.last_active_date,
+                    streak_updated_at = NOW()
+                WHERE user_streaks.last_active_date IS NULL
+                   OR user_streaks.last_active_date < EXCLUDED.last_active_date
+                RETURNING user_id, current_streak
+            ),
+            fired AS (
+                INSERT INTO notifications (user_id, type, title, body, icon)
+                SELECT a.user_id, 'milestone', m.title, m.body, m.icon
+                FROM advanced a
+                JOIN unnest(%(days)s::int[], %(titles)s::text[], %(bodies)s::text[], %(icons)s::text[])
+                     AS m(days, title, body, icon) ON m.days = a.current_streak
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM notifications n
+                    WHERE n.user_id = a.user_id AND n.type = 'milestone' AND n.title = m.title
+                )
+                RETURNING 1
+            )
+            SELECT (SELECT COUNT(*) FROM advanced) AS streaks,
+                   (SELECT COUNT(*) FROM fired)    AS milestones
+        """, {"day": active_day, "days": days, "titles": titles, "bodies": bodies, "icons": icons})
+        row = cursor.fetchone()
+    return int(row["streaks"]), int(row["milestones"])
 
 
 def get_streak(user_id: int) -> dict:
@@ -209,291 +244,242 @@ def get_streak(user_id: int) -> dict:
 # ONBOARDING TIPS ENGINE
 # ─────────────────────────────────────────────────────────────────────────────
 
-def _deliver_onboarding_tip(user_id: int, today: date) -> None:
+def _deliver_onboarding_tips(today: date) -> int:
     """
-    Send the next onboarding tip to a new user — one per day, up to 7 total.
-    Stops after all tips are sent OR the account is more than 14 days old.
+    Send the next onboarding tip to every account at most 14 days old — one
+    per day, up to 7 total. Returns tips delivered.
     """
+    icons, titles, bodies = (list(col) for col in zip(*_ONBOARDING_TIPS))
     with get_db() as (conn, cursor):
-        # Check account age
-        cursor.execute("SELECT created_at FROM users WHERE id = %s", (user_id,))
-        user_row = cursor.fetchone()
-        if not user_row or not user_row["created_at"]:
-            return
-        account_age = (today - user_row["created_at"]).days
-        if account_age > 14:
-            return  # past the onboarding window
-
-        # Get or create onboarding_tips row
-        cursor.execute(
-            "SELECT tips_sent, last_tip_at FROM onboarding_tips WHERE user_id = %s",
-            (user_id,)
-        )
-        tips_row = cursor.fetchone()
-
-        if tips_row is None:
-            cursor.execute(
-                "INSERT INTO onboarding_tips (user_id, tips_sent, last_tip_at) VALUES (%s, 0, NULL)",
-                (user_id,)
-            )
-            tips_sent    = 0
-            last_tip_at  = None
-        else:
-            tips_sent   = int(tips_row["tips_sent"])
-            last_tip_at = tips_row["last_tip_at"]
-
-        if tips_sent >= len(_ONBOARDING_TIPS):
-            return  # all tips delivered
-
-        if last_tip_at == today:
-            return  # already sent one today
-
-        icon, title, body = _ONBOARDING_TIPS[tips_sent]
-
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_RETENTION_LOCK_KEY,))
         cursor.execute("""
-            INSERT INTO notifications (user_id, type, title, body, icon)
-            VALUES (%s, 'tip', %s, %s, %s)
-        """, (user_id, title, body, icon))
-
+            INSERT INTO onboarding_tips (user_id, tips_sent, last_tip_at)
+            SELECT id, 0, NULL FROM users
+            WHERE email_verified = 1 AND created_at >= %(today)s - 14
+            ON CONFLICT (user_id) DO NOTHING
+        """, {"today": today})
         cursor.execute("""
-            UPDATE onboarding_tips
-            SET tips_sent = tips_sent + 1, last_tip_at = %s
-            WHERE user_id = %s
-        """, (today, user_id))
+            WITH due AS (
+                SELECT o.user_id, o.tips_sent + 1 AS next_tip
+                FROM onboarding_tips o
+                JOIN users u ON u.id = o.user_id
+                WHERE u.email_verified = 1 AND u.created_at >= %(today)s - 14
+                  AND o.tips_sent < %(n_tips)s
+                  AND o.last_tip_at IS DISTINCT FROM %(today)s
+            ),
+            sent AS (
+                INSERT INTO notifications (user_id, type, title, body, icon)
+                SELECT d.user_id, 'tip', t.title, t.body, t.icon
+                FROM due d
+                JOIN unnest(%(icons)s::text[], %(titles)s::text[], %(bodies)s::text[])
+                     WITH ORDINALITY AS t(icon, title, body, n) ON t.n = d.next_tip
+            )
+            UPDATE onboarding_tips o
+            SET tips_sent = d.next_tip, last_tip_at = %(today)s
+            FROM due d
+            WHERE o.user_id = d.user_id
+        """, {"today": today, "n_tips": len(_ONBOARDING_TIPS),
+              "icons": icons, "titles": titles, "bodies": bodies})
+        return cursor.rowcount
 
 
 # ─────────────────────────────────────────────────────────────────────────────
 # SMART REMINDERS ENGINE
 # ─────────────────────────────────────────────────────────────────────────────
 
-def _already_sent_today(cursor, user_id: int, title_prefix: str, today: date) -> bool:
-    """Return True if a notification with this title prefix was sent today."""
-    cursor.execute("""
-        SELECT id FROM notifications
-        WHERE user_id = %s AND title LIKE %s
-          AND created_at::DATE = %s
-    """, (user_id, title_prefix + "%", today))
-    return cursor.fetchone() is not None
+def _not_sent_today(user_col: str, prefix: str) -> str:
+    """SQL predicate: no notification titled `prefix…` reached this user today."""
+    return f"""NOT EXISTS (
+        SELECT 1 FROM notifications n
+        WHERE n.user_id = {user_col} AND n.title LIKE '{prefix}%%'
+          AND n.created_at >= %(today)s AND n.created_at < %(tomorrow)s
+    )"""
+
+
+_NGN = "to_char({}, 'FM999,999,999,990')"
+
+# One INSERT … SELECT per reminder type, all against _retention_users — the
+# per-user facts (limit, month totals, last activity) computed once per run.
+_REMINDER_SQL = [
+    ("bill", f"""
+        INSERT INTO notifications (user_id, type, title, body, icon)
+        SELECT b.user_id, 'reminder', 'Bill Due: ' || b.name,
+               format(%(t_bill)s, b.name,
+                      CASE b.next_due - %(today)s WHEN 0 THEN 'today' WHEN 1 THEN 'in 1 day'
+                           ELSE 'in ' || (b.next_due - %(today)s) || ' days' END,
+                      b.next_due, {_NGN.format('b.amount')}),
+               '&#x1F514;'
+        FROM (
+            SELECT r.user_id, r.name, r.amount, r.next_due,
+                   ROW_NUMBER() OVER (PARTITION BY r.user_id ORDER BY r.next_due) AS rn
+            FROM recurring_items r
+            JOIN _retention_users u ON u.id = r.user_id
+            WHERE r.active = 1 AND r.next_due BETWEEN %(today)s AND %(three_days)s
+        ) b
+        WHERE b.rn <= 3 AND {_not_sent_today('b.user_id', 'Bill Due')}
+    """),
+    ("budget", f"""
+        INSERT INTO notifications (user_id, type, title, body, icon)
+        SELECT s.id, 'alert',
+               CASE WHEN s.pct >= 100 THEN 'Budget Alert: Limit Exceeded'
+                    WHEN s.pct >= 80  THEN 'Budget Alert: 80%% Used'
+                    ELSE 'Budget Alert: 50%% Used' END,
+               CASE WHEN s.pct >= 100
+                    THEN format(%(t_budget_over)s, {_NGN.format('s.lim')}, {_NGN.format('s.spent - s.lim')})
+                    WHEN s.pct >= 80
+                    THEN format(%(t_budget_80)s, round(s.pct), {_NGN.format('s.spent')},
+                                {_NGN.format('s.lim')}, {_NGN.format('s.lim - s.spent')})
+                    ELSE format(%(t_budget_50)s, {_NGN.format('s.spent')},
+                                {_NGN.format('s.lim')}, {_NGN.format('s.lim - s.spent')}) END,
+               CASE WHEN s.pct >= 100 THEN '&#x1F534;'
+                    WHEN s.pct >= 80  THEN '&#x1F6A8;'
+                    ELSE '&#x26A0;&#xFE0F;' END
+        FROM (
+            SELECT id, spending_limit AS lim, m_spent AS spent,
+                   m_spent * 100.0 / spending_limit AS pct
+            FROM _retention_users WHERE spending_limit > 0
+        ) s
+        WHERE (s.pct >= 100 OR s.pct >= 80 AND s.pct < 85 OR s.pct >= 50 AND s.pct < 55)
+          AND {_not_sent_today('s.id', 'Budget Alert')}
+    """),
+    ("streak_broken", f"""
+        INSERT INTO notifications (user_id, type, title, body, icon)
+        SELECT s.user_id, 'nudge', 'Streak Broken — Come Back!',
+               format(%(t_streak_broken)s, s.current_streak), '&#x1F614;'
+        FROM user_streaks s
+        JOIN _retention_users u ON u.id = s.user_id
+        WHERE s.last_active_date = %(today)s - 2 AND s.current_streak >= 3
+          AND {_not_sent_today('s.user_id', 'Streak Broken')}
+    """),
+    ("goal", f"""
+        INSERT INTO notifications (user_id, type, title, body, icon)
+        SELECT DISTINCT ON (g.user_id)
+               g.user_id, 'milestone', 'Goal Almost Complete: ' || LEFT(g.name, 30),
+               format(%(t_goal)s, g.name,
+                      round(g.current_amount * 100.0 / g.target_amount),
+                      {_NGN.format('g.target_amount - g.current_amount')}),
+               '&#x1F3AF;'
+        FROM goals g
+        JOIN _retention_users u ON u.id = g.user_id
+        WHERE g.status = 'active' AND g.current_amount > 0 AND g.target_amount > 0
+          AND g.current_amount::float / g.target_amount >= 0.9
+          AND {_not_sent_today('g.user_id', 'Goal Almost')}
+        ORDER BY g.user_id, g.current_amount::float / g.target_amount DESC
+    """),
+    ("weekly", f"""
+        INSERT INTO notifications (user_id, type, title, body, icon)
+        SELECT u.id, 'reminder', 'Weekly Check-in',
+               'New week, fresh start. '
+               || CASE WHEN w.n > 0
+                       THEN format(%(t_weekly)s, w.n, CASE WHEN w.n = 1 THEN '' ELSE 's' END)
+                       ELSE '' END
+               || 'Log your first expense of the week to keep your streak alive!',
+               '&#x1F4C5;'
+        FROM _retention_users u
+        CROSS JOIN LATERAL (
+            SELECT COUNT(*) AS n FROM expenses e
+            WHERE e.user_id = u.id
+              AND e.created_at >= %(last_week_start)s AND e.created_at < %(week_start)s
+        ) w
+        WHERE %(is_monday)s AND {_not_sent_today('u.id', 'Weekly Check')}
+    """),
+    ("no_expenses", f"""
+        INSERT INTO notifications (user_id, type, title, body, icon)
+        SELECT u.id, 'nudge', 'No Expenses Logged Recently',
+               format(%(t_no_expenses)s, %(today)s - x.last_day, x.last_day), '&#x1F4DD;'
+        FROM _retention_users u
+        CROSS JOIN LATERAL (
+            SELECT MAX(e.created_at) AS last_day FROM expenses e WHERE e.user_id = u.id
+        ) x
+        WHERE %(today)s - x.last_day >= 3
+          AND {_not_sent_today('u.id', 'No Expenses')}
+    """),
+    ("month_end", f"""
+        INSERT INTO notifications (user_id, type, title, body, icon)
+        SELECT u.id, 'tip', 'Month-End: Move Your Surplus',
+               format(%(t_month_end)s, {_NGN.format('u.m_income - u.m_spent')},
+                      {_NGN.format('floor((u.m_income - u.m_spent) * 0.3)')}),
+               '&#x1F4B8;'
+        FROM _retention_users u
+        WHERE %(near_month_end)s AND u.m_income > u.m_spent
+          AND {_not_sent_today('u.id', 'Month-End')}
+    """),
+    # Fires once per absence rather than daily: nothing since the last visit.
+    ("welcome_back", f"""
+        INSERT INTO notifications (user_id, type, title, body, icon)
+        SELECT u.id, 'nudge',
+               'Welcome Back — ' || (%(today)s - u.last_active) || ' Days Away',
+               format(%(t_welcome)s, %(today)s - u.last_active)
+               || CASE WHEN u.m_spent > 0
+                       THEN format(%(t_welcome_spent)s, {_NGN.format('u.m_spent')}) ELSE '' END
+               || 'Take a minute to log any expenses you missed.',
+               '&#x1F44B;'
+        FROM _retention_users u
+        WHERE %(today)s - u.last_active >= 7
+          AND NOT EXISTS (
+              SELECT 1 FROM notifications n
+              WHERE n.user_id = u.id AND n.title LIKE 'Welcome Back%%'
+                AND n.created_at > u.last_active
+          )
+    """),
+]
 
 
-def _generate_reminders(user_id: int, today: date) -> None:
+def _generate_reminders(today: date) -> dict:
     """
-    Fetch ALL data needed for every reminder in a single DB round-trip,
-    then build and insert reminders in Python — zero extra queries.
-
-    BEFORE: 8+ separate SELECT calls (one per _already_sent_today check + data query).
-    AFTER:  1 preflight SELECT with CTEs, then INSERT only what fires.
+    Stage per-user facts for every recently active user in one temp table,
+    then run each reminder type as a single INSERT … SELECT.
+    Returns {reminder type: notifications inserted}.
     """
     import calendar as _cal
-    month_start   = today.replace(day=1)
     week_start    = today - timedelta(days=today.weekday())
     days_in_month = _cal.monthrange(today.year, today.month)[1]
-    near_month_end = (days_in_month - today.day) <= 2
-
+    params = {
+        "today":           today,
+        "tomorrow":        today + timedelta(days=1),
+        "three_days":      today + timedelta(days=3),
+        "month_start":     today.replace(day=1),
+        "week_start":      week_start,
+        "last_week_start": week_start - timedelta(days=7),
+        "active_since":    today - timedelta(days=_REMINDER_ACTIVE_DAYS),
+        "is_monday":       today.weekday() == 0,
+        "near_month_end":  (days_in_month - today.day) <= 2,
+        **{f"t_{k}": v for k, v in _REMINDER_TEMPLATES.items()},
+    }
+
+    report = {}
     with get_db() as (conn, cursor):
-
-        # ── Preflight: single query fetches everything needed ─────────────────
-        # 1. Which reminder title-prefixes were already sent today
-        # 2. User's spending limit
-        # 3. Total spent this month
-        # 4. Bills due in next 3 days
-        # 5. Streak row
-        # 6. Active goal ≥ 90% complete
-        # 7. Last expense date
-        # 8. Last login date (for re-engagement)
-        # 9. Monthly income/spend (for month-end nudge)
-        # 10. Last week expense count (for Monday check-in)
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (_RETENTION_LOCK_KEY,))
+        # Month totals: one grouped pass over this month's transactions.
         cursor.execute("""
-            WITH sent_today AS (
-                SELECT DISTINCT LEFT(title, 20) AS prefix
-                FROM notifications
-                WHERE user_id = %(uid)s AND created_at::DATE = %(today)s
-            ),
-            user_data AS (
-                SELECT monthly_spending_limit, last_login
-                FROM users WHERE id = %(uid)s
-            ),
-            monthly_spend AS (
-                SELECT COALESCE(SUM(CASE WHEN t.type='debit'  THEN t.amount ELSE 0 END),0) AS spent,
-                       COALESCE(SUM(CASE WHEN t.type='credit' THEN t.amount ELSE 0 END),0) AS income
-                FROM transactions t JOIN banks b ON t.bank_id=b.id
-                WHERE b.user_id=%(uid)s AND t.created_at >= %(month_start)s
-            ),
-            bills_due AS (
-                SELECT name, amount, next_due
-                FROM recurring_items
-                WHERE user_id=%(uid)s AND active=1
-                  AND next_due IS NOT NULL
-                  AND next_due BETWEEN %(today)s AND %(three_days)s
-                ORDER BY next_due LIMIT 3
-            ),
-            streak_row AS (
-                SELECT last_active_date, current_streak
-                FROM user_streaks WHERE user_id=%(uid)s
-            ),
-            near_goal AS (
-                SELECT name, target_amount, current_amount
-                FROM goals
-                WHERE user_id=%(uid)s AND status='active'
-                  AND current_amount > 0 AND target_amount > 0
-                  AND (current_amount::float/target_amount) >= 0.9
-                ORDER BY (current_amount::float/target_amount) DESC LIMIT 1
-            ),
-            last_expense AS (
-                SELECT MAX(e.created_at) AS last_date
-                FROM expenses e JOIN banks b ON e.bank_id=b.id
-                WHERE b.user_id=%(uid)s
-            ),
-            last_week_count AS (
-                SELECT COUNT(*) AS n
-                FROM expenses e JOIN banks b ON e.bank_id=b.id
-                WHERE b.user_id=%(uid)s AND e.created_at >= %(last_week_start)s
-                  AND e.created_at < %(week_start)s
-            )
-            SELECT
-                (SELECT json_agg(prefix) FROM sent_today)             AS sent_prefixes,
-                (SELECT monthly_spending_limit FROM user_data)         AS spending_limit,
-                (SELECT last_login FROM user_data)                     AS last_login,
-                (SELECT spent FROM monthly_spend)                      AS m_spent,
-                (SELECT income FROM monthly_spend)                     AS m_income,
-                (SELECT json_agg(bills_due) FROM bills_due)            AS bills,
-                (SELECT last_active_date FROM streak_row)              AS streak_date,
-                (SELECT current_streak FROM streak_row)                AS streak_curr,
-                (SELECT row_to_json(near_goal) FROM near_goal)         AS goal_row,
-                (SELECT last_date FROM last_expense)                   AS last_exp_date,
-                (SELECT n FROM last_week_count)                        AS last_week_n
-        """, {
-            "uid":            user_id,
-            "today":          today,
-            "month_start":    month_start,
-            "three_days":     today + timedelta(days=3),
-            "week_start":     week_start,
-            "last_week_start": week_start - timedelta(days=7),
-        })
-        pf = cursor.fetchone()
-
-        # Parse preflight results
-        sent_today_prefixes = set(pf["sent_prefixes"] or [])
-        spending_limit      = int(pf["spending_limit"] or 0)
-        last_login          = pf["last_login"]
-        m_spent             = int(pf["m_spent"] or 0)
-        m_income            = int(pf["m_income"] or 0)
-        bills               = pf["bills"] or []          # list of dicts
-        streak_date         = pf["streak_date"]
-        streak_curr         = int(pf["streak_curr"] or 0)
-        goal_row            = pf["goal_row"]             # dict or None
-        last_exp_date       = pf["last_exp_date"]
-        last_week_n         = int(pf["last_week_n"] or 0)
-
-        def _already_sent(prefix: str) -> bool:
-            """Check against in-memory set — no extra DB calls."""
-            return any(p.startswith(prefix[:20]) for p in sent_today_prefixes)
-
-        def _insert(ntype, title, body, icon):
-            cursor.execute("""
-                INSERT INTO notifications (user_id, type, title, body, icon)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (user_id, ntype, title, body, icon))
-
-        # ── 1. Bills due in next 3 days ────────────────────────────────────────
-        if bills and not _already_sent("Bill Due"):
-            for bill in bills:
-                days_away = (bill["next_due"] - today).days if isinstance(bill["next_due"], date) else (
-                    (__import__("datetime").date.fromisoformat(str(bill["next_due"])) - today).days
-                )
-                due_label = "today" if days_away == 0 else f"in {days_away} day{'s' if days_away != 1 else ''}"
-                _insert("reminder",
-                        f"Bill Due: {bill['name']}",
-                        f"<strong>{bill['name']}</strong> is due {due_label} "
-                        f"({bill['next_due']}) — NGN {int(bill['amount']):,}. "
-                        f"Make sure you have enough balance on the account it will come from.",
-                        "&#x1F514;")
-
-        # ── 2. Budget alerts ────────────────────────────────────────────────────
-        if spending_limit > 0 and not _already_sent("Budget Alert"):
-            pct = m_spent / spending_limit * 100
-            if 50 <= pct < 55:
-                _insert("alert", "Budget Alert: 50% Used",
-                        f"You have spent <strong>NGN {m_spent:,}</strong> — "
-                        f"half your NGN {spending_limit:,} monthly budget. "
-                        f"NGN {spending_limit - m_spent:,} remaining.",
-                        "&#x26A0;&#xFE0F;")
-            elif 80 <= pct < 85:
-                _insert("alert", "Budget Alert: 80% Used",
-                        f"You have used <strong>{pct:.0f}% of your monthly budget</strong> "
-                        f"(NGN {m_spent:,} of NGN {spending_limit:,}). "
-                        f"Only NGN {spending_limit - m_spent:,} left — slow down.",
-                        "&#x1F6A8;")
-            elif pct >= 100:
-                _insert("alert", "Budget Alert: Limit Exceeded",
-                        f"You have exceeded your NGN {spending_limit:,} monthly budget by "
-                        f"<strong>NGN {m_spent - spending_limit:,}</strong>. "
-                        f"Review your expenses and pause non-essential spending.",
-                        "&#x1F534;")
-
-        # ── 3. Streak broken ────────────────────────────────────────────────────
-        if streak_date and not _already_sent("Streak Broken"):
-            gap = (today - streak_date).days
-            if gap == 2 and streak_curr >= 3:
-                _insert("nudge", "Streak Broken — Come Back!",
-                        f"Your {streak_curr}-day tracking streak ended yesterday. "
-                        f"Don't let it stop you — start a new one today. "
-                        f"Log one expense now to get back on track.",
-                        "&#x1F614;")
-
-        # ── 4. Goal almost reached ──────────────────────────────────────────────
-        if goal_row and not _already_sent("Goal Almost"):
-            remaining = int(goal_row["target_amount"]) - int(goal_row["current_amount"])
-            pct_done  = round(int(goal_row["current_amount"]) / int(goal_row["target_amount"]) * 100)
-            _insert("milestone",
-                    f"Goal Almost Complete: {goal_row['name'][:30]}",
-                    f"Your <strong>{goal_row['name']}</strong> goal is "
-                    f"<strong>{pct_done}% complete</strong>! "
-                    f"Just NGN {remaining:,} left. One more contribution and you are done!",
-                    "&#x1F3AF;")
-
-        # ── 5. Monday check-in ──────────────────────────────────────────────────
-        if today.weekday() == 0 and not _already_sent("Weekly Check"):
-            _insert("reminder", "Weekly Check-in",
-                    f"New week, fresh start. "
-                    + (f"You logged {last_week_n} expense{'s' if last_week_n != 1 else ''} last week. "
-                       if last_week_n > 0 else "")
-                    + "Log your first expense of the week to keep your streak alive!",
-                    "&#x1F4C5;")
-
-        # ── 6. No expenses in 3+ days ───────────────────────────────────────────
-        if last_exp_date and not _already_sent("No Expenses"):
-            # Convert to date if needed
-            exp_date = last_exp_date if isinstance(last_exp_date, date) else last_exp_date.date()
-            days_since = (today - exp_date).days
-            if days_since >= 3:
-                _insert("nudge", "No Expenses Logged Recently",
-                        f"It has been <strong>{days_since} days</strong> since your last expense. "
-                        f"Logging accurately keeps your balance right. "
-                        f"Tap Expenses and add anything you have spent since {exp_date}.",
-                        "&#x1F4DD;")
-
-        # ── 7. Month-end surplus nudge ──────────────────────────────────────────
-        if near_month_end and not _already_sent("Month-End"):
-            net = m_income - m_spent
-            if net > 0:
-                _insert("tip", "Month-End: Move Your Surplus",
-                        f"The month is almost over and you have <strong>NGN {net:,} left</strong>. "
-                        f"Transfer some to a savings goal before new-month expenses arrive. "
-                        f"Even NGN {int(net * 0.3):,} moved now builds a habit.",
-                        "&#x1F4B8;")
-
-        # ── 8. Re-engagement (7+ days away) ────────────────────────────────────
-        if last_login and not _already_sent("Welcome Back"):
-            login_date = last_login if isinstance(last_login, date) else last_login.date()
-            days_away  = (today - login_date).days
-            if days_away >= 7:
-                _insert("nudge",
-                        f"Welcome Back — {days_away} Days Away",
-                        f"Good to see you! You were away for {days_away} days. "
-                        + (f"NGN {m_spent:,} has been spent this month so far. " if m_spent > 0 else "")
-                        + "Take a minute to log any expenses you missed.",
-                        "&#x1F44B;")
+            CREATE TEMP TABLE _retention_users ON COMMIT DROP AS
+            SELECT u.id,
+                   COALESCE(u.monthly_spending_limit, 0) AS spending_limit,
+                   a.last_active,
+                   COALESCE(m.spent, 0)  AS m_spent,
+                   COALESCE(m.income, 0) AS m_income
+            FROM users u
+            JOIN (
+                SELECT user_id, MAX(login_date) AS last_active
+                FROM analytics_logins
+                WHERE login_date >= %(active_since)s
+                GROUP BY user_id
+            ) a ON a.user_id = u.id
+            LEFT JOIN (
+                SELECT t.user_id,
+                       SUM(t.amount) FILTER (WHERE t.type = 'debit')  AS spent,
+                       SUM(t.amount) FILTER (WHERE t.type = 'credit') AS income
+                FROM transactions t
+                WHERE t.created_at >= %(month_start)s
+                GROUP BY t.user_id
+            ) m ON m.user_id = u.id
+            WHERE u.email_verified = 1
+        """, params)
+        cursor.execute("ANALYZE _retention_users")
+        for name, sql in _REMINDER_SQL:
+            cursor.execute(sql, params)
+            report[name] = cursor.rowcount
+    return report
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -508,17 +494,19 @@ def push_notification(user_id: int, ntype: str, title: str, body: str,
             INSERT INTO notifications (user_id, type, title, body, icon)
             VALUES (%s, %s, %s, %s, %s)
         """, (user_id, ntype, title, body, icon))
+    _invalidate_notif_cache(user_id)
 
 
 def get_notifications(user_id: int, unread_only: bool = False, limit: int = 50) -> list:
     """Return list of notification dicts, newest first.
-    Cached for 30 s — invalidated whenever a write happens via _invalidate_notif_cache().
+    Cached for 30 s per inbox version — a write via _invalidate_notif_cache(user_id)
+    makes only that user's next read miss.
     """
-    return _get_notifications_cached(user_id, unread_only, limit)
+    return _get_notifications_cached(user_id, get_version(user_id, NOTIFICATIONS), unread_only, limit)
 
 
 @st.cache_data(ttl=30, show_spinner=False)
-def _get_notifications_cached(user_id: int, unread_only: bool, limit: int) -> list:
+def _get_notifications_cached(user_id: int, version: int, unread_only: bool, limit: int) -> list:
     with get_db() as (conn, cursor):
         if unread_only:
             cursor.execute("""
@@ -538,12 +526,12 @@ def _get_notifications_cached(user_id: int, unread_only: bool, limit: int) -> li
 
 
 def get_unread_count(user_id: int) -> int:
-    """Cached for 30 s — invalidated on any write via _invalidate_notif_cache()."""
-    return _get_unread_count_cached(user_id)
+    """Cached for 30 s per inbox version — see get_notifications()."""
+    return _get_unread_count_cached(user_id, get_version(user_id, NOTIFICATIONS))
 
 
 @st.cache_data(ttl=30, show_spinner=False)
-def _get_unread_count_cached(user_id: int) -> int:
+def _get_unread_count_cached(user_id: int, version: int) -> int:
     with get_db() as (conn, cursor):
         cursor.execute(
             "SELECT COUNT(*) AS n FROM notifications WHERE user_id = %s AND read = 0",
@@ -552,10 +540,9 @@ def _get_unread_count_cached(user_id: int) -> int:
         return int(cursor.fetchone()["n"] or 0)
 
 
-def _invalidate_notif_cache() -> None:
-    """Call after any write to notifications so cached reads reflect the change."""
-    _get_notifications_cached.clear()
-    _get_unread_count_cached.clear()
+def _invalidate_notif_cache(user_id: int) -> None:
+    """Call after any write to a user's notifications — other users' cached inboxes stay."""
+    bump(user_id, NOTIFICATIONS)
 
 
 def mark_notifications_read(user_id: int) -> None:
@@ -564,16 +551,18 @@ def mark_notifications_read(user_id: int) -> None:
             "UPDATE notifications SET read = 1 WHERE user_id = %s AND read = 0",
             (user_id,)
         )
-    _invalidate_notif_cache()
+    _invalidate_notif_cache(user_id)
 
 
 def mark_notification_read(notif_id: int) -> None:
     with get_db() as (conn, cursor):
         cursor.execute(
-            "UPDATE notifications SET read = 1 WHERE id = %s",
+            "UPDATE notifications SET read = 1 WHERE id = %s RETURNING user_id",
             (notif_id,)
         )
-    _invalidate_notif_cache()
+        row = cursor.fetchone()
+    if row:
+        _invalidate_notif_cache(row["user_id"])
 
 
 def clear_all_notifications(user_id: int) -> None:
@@ -582,4 +571,21 @@ def clear_all_notifications(user_id: int) -> None:
             "DELETE FROM notifications WHERE user_id = %s",
             (user_id,)
         )
-    _invalidate_notif_cache()
+    _invalidate_notif_cache(user_id)
+
+
+# ── CLI ───────────────────────────────────────────────────────────────────────
+
+def _cli(argv) -> None:
+    today = (datetime.strptime(argv[argv.index("--date") + 1], "%Y-%m-%d").date()
+             if "--date" in argv else None)
+    report    = run_retention_batch(today)
+    elapsed   = report.pop("elapsed_s")
+    reminders = report.pop("reminders")
+    for key, n in {**report, **reminders}.items():
+        print(f"  {key:<18} {n:>8,}")
+    print(f"Done in {elapsed}s.")
+
+
+if __name__ == "__main__":
+    _cli(sys.argv[1:])
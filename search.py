@@ -0,0 +1,112 @@
+# search.py — one ranked search across a user's money records
+#
+# Matches expense names/categories, transaction descriptions (income,
+# transfers, adjustments), debt names/counterparties/notes and recurring bill
+# names in a single UNION ALL, ranked by pg_trgm word similarity — so typos
+# and partial words still match — then by recency. Every predicate is served
+# by the trigram GIN indexes from migration 13, so latency stays flat as
+# history grows. Without pg_trgm it degrades to unindexed ILIKE, prefix
+# matches ranked first.
+#
+# Public API
+# ──────────
+#   SEARCH_KINDS                                       → ("expense", "income", "transaction", "debt", "bill")
+#   search(user_id, query, limit=20, offset=0, kinds)  → {"results": [...], "has_more": bool}
+#       result: {kind, id, title, detail, amount, day, score}
+from __future__ import annotations
+
+import streamlit as st
+
+from db import get_db
+
+
+SEARCH_KINDS = ("expense", "income", "transaction", "debt", "bill")
+MIN_QUERY_LEN = 2
+
+# kind → (SELECT … with {score} / {match} placeholders, searchable columns)
+_SOURCES = {
+    "expense": ("""
+        SELECT 'expense' AS kind, e.id, e.name AS title, COALESCE(e.category, '') AS detail,
+               e.amount, e.created_at AS day, {score} AS score
+        FROM expenses e
+        WHERE e.user_id = %(uid)s AND ({match})
+    """, ("e.name", "e.category")),
+    "income": ("""
+        SELECT 'income' AS kind, t.id, ltrim(substring(t.description from 8)) AS title,
+               b.bank_name AS detail, t.amount, t.created_at AS day, {score} AS score
+        FROM transactions t JOIN banks b ON b.id = t.bank_id
+        WHERE t.user_id = %(uid)s AND t.type = 'credit'
+          AND t.description LIKE 'Income:%%' AND ({match})
+    """, ("t.description",)),
+    # Expense legs are reported once, as expenses, above.
+    "transaction": ("""
+        SELECT 'transaction' AS kind, t.id, t.description AS title, t.type AS detail,
+               t.amount, t.created_at AS day, {score} AS score
+        FROM transactions t
+        WHERE t.user_id = %(uid)s
+          AND t.description NOT LIKE 'Income:%%' AND t.description NOT LIKE 'Expense:%%'
+          AND ({match})
+    """, ("t.description",)),
+    "debt": ("""
+        SELECT 'debt' AS kind, d.id, d.name AS title, COALESCE(d.counterparty, '') AS detail,
+               d.balance_remaining AS amount, d.due_date AS day, {score} AS score
+        FROM debts d
+        WHERE d.user_id = %(uid)s AND ({match})
+    """, ("d.name", "d.counterparty", "d.notes")),
+    "bill": ("""
+        SELECT 'bill' AS kind, r.id, r.name AS title, r.frequency AS detail,
+               r.amount, r.next_due AS day, {score} AS score
+        FROM recurring_items r
+        WHERE r.user_id = %(uid)s AND ({match})
+    """, ("r.name",)),
+}
+
+
+@st.cache_resource
+def _trigram_available() -> bool:
+    with get_db(readonly=True) as (conn, cursor):
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def _like_pattern(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _source_sql(kind: str, trigram: bool) -> str:
+    sql, columns = _SOURCES[kind]
+    if trigram:
+        match = " OR ".join(f"%(q)s <%% {c} OR {c} ILIKE %(contains)s" for c in columns)
+        score = "GREATEST(" + ", ".join(f"word_similarity(%(q)s, COALESCE({c}, ''))" for c in columns) + ")"
+    else:
+        match = " OR ".join(f"{c} ILIKE %(contains)s" for c in columns)
+        score = ("CASE WHEN " + " OR ".join(f"{c} ILIKE %(prefix)s" for c in columns)
+                 + " THEN 1.0 ELSE 0.5 END")
+    return sql.format(match=match, score=score)
+
+
+def search(user_id: int, query: str, limit: int = 20, offset: int = 0, kinds=None) -> dict:
+    """Best matches first, then most recent. Pass `offset` += limit for the next page."""
+    query = (query or "").strip()
+    kinds = [k for k in (kinds or SEARCH_KINDS) if k in _SOURCES]
+    if len(query) < MIN_QUERY_LEN or not kinds:
+        return {"results": [], "has_more": False}
+
+    trigram = _trigram_available()
+    union   = "\nUNION ALL\n".join(_source_sql(k, trigram) for k in kinds)
+    escaped = _like_pattern(query)
+    with get_db(readonly=True) as (conn, cursor):
+        cursor.execute(f"""
+            SELECT * FROM ({union}) r
+            ORDER BY score DESC, day DESC NULLS LAST, kind, id
+            LIMIT %(limit)s OFFSET %(offset)s
+        """, {
+            "uid":      user_id,
+            "q":        query,
+            "contains": f"%{escaped}%",
+            "prefix":   f"{escaped}%",
+            "limit":    limit + 1,
+            "offset":   offset,
+        })
+        rows = cursor.fetchall()
+    return {"results": rows[:limit], "has_more": len(rows) > limit}
@@ -87,31 +87,25 @@ def _fetch_all_data(user_id: int) -> dict:
     days_so_far = today.day
     days_in_prev= calendar.monthrange(prev_m_end.year, prev_m_end.month)[1]
 
-    with get_db() as (conn, cursor):
+    with get_db(readonly=True) as (conn, cursor):
 
         # ── current month category totals ─────────────────────────────────────
         cursor.execute("""
-            SELECT COALESCE(e.category, e.name) AS cat,
-                   SUM(e.amount)                AS total,
-                   COUNT(*)                     AS cnt,
-                   AVG(e.amount)                AS avg_amt,
-                   MIN(e.amount)                AS min_amt,
-                   MAX(e.amount)                AS max_amt
-            FROM expenses e JOIN banks b ON e.bank_id = b.id
-            WHERE b.user_id = %s AND e.created_at >= %s
-            GROUP BY cat
+            SELECT category                          AS cat,
+                   spent                             AS total,
+                   txn_count                         AS cnt,
+                   spent::float / NULLIF(txn_count, 0) AS avg_amt
+            FROM user_month_category_totals
+            WHERE user_id = %s AND month = %s
         """, (user_id, m_start))
         cur_cats = {r["cat"]: dict(r) for r in cursor.fetchall()}
 
         # ── previous month category totals ───────────────────────────────────
         cursor.execute("""
-            SELECT COALESCE(e.category, e.name) AS cat,
-                   SUM(e.amount) AS total,
-                   COUNT(*)      AS cnt
-            FROM expenses e JOIN banks b ON e.bank_id = b.id
-            WHERE b.user_id = %s AND e.created_at BETWEEN %s AND %s
-            GROUP BY cat
-        """, (user_id, prev_m_start, prev_m_end))
+            SELECT category AS cat, spent AS total, txn_count AS cnt
+            FROM user_month_category_totals
+            WHERE user_id = %s AND month = %s
+        """, (user_id, prev_m_start))
         prev_cats = {r["cat"]: dict(r) for r in cursor.fetchall()}
 
         # ── all expenses this month (for small-purchase analysis) ─────────────
@@ -129,8 +123,8 @@ def _fetch_all_data(user_id: int) -> dict:
             SELECT DATE_TRUNC('month', t.created_at) AS mo,
                    SUM(CASE WHEN t.type='credit' THEN t.amount ELSE 0 END) AS income,
                    SUM(CASE WHEN t.type='debit'  THEN t.amount ELSE 0 END) AS spent
-            FROM transactions t JOIN banks b ON t.bank_id = b.id
-            WHERE b.user_id = %s AND t.created_at >= %s
+            FROM transactions t
+            WHERE t.user_id = %s AND t.created_at >= %s
             GROUP BY mo ORDER BY mo DESC
         """, (user_id, today - timedelta(days=90)))
         monthly_totals = cursor.fetchall()
@@ -0,0 +1,88 @@
+# snapshots.py — per-bank daily money in / out
+#
+# bank_daily_balances (migration 9) holds one row per bank per day with money
+# in, money out and transaction count, kept by statement-level triggers on
+# transactions — a write touches only its own day's row. Charts, summaries and
+# bank reports read one row per day instead of one per transaction.
+#
+# Closing balances are not stored: the closing balance of day D is the bank's
+# live balance minus the net of every later day, so back-dated writes can
+# never leave later days stale.
+#
+# History before the table existed is filled in by the deferred migration 15
+# (`python models.py --deferred 15`). Until it is recorded, daily_source()
+# hands readers an equivalent aggregate over transactions instead. The rebuild
+# can also be run by hand to repair:
+#
+#   python snapshots.py              → rebuild every bank
+#   python snapshots.py --bank 42    → rebuild one bank
+#
+# Public API
+# ──────────
+#   daily_source()                         → FROM-clause source with (user_id, bank_id, day, credit, debit, txn_count)
+#   balance_on(user_id, day)               → int, total closing balance on `day`
+#   rebuild_daily_balances(bank_id=None)   → int, snapshot rows rebuilt
+from __future__ import annotations
+
+import sys
+from datetime import date
+
+import streamlit as st
+
+from db import get_db
+
+
+_BACKFILL_MIGRATION = 15
+
+# Same shape as bank_daily_balances; quals on user_id / day push down into
+# the GROUP BY and use the (user_id, type, created_at) index.
+_LEDGER_DAILY = """(
+    SELECT user_id, bank_id, created_at AS day,
+           SUM(CASE WHEN type = 'credit' THEN amount ELSE 0 END) AS credit,
+           SUM(CASE WHEN type = 'debit'  THEN amount ELSE 0 END) AS debit,
+           COUNT(*) AS txn_count
+    FROM transactions
+    WHERE created_at IS NOT NULL
+    GROUP BY user_id, bank_id, created_at
+) ledger_daily"""
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _backfill_applied() -> bool:
+    with get_db() as (conn, cursor):
+        cursor.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (_BACKFILL_MIGRATION,))
+        return cursor.fetchone() is not None
+
+
+def daily_source() -> str:
+    """The snapshot table once its history is backfilled, else the ledger grouped by day."""
+    return "bank_daily_balances" if _backfill_applied() else _LEDGER_DAILY
+
+
+def balance_on(user_id: int, day: date) -> int:
+    """Sum of every bank's closing balance on `day`: live balances minus the net after it."""
+    with get_db(readonly=True) as (conn, cursor):
+        cursor.execute(f"""
+            SELECT (SELECT COALESCE(SUM(balance), 0) FROM banks WHERE user_id = %s)
+                 - (SELECT COALESCE(SUM(credit - debit), 0) FROM {daily_source()} s
+                    WHERE user_id = %s AND day > %s) AS bal
+        """, (user_id, user_id, day))
+        return int(cursor.fetchone()["bal"] or 0)
+
+
+def rebuild_daily_balances(bank_id: int | None = None) -> int:
+    """Recompute snapshots from transactions for one bank, or all when bank_id is None."""
+    with get_db() as (conn, cursor):
+        cursor.execute("SELECT rebuild_bank_daily_balances(%s) AS n", (bank_id,))
+        return int(cursor.fetchone()["n"] or 0)
+
+
+def _cli(argv) -> None:
+    bank_id = int(argv[argv.index("--bank") + 1]) if "--bank" in argv else None
+    n = rebuild_daily_balances(bank_id)
+    scope = f"bank {bank_id}" if bank_id is not None else "all banks"
+    print(f"Rebuilt {n} daily snapshot row(s) for {scope}.")
+
+
+if __name__ == "__main__":
+    _cli(sys.argv[1:])
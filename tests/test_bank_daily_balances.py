@@ -0,0 +1,95 @@
+# Daily balance snapshots against a real Postgres.
+#
+# Opt-in: writes to the database configured in .streamlit/secrets.toml
+# (SUPABASE_DB_URL), so point that at a scratch database and run
+#
+#   BUDGET_RIGHT_DB_TESTS=1 python -m pytest tests/
+import os
+import sys
+import uuid
+from datetime import date, timedelta
+from pathlib import Path
+
+import pytest
+
+if not os.environ.get("BUDGET_RIGHT_DB_TESTS"):
+    pytest.skip("set BUDGET_RIGHT_DB_TESTS=1 to run database tests", allow_module_level=True)
+pytest.importorskip("streamlit")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import models  # noqa: E402,F401 — applies pending migrations on import
+from db import get_db  # noqa: E402
+from utils import save_expenses  # noqa: E402
+
+
+@pytest.fixture
+def bank():
+    tag = uuid.uuid4().hex[:10]
+    with get_db() as (conn, cursor):
+        cursor.execute("""
+            INSERT INTO users (surname, other_names, email, username, password, allow_overdraft)
+            VALUES ('Test', 'Snapshots', %s, %s, '\\x00', 1) RETURNING id
+        """, (f"{tag}@example.test", f"snap_{tag}"))
+        user_id = cursor.fetchone()["id"]
+        cursor.execute("""
+            INSERT INTO banks (user_id, bank_name, account_name, account_number, balance)
+            VALUES (%s, 'Test Bank', 'Test', '0000000000', 100000) RETURNING id
+        """, (user_id,))
+        bank_id = cursor.fetchone()["id"]
+    yield user_id, bank_id
+    with get_db() as (conn, cursor):
+        cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+
+
+def _snapshot_rows(bank_id):
+    with get_db() as (conn, cursor):
+        cursor.execute("""
+            SELECT day, credit, debit, txn_count FROM bank_daily_balances
+            WHERE bank_id = %s AND (credit <> 0 OR debit <> 0 OR txn_count <> 0)
+            ORDER BY day
+        """, (bank_id,))
+        return [dict(r) for r in cursor.fetchall()]
+
+
+def _closing_from_snapshots(bank_id, day):
+    with get_db() as (conn, cursor):
+        cursor.execute("""
+            SELECT b.balance - COALESCE((
+                SELECT SUM(credit - debit) FROM bank_daily_balances
+                WHERE bank_id = b.id AND day > %s), 0) AS closing
+            FROM banks b WHERE b.id = %s
+        """, (day, bank_id))
+        return int(cursor.fetchone()["closing"])
+
+
+def test_expense_on_a_day_without_a_row_matches_rebuild(bank):
+    user_id, bank_id = bank
+    today     = date.today()
+    back_day  = today - timedelta(days=40)
+    other_day = today - timedelta(days=10)
+
+    # Transaction insert and bank debit in one statement, onto days with no row.
+    ok, _ = save_expenses(user_id, [
+        {"bank_id": bank_id, "name": "Rice", "amount": 7000, "created_at": back_day},
+        {"bank_id": bank_id, "name": "Fuel", "amount": 3000, "created_at": other_day},
+    ])
+    assert ok
+    ok, _ = save_expenses(user_id, [{"bank_id": bank_id, "name": "Bread", "amount": 1500}])
+    assert ok
+
+    by_trigger = _snapshot_rows(bank_id)
+    closings   = {d: _closing_from_snapshots(bank_id, d)
+                  for d in (back_day - timedelta(days=1), back_day, other_day, today)}
+
+    with get_db() as (conn, cursor):
+        cursor.execute("SELECT rebuild_bank_daily_balances(%s)", (bank_id,))
+
+    assert _snapshot_rows(bank_id) == by_trigger
+    assert {d: _closing_from_snapshots(bank_id, d) for d in closings} == closings
+    assert closings == {
+        back_day - timedelta(days=1): 100000,
+        back_day:                     93000,
+        other_day:                    90000,
+        today:                        88500,
+    }
@@ -5,125 +5,317 @@ import streamlit as st
 from datetime import datetime, timedelta
 
 from db import get_db
+from cache_versions import DATA, DATA_CACHE_TTL, DATA_CACHE_ENTRIES, get_version
 
 
 # ── Expense saving ───────────────────────────────────────────────────────────
 
+# One statement does the overdraft check and all three writes: the bank rows
+# are locked (FOR UPDATE), each bank's combined debit is checked against its
+# balance and the user's overdraft setting, and only if every bank passes are
+# the transactions, expenses and balance updates written. Transaction ids are
+# drawn from the sequence up front so each expense can point at its debit.
+# One round trip whether saving one expense or a whole batch.
+_SAVE_EXPENSES_SQL = """
+    WITH input AS (
+        SELECT r.*, nextval(pg_get_serial_sequence('transactions', 'id')) AS tx_id
+        FROM unnest(%(bank_ids)s::int[], %(names)s::text[], %(categories)s::text[],
+                    %(amounts)s::int[], %(days)s::date[])
+             WITH ORDINALITY AS r(bank_id, name, category, amount, day, n)
+    ),
+    need AS (
+        SELECT bank_id, SUM(amount) AS total FROM input GROUP BY bank_id
+    ),
+    bank AS (
+        SELECT b.id, b.bank_name, b.balance, n.total, u.allow_overdraft
+        FROM need n
+        JOIN banks b ON b.id = n.bank_id AND b.user_id = %(uid)s
+        JOIN users u ON u.id = b.user_id
+        FOR UPDATE OF b
+    ),
+    blocked AS (
+        SELECT bank_id FROM need WHERE bank_id NOT IN (SELECT id FROM bank)
+        UNION ALL
+        SELECT id FROM bank WHERE balance - total < 0 AND COALESCE(allow_overdraft, 0) = 0
+    ),
+    tx AS (
+        INSERT INTO transactions (id, user_id, bank_id, type, amount, description, created_at)
+        SELECT tx_id, %(uid)s, bank_id, 'debit', amount, 'Expense: ' || name, day
+        FROM input
+        WHERE NOT EXISTS (SELECT 1 FROM blocked)
+        RETURNING id
+    ),
+    exp AS (
+        INSERT INTO expenses (user_id, bank_id, name, category, amount, created_at, tx_id)
+        SELECT %(uid)s, i.bank_id, i.name, i.category, i.amount, i.day, i.tx_id
+        FROM input i JOIN tx ON tx.id = i.tx_id
+    ),
+    debit AS (
+        UPDATE banks b SET balance = b.balance - bank.total
+        FROM bank
+        WHERE b.id = bank.id AND NOT EXISTS (SELECT 1 FROM blocked)
+    )
+    SELECT NOT EXISTS (SELECT 1 FROM blocked)             AS saved,
+           (SELECT array_agg(tx_id ORDER BY n) FROM input) AS tx_ids,
+           (SELECT COUNT(*) FROM need)                     AS banks_requested,
+           COALESCE((SELECT json_agg(bank) FROM bank), '[]') AS banks
+"""
+
+
+def _save_expenses(user_id, rows):
+    """Run _SAVE_EXPENSES_SQL. Returns (result row, parsed banks list)."""
+    today = datetime.now().date()
+    params = {
+        "uid":        user_id,
+        "bank_ids":   [r["bank_id"] for r in rows],
+        "names":      [r["name"] for r in rows],
+        "categories": [r.get("category") or r["name"] for r in rows],
+        "amounts":    [int(r["amount"]) for r in rows],
+        "days":       [r.get("created_at") or today for r in rows],
+    }
+    with get_db() as (conn, cursor):
+        cursor.execute(_SAVE_EXPENSES_SQL, params)
+        result = cursor.fetchone()
+    return result, result["banks"] or []
+
+
+def _shortfall_message(bank, single):
+    balance, total = int(bank["balance"]), int(bank["total"])
+    what = "this expense is" if single else "these expenses total"
+    return (
+        f"Insufficient funds. Your {'' if single else bank['bank_name'] + ' '}balance is NGN {balance:,} "
+        f"but {what} NGN {total:,} — NGN {total - balance:,} short. "
+        f"Enable overdraft in Settings if you want to allow this."
+    )
+
+
 def save_expense(user_id, bank_id, name, amount, category=None):
     """
     Inserts an expense + debit transaction, debits bank balance.
     Checks overdraft: if the bank would go negative and user has not enabled
-    overdraft, raises ValueError so callers can show a clear error.
+    overdraft, nothing is written.
     Returns (True, tx_id) on success, (False, reason_str) on failure.
     """
-    today = datetime.now().date()
-    amt   = int(amount)
-    cat   = category or name
     try:
-        with get_db() as (conn, cursor):
-            # Check overdraft permission
-            cursor.execute("SELECT balance FROM banks WHERE id=%s AND user_id=%s", (bank_id, user_id))
-            bank_row = cursor.fetchone()
-            if not bank_row:
-                return False, "Bank account not found."
-            if bank_row["balance"] - amt < 0:
-                # Check if user has overdraft enabled
-                cursor.execute("SELECT allow_overdraft FROM users WHERE id=%s", (user_id,))
-                user_row = cursor.fetchone()
-                if not user_row or not user_row["allow_overdraft"]:
-                    shortfall = amt - bank_row["balance"]
-                    return False, (
-                        f"Insufficient funds. Your balance is NGN {bank_row['balance']:,} "
-                        f"but this expense is NGN {amt:,} — NGN {shortfall:,} short. "
-                        f"Enable overdraft in Settings if you want to allow this."
-                    )
-            cursor.execute(
-                "INSERT INTO transactions (bank_id, type, amount, description, created_at) "
-                "VALUES (%s, 'debit', %s, %s, %s) RETURNING id",
-                (bank_id, amt, f"Expense: {name}", today)
-            )
-            tx_id = cursor.fetchone()["id"]
-            cursor.execute(
-                "INSERT INTO expenses (user_id, bank_id, name, category, amount, created_at, tx_id) "
-                "VALUES (%s, %s, %s, %s, %s, %s, %s)",
-                (user_id, bank_id, name, cat, amt, today, tx_id)
-            )
-            cursor.execute(
-                "UPDATE banks SET balance = balance - %s WHERE id=%s",
-                (amt, bank_id)
-            )
-        return True, tx_id
+        result, banks = _save_expenses(
+            user_id, [{"bank_id": bank_id, "name": name, "amount": amount, "category": category}]
+        )
     except Exception as e:
         return False, str(e)
+    if result["saved"]:
+        return True, result["tx_ids"][0]
+    if not banks:
+        return False, "Bank account not found."
+    return False, _shortfall_message(banks[0], single=True)
 
 
-# ── Filter / sort helpers ────────────────────────────────────────────────────
-
-def apply_income_filters(income_data):
-    """Apply search, bank filter, date range, and sort to income list."""
-    results = list(income_data)
-
-    search = st.session_state.income_search.strip().lower()
+def save_expenses(user_id, rows):
+    """
+    Bulk save_expense: rows are dicts with bank_id, name, amount and optional
+    category / created_at (defaults: name / today). All-or-nothing — the
+    overdraft check runs once per bank on the combined amount.
+    Returns (True, [tx_id, …] in row order) or (False, reason_str).
+    """
+    rows = list(rows)
+    if not rows:
+        return True, []
+    try:
+        result, banks = _save_expenses(user_id, rows)
+    except Exception as e:
+        return False, str(e)
+    if result["saved"]:
+        return True, list(result["tx_ids"])
+    if len(banks) < result["banks_requested"]:
+        return False, "Bank account not found."
+    short = [b for b in banks if int(b["balance"]) - int(b["total"]) < 0 and not b["allow_overdraft"]]
+    return False, " ".join(_shortfall_message(b, single=False) for b in short)
+
+
+# ── Filter / sort → SQL ──────────────────────────────────────────────────────
+# Income History and Expense Summary used to load the user's whole history and
+# filter/sort it in Python on every rerun (every search keystroke included).
+# The session-state filters now compile to one parameterised WHERE clause,
+# totals are aggregated by Postgres, and rows come a page at a time with keyset
+# pagination — (sort value, id) of the last row shown — so a click reads about
+# HISTORY_PAGE_SIZE rows however long the history is. These read the primary:
+# the page renders them on the rerun right after a save, which a lagging
+# replica would miss.
+
+HISTORY_PAGE_SIZE = 50
+
+_SORT_COLUMNS = {
+    "Newest First":   ("created_at", "DESC"),
+    "Oldest First":   ("created_at", "ASC"),
+    "Highest Amount": ("amount",     "DESC"),
+    "Lowest Amount":  ("amount",     "ASC"),
+}
+
+
+def _like_pattern(text):
+    """Substring pattern for ILIKE, with the user's % and _ taken literally."""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def income_filter_sql():
+    """(WHERE fragment, params) for the Income History filters — aliases t, b."""
+    ss = st.session_state
+    where, params = [], []
+    search = ss.income_search.strip()
     if search:
-        results = [r for r in results if search in r["description"].lower() or search in r["bank_name"].lower()]
-
-    bank_f = st.session_state.income_filter_bank
-    if bank_f and bank_f != "All":
-        results = [r for r in results if r["bank_name"] == bank_f]
-
-    if st.session_state.income_filter_date_from:
-        results = [r for r in results if r["created_at"] >= st.session_state.income_filter_date_from]
-    if st.session_state.income_filter_date_to:
-        results = [r for r in results if r["created_at"] <= st.session_state.income_filter_date_to]
-
-    sort_key = st.session_state.income_sort
-    if sort_key == "Newest First":
-        results = sorted(results, key=lambda r: r["created_at"], reverse=True)
-    elif sort_key == "Oldest First":
-        results = sorted(results, key=lambda r: r["created_at"])
-    elif sort_key == "Highest Amount":
-        results = sorted(results, key=lambda r: r["amount"], reverse=True)
-    elif sort_key == "Lowest Amount":
-        results = sorted(results, key=lambda r: r["amount"])
-
-    return results
-
-
-def apply_expense_filters(expenses_data):
-    """Apply search, bank, category, date range, and sort to expense list."""
-    results = list(expenses_data)
-
-    search = st.session_state.exp_search.strip().lower()
+        where.append("(t.description ILIKE %s OR b.bank_name ILIKE %s)")
+        params += [_like_pattern(search)] * 2
+    if ss.income_filter_bank and ss.income_filter_bank != "All":
+        where.append("b.bank_name = %s")
+        params.append(ss.income_filter_bank)
+    if ss.income_filter_date_from:
+        where.append("t.created_at >= %s")
+        params.append(ss.income_filter_date_from)
+    if ss.income_filter_date_to:
+        where.append("t.created_at <= %s")
+        params.append(ss.income_filter_date_to)
+    return " AND ".join(where) or "TRUE", params
+
+
+def expense_filter_sql():
+    """(WHERE fragment, params) for the Expense Summary filters — aliases e, b."""
+    ss = st.session_state
+    where, params = [], []
+    search = ss.exp_search.strip()
     if search:
-        results = [r for r in results if
-                   search in (r["name"] or "").lower() or
-                   search in (r["category"] or "").lower() or
-                   search in r["bank_name"].lower()]
+        where.append("(e.name ILIKE %s OR e.category ILIKE %s OR b.bank_name ILIKE %s)")
+        params += [_like_pattern(search)] * 3
+    if ss.exp_filter_bank and ss.exp_filter_bank != "All":
+        where.append("b.bank_name = %s")
+        params.append(ss.exp_filter_bank)
+    if ss.exp_filter_category and ss.exp_filter_category != "All":
+        where.append("COALESCE(NULLIF(e.category, ''), e.name) = %s")
+        params.append(ss.exp_filter_category)
+    if ss.exp_filter_date_from:
+        where.append("e.created_at >= %s")
+        params.append(ss.exp_filter_date_from)
+    if ss.exp_filter_date_to:
+        where.append("e.created_at <= %s")
+        params.append(ss.exp_filter_date_to)
+    return " AND ".join(where) or "TRUE", params
+
+
+_HISTORY = {
+    "income": {
+        "alias":   "t",
+        "sort":    "income_sort",
+        "filters": income_filter_sql,
+        "columns": "t.id, t.created_at, t.description, t.amount, t.bank_id, b.bank_name, b.account_number",
+        "from":    "FROM transactions t JOIN banks b ON t.bank_id = b.id "
+                   "WHERE t.user_id = %s AND t.type = 'credit' AND t.description LIKE 'Income:%%'",
+    },
+    "expenses": {
+        "alias":   "e",
+        "sort":    "exp_sort",
+        "filters": expense_filter_sql,
+        "columns": "e.id, e.created_at, e.name, e.category, e.amount, "
+                   "e.bank_id, b.bank_name, b.account_number, e.tx_id",
+        "from":    "FROM expenses e JOIN banks b ON e.bank_id = b.id WHERE e.user_id = %s",
+    },
+}
+
+
+def fetch_history_page(kind, user_id, limit=HISTORY_PAGE_SIZE):
+    """
+    The current page of "income" or "expenses" rows for the filters and sort in
+    session_state. Changing either returns to page 1.
+    Returns {rows, has_more, next_key, page, count, total, count_all} —
+    count/total over every filtered row, count_all over the unfiltered history.
+    """
+    spec = _HISTORY[kind]
+    a    = spec["alias"]
+    filters, f_params = spec["filters"]()
+    col, direction    = _SORT_COLUMNS.get(st.session_state[spec["sort"]], _SORT_COLUMNS["Newest First"])
+
+    ss  = st.session_state
+    sig = repr((filters, f_params, col, direction))
+    if ss.get(f"_{kind}_page_sig") != sig:
+        ss[f"_{kind}_page_sig"], ss[f"_{kind}_page_keys"] = sig, []
+    keys  = ss[f"_{kind}_page_keys"]
+    after = keys[-1] if keys else None
+
+    keyset, k_params = "TRUE", []
+    if after is not None:
+        keyset   = f"({a}.{col}, {a}.id) {'<' if direction == 'DESC' else '>'} (%s, %s)"
+        k_params = list(after)
 
-    bank_f = st.session_state.exp_filter_bank
-    if bank_f and bank_f != "All":
-        results = [r for r in results if r["bank_name"] == bank_f]
+    with get_db() as (conn, cursor):
+        cursor.execute(f"""
+            SELECT COUNT(*)                                    AS count_all,
+                   COUNT(*) FILTER (WHERE {filters})           AS count,
+                   COALESCE(SUM({a}.amount) FILTER (WHERE {filters}), 0) AS total
+            {spec["from"]}
+        """, f_params + f_params + [user_id])
+        totals = cursor.fetchone()
+
+        cursor.execute(f"""
+            SELECT {spec["columns"]}
+            {spec["from"]} AND {filters} AND {keyset}
+            ORDER BY {a}.{col} {direction}, {a}.id {direction}
+            LIMIT %s
+        """, [user_id] + f_params + k_params + [limit + 1])
+        rows = cursor.fetchall()
+
+    has_more = len(rows) > limit
+    rows     = rows[:limit]
+    return {
+        "rows":      rows,
+        "has_more":  has_more,
+        "next_key":  (rows[-1][col], rows[-1]["id"]) if rows else None,
+        "page":      len(keys) + 1,
+        "count":     int(totals["count"]),
+        "total":     int(totals["total"]),
+        "count_all": int(totals["count_all"]),
+    }
 
-    cat_f = st.session_state.exp_filter_category
-    if cat_f and cat_f != "All":
-        results = [r for r in results if (r["category"] or r["name"]) == cat_f]
 
-    if st.session_state.exp_filter_date_from:
-        results = [r for r in results if r["created_at"] >= st.session_state.exp_filter_date_from]
-    if st.session_state.exp_filter_date_to:
-        results = [r for r in results if r["created_at"] <= st.session_state.exp_filter_date_to]
+def render_history_pager(kind, page):
+    """Previous / Next controls under a fetch_history_page() list."""
+    if page["page"] == 1 and not page["has_more"]:
+        return
+    keys = st.session_state[f"_{kind}_page_keys"]
+    first = (page["page"] - 1) * HISTORY_PAGE_SIZE + 1
+    prev_col, info_col, next_col = st.columns([1, 2, 1])
+    with prev_col:
+        if st.button("← Previous", key=f"{kind}_page_prev", disabled=page["page"] == 1):
+            keys.pop()
+            st.rerun()
+    with info_col:
+        st.caption(f"Page {page['page']} · entries {first}–{first + len(page['rows']) - 1} of {page['count']}")
+    with next_col:
+        if st.button("Next →", key=f"{kind}_page_next", disabled=not page["has_more"]):
+            keys.append(page["next_key"])
+            st.rerun()
+
+
+def has_income_history(user_id):
+    with get_db() as (conn, cursor):
+        cursor.execute("""
+            SELECT EXISTS (
+                SELECT 1 FROM transactions
+                WHERE user_id = %s AND type = 'credit' AND description LIKE 'Income:%%'
+            ) AS found
+        """, (user_id,))
+        return bool(cursor.fetchone()["found"])
 
-    sort_key = st.session_state.exp_sort
-    if sort_key == "Newest First":
-        results = sorted(results, key=lambda r: r["created_at"], reverse=True)
-    elif sort_key == "Oldest First":
-        results = sorted(results, key=lambda r: r["created_at"])
-    elif sort_key == "Highest Amount":
-        results = sorted(results, key=lambda r: r["amount"], reverse=True)
-    elif sort_key == "Lowest Amount":
-        results = sorted(results, key=lambda r: r["amount"])
 
-    return results
+def get_expense_category_totals(user_id):
+    """[(category, all-time spent)] from the monthly rollup, largest first."""
+    with get_db() as (conn, cursor):
+        cursor.execute("""
+            SELECT category, SUM(spent) AS amount
+            FROM user_month_category_totals
+            WHERE user_id = %s
+            GROUP BY category
+            HAVING SUM(spent) > 0
+            ORDER BY amount DESC
+        """, (user_id,))
+        return [(r["category"], int(r["amount"])) for r in cursor.fetchall()]
 
 
 def render_filter_bar_income(banks):
@@ -287,14 +479,15 @@ def get_category_budgets(user_id):
     """
     Load all category budgets for user and compute how much has been
     spent in each category this month.
-    Cached for 60 seconds — re-fetches after any expense is added.
+    Cached per data version — re-fetches on the first rerun after any write.
     """
-    return _get_category_budgets_cached(user_id, datetime.now().date().isoformat())
+    return _get_category_budgets_cached(user_id, get_version(user_id, DATA),
+                                        datetime.now().date().isoformat())
 
 
-@st.cache_data(ttl=60, show_spinner=False)
-def _get_category_budgets_cached(user_id, _date_key):
-    """Inner cached version — _date_key forces daily cache invalidation."""
+@st.cache_data(ttl=DATA_CACHE_TTL, max_entries=DATA_CACHE_ENTRIES, show_spinner=False)
+def _get_category_budgets_cached(user_id, version, date_key):
+    """Inner cached version — date_key forces daily cache invalidation."""
     today = datetime.now().date()
     month_start = today.replace(day=1)
 
@@ -309,14 +502,12 @@ def _get_category_budgets_cached(user_id, _date_key):
         if not budgets:
             return []
 
-        cursor.execute("""
-            SELECT COALESCE(e.category, e.name) AS cat, SUM(e.amount) AS total
-            FROM expenses e
-            JOIN banks b ON e.bank_id = b.id
-            WHERE b.user_id = %s AND e.created_at >= %s
-            GROUP BY cat
-        """, (user_id, month_start))
-        spent_map = {r["cat"]: int(r["total"]) for r in cursor.fetchall()}
+        cursor.execute(
+            "SELECT category, spent FROM user_month_category_totals "
+            "WHERE user_id = %s AND month = %s",
+            (user_id, month_start)
+        )
+        spent_map = {r["category"]: int(r["spent"]) for r in cursor.fetchall()}
 
     result = []
     for cat, limit in budgets.items():
@@ -341,11 +532,12 @@ def compute_daily_safe_to_spend(user_id, spending_limit):
     """
     if not spending_limit:
         return None
-    return _compute_daily_cached(user_id, spending_limit, datetime.now().date().isoformat())
+    return _compute_daily_cached(user_id, get_version(user_id, DATA), spending_limit,
+                                 datetime.now().date().isoformat())
 
 
-@st.cache_data(ttl=60, show_spinner=False)
-def _compute_daily_cached(user_id, spending_limit, _date_key):
+@st.cache_data(ttl=DATA_CACHE_TTL, max_entries=DATA_CACHE_ENTRIES, show_spinner=False)
+def _compute_daily_cached(user_id, version, spending_limit, date_key):
     import calendar
     today          = datetime.now().date()
     month_start    = today.replace(day=1)
@@ -355,8 +547,7 @@ def _compute_daily_cached(user_id, spending_limit, _date_key):
     with get_db() as (conn, cursor):
         cursor.execute("""
             SELECT COALESCE(SUM(t.amount), 0) AS n FROM transactions t
-            JOIN banks b ON t.bank_id = b.id
-            WHERE b.user_id = %s AND t.type = 'debit' AND t.created_at >= %s
+            WHERE t.user_id = %s AND t.type = 'debit' AND t.created_at >= %s
         """, (user_id, month_start))
         spent = int(cursor.fetchone()["n"] or 0)
 